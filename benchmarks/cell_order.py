@@ -0,0 +1,90 @@
+"""
+Benchmark of reordering cats data in grid cell order: `compute_states` time with and without reordering.
+
+Usage:
+    python -m benchmarks.cell_order --N 1000000 5000000 --out cell_order.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.simulation import Simulation
+
+
+def run_case(sim: Simulation, reorder_interval: int, warmup: int, steps: int) -> dict:
+    sim.restart()
+    sim.reorder_interval = reorder_interval
+    for _ in range(warmup):
+        sim.step()
+    if reorder_interval > 0:
+        sim.reorder()  # Compile reordering kernels before measuring
+
+    compute_ms = []
+    reorder_ms = []
+    for _ in range(steps):
+        sim.move()
+        if reorder_interval > 0 and sim.steps_done % reorder_interval == 0:
+            reorder_ms.append(measure(sim.reorder))
+        compute_ms.append(measure(sim.update_states))
+        sim.steps_done += 1
+
+    compute_avg = sum(compute_ms) / steps
+    # Cost of reordering is amortized over the interval
+    reorder_avg = sum(reorder_ms) / steps
+    return {
+        "reorder_interval": reorder_interval,
+        "compute_states_ms": compute_avg,
+        "reorder_ms_amortized": reorder_avg,
+        "total_ms": compute_avg + reorder_avg,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[1_000_000, 5_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument(
+        "--intervals",
+        type=int,
+        nargs="+",
+        default=[0, 1, 10, 50],
+        help="Reorder intervals to compare, 0 means no reordering",
+    )
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--out", default="cell_order.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {
+            "X": args.side,
+            "Y": args.side,
+            "N": n,
+            "R0": args.R0,
+            "R1": args.R1,
+            "init_opt": 0,
+        }
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        for interval in args.intervals:
+            case = {**params, **run_case(sim, interval, args.warmup, args.steps)}
+            results.append(case)
+            print(
+                "N={N:>8} interval={reorder_interval:>3}: compute_states "
+                "{compute_states_ms:9.3f} ms, reorder {reorder_ms_amortized:8.3f} ms/step, "
+                "total {total_ms:9.3f} ms".format(**case)
+            )
+
+    meta = metadata("cell_order", warmup=args.warmup, steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark of clustered distributions: `compute_states` time and share of correct states when all cats
+start in the corner strip (`init_opt=1`), so almost all cats are in one or two cells of the grid.
+
+Usage:
+    python -m benchmarks.clustered --N 10000 100000 1000000 --out clustered.json
+"""
+
+import argparse
+
+import taichi as ti
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.common import STATE_IDLE, STATE_INTERACT, STATE_INTERSECTION, TESTING_MODE
+from catradar.grid_manager import _calc_dist
+from catradar.simulation import Simulation
+
+# Requirement from arch.md: states of 95% of cats must be determined correctly
+CORRECT_SHARE = 0.95
+
+
+@ti.kernel
+def exact_states(
+    N: ti.i32,
+    R0: ti.f32,
+    R1: ti.f32,
+    positions: ti.template(),
+    states: ti.template(),
+    norm_func: ti.i32,
+):
+    """
+    Computes states by checking all pairs of cats, interaction happens with probability 1 as in TESTING_MODE.
+    """
+    for i in range(N):
+        state = STATE_IDLE
+        for j in range(N):
+            if i != j and state != STATE_INTERSECTION:
+                dist = _calc_dist(positions[i], positions[j], norm_func)
+                if dist <= R0:
+                    state = STATE_INTERSECTION
+                elif dist <= R1:
+                    state = STATE_INTERACT
+        states[i] = state
+
+
+def correct_share(sim: Simulation, expected) -> float:
+    exact_states(
+        sim.N,
+        sim.params["R0"],
+        sim.params["R1"],
+        sim.positions,
+        expected,
+        sim.norm_func,
+    )
+    return float((expected.to_numpy() == sim.states.to_numpy()).mean())
+
+
+def run_case(sim: Simulation, norm: int, steps: int, check: bool) -> dict:
+    sim.restart()
+    sim.norm_func = norm
+    sim.update_states()  # Compile kernels before measuring
+    sim.restart()
+
+    expected = ti.field(dtype=ti.i32, shape=sim.N) if check else None
+    compute_ms = [measure(sim.update_states)]
+    first_share = correct_share(sim, expected) if check else None
+    for _ in range(steps - 1):
+        sim.move()
+        compute_ms.append(measure(sim.update_states))
+    last_share = correct_share(sim, expected) if check else None
+
+    return {
+        "norm": norm,
+        "compute_states_ms": sum(compute_ms) / steps,
+        "max_compute_states_ms": max(compute_ms),
+        "correct_share_first": first_share,
+        "correct_share_last": last_share,
+        "correct_ok": None
+        if not check
+        else min(first_share, last_share) >= CORRECT_SHARE,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--side", type=float, default=1000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--norm", type=int, nargs="+", default=[0])
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument(
+        "--check-limit",
+        type=int,
+        default=100_000,
+        help="Largest N for which states are checked against all pairs of cats",
+    )
+    parser.add_argument("--out", default="clustered.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {
+            "X": args.side,
+            "Y": args.side,
+            "N": n,
+            "R0": args.R0,
+            "R1": args.R1,
+            "init_opt": 1,
+        }
+        if sim is None:
+            sim = Simulation(params, mode=TESTING_MODE)
+        else:
+            sim.reset(params)
+        for norm in args.norm:
+            case = {**params, **run_case(sim, norm, args.steps, n <= args.check_limit)}
+            results.append(case)
+            print(
+                "N={N:>8} norm={norm}: compute_states {compute_states_ms:9.3f} ms "
+                "(max {max_compute_states_ms:9.3f} ms), correct {correct_share_first} "
+                "-> {correct_share_last}".format(**case)
+            )
+
+    meta = metadata("clustered", steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
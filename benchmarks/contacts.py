@@ -0,0 +1,79 @@
+"""
+Benchmark of contact lists: count of contacts, memory of the CSR list against the former fixed matrix
+of 10 intersections per cat, and time of building contacts and of steps with the colliding pattern.
+
+Usage:
+    python -m benchmarks.contacts --N 100000 1000000 --out contacts.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar import contacts, field_pool
+from catradar.common import MOVE_PATTERN_COLLIDING
+from catradar.simulation import Simulation
+
+# Shape of the former matrix of intersections: count and ids of the first 10 intersections per cat
+MATRIX_COLUMNS = 11
+
+
+def run_case(sim: Simulation, warmup: int, steps: int) -> dict:
+    sim.movement_pattern = MOVE_PATTERN_COLLIDING
+    sim.step(warmup)  # Compile kernels before measuring
+    build_ms = []
+    step_ms = []
+    for _ in range(steps):
+        step_ms.append(measure(sim.step))
+        build_ms.append(
+            measure(lambda: contacts.build_contacts(sim.positions, sim.norm_func))
+        )
+
+    total = int(contacts.contact_start[sim.N])
+    memory = field_pool.memory_report()
+    return {
+        "contacts": total,
+        "contacts_per_cat": total / sim.N,
+        "build_contacts_ms": sum(build_ms) / steps,
+        "step_ms": sum(step_ms) / steps,
+        "contacts_mb": memory["contacts"]["allocated_mb"]
+        + memory["contact_ids"]["allocated_mb"],
+        "matrix_mb": sim.N * MATRIX_COLUMNS * 4 / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="contacts.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {"X": args.side, "Y": args.side, "N": n, "R0": args.R0, "R1": args.R1}
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        case = {**params, **run_case(sim, args.warmup, args.steps)}
+        results.append(case)
+        print(
+            "N={N:>8}: {contacts:>9} contacts ({contacts_per_cat:.2f} per cat), "
+            "list {contacts_mb:8.2f} MB vs matrix {matrix_mb:8.2f} MB, "
+            "build_contacts {build_contacts_ms:8.3f} ms, step {step_ms:9.3f} ms".format(
+                **case
+            )
+        )
+
+    meta = metadata("contacts", warmup=args.warmup, steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
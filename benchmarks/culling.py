@@ -0,0 +1,95 @@
+"""
+Benchmark of the draw path without a window: time of compacting visible cats by `update_colors`
+for views of different size and of filling the heatmap drawn instead of cats when the camera is far.
+
+Usage:
+    python -m benchmarks.culling --N 1000000 5000000 --out culling.json
+"""
+
+import argparse
+
+import taichi as ti
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar import canvas, field_pool
+from catradar.simulation import Simulation
+
+NORM_RATIO = 1000
+
+# Share of the side of the field seen by the camera, the view is in the center of the field
+VIEWS = [1.0, 0.3, 0.1, 0.01]
+
+
+def run_case(sim: Simulation, view: float, steps: int) -> dict:
+    p = sim.params
+    center = ti.math.vec2(p["X"], p["Y"]) / 2
+    half = ti.math.vec2(p["X"], p["Y"]) * view / 2
+    lo, hi = center - half, center + half
+
+    def update_colors():
+        canvas.update_colors(
+            sim.positions,
+            sim.states,
+            -1,
+            sim.N,
+            lo,
+            hi,
+            100,
+            NORM_RATIO,
+            field_pool.generation(),
+        )
+
+    def update_heatmap():
+        canvas.update_heatmap(
+            sim.positions, sim.states, sim.N, lo, hi, field_pool.generation()
+        )
+
+    update_colors()  # Compile kernels before measuring
+    update_heatmap()
+    colors_ms = [measure(update_colors) for _ in range(steps)]
+    heatmap_ms = [measure(update_heatmap) for _ in range(steps)]
+    return {
+        "view": view,
+        "drawn": int(canvas.draw_count[None]),
+        "update_colors_ms": sum(colors_ms) / steps,
+        "update_heatmap_ms": sum(heatmap_ms) / steps,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="culling.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {"X": args.side, "Y": args.side, "N": n, "R0": args.R0, "R1": args.R1}
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        sim.step()
+        canvas.setup_data_for_scene(
+            params["X"], params["Y"], n, params["R0"], NORM_RATIO
+        )
+        for view in VIEWS:
+            case = {**params, **run_case(sim, view, args.steps)}
+            results.append(case)
+            print(
+                "N={N:>8} view {view:>5.2f}: {drawn:>8} drawn, "
+                "update_colors {update_colors_ms:8.3f} ms, "
+                "update_heatmap {update_heatmap_ms:8.3f} ms".format(**case)
+            )
+
+    meta = metadata("culling", steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the domain decomposition: steps per second of `DistributedSimulation` with different counts
+of worker processes compared with `Simulation` in one process, and the balance of cats between strips.
+
+Usage:
+    python -m benchmarks.distributed --N 1000000 --workers 1 2 4 --out distributed.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.common import GRID_HASHED, MOVE_PATTERN_FREE
+from catradar.distributed import DistributedSimulation
+from catradar.simulation import Simulation
+
+PATTERN_NAMES = ["free", "carousel", "colliding"]
+
+
+def run_steps(sim, pattern: int, steps: int) -> dict:
+    sim.movement_pattern = pattern
+    sim.step(2)  # Compile kernels before measuring
+    step_ms = [measure(sim.step) for _ in range(steps)]
+    return {
+        "step_ms": sum(step_ms) / steps,
+        "steps_per_second": 1000 * steps / sum(step_ms),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4], help="0 - one process"
+    )
+    parser.add_argument("--pattern", type=int, default=MOVE_PATTERN_FREE)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--out", default="distributed.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.N:
+        params = {
+            "X": args.side,
+            "Y": args.side,
+            "N": n,
+            "R0": args.R0,
+            "R1": args.R1,
+            # Memory of the hashed grid does not depend on the area, so each worker stays small
+            "grid_storage": GRID_HASHED,
+        }
+        for workers in args.workers:
+            case = {
+                **params,
+                "workers": workers,
+                "pattern": PATTERN_NAMES[args.pattern],
+            }
+            if workers == 0:
+                case.update(run_steps(Simulation(params), args.pattern, args.steps))
+            else:
+                with DistributedSimulation(params, workers=workers, seed=0) as sim:
+                    case.update(run_steps(sim, args.pattern, args.steps))
+                    case["owned_counts"] = list(sim.owned_counts)
+                    case["grid_rebuilds"] = list(sim.grid_rebuilds)
+            results.append(case)
+            print(
+                "N={N:>8} workers={workers}: {step_ms:9.3f} ms per step, "
+                "{steps_per_second:8.1f} steps/s".format(**case)
+            )
+
+    meta = metadata("distributed", steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
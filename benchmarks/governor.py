@@ -0,0 +1,129 @@
+"""
+Benchmark of the frame governor without a window: time of state updates for shares of updated states,
+and frames of the simulation with the draw path run under the governor, reporting the frame time
+before and after it settles and the chosen settings.
+
+Usage:
+    python -m benchmarks.governor --N 1000000 5000000 --target-fps 30 --out governor.json
+"""
+
+import argparse
+import time
+
+import taichi as ti
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar import canvas, field_pool
+from catradar.governor import FrameGovernor
+from catradar.simulation import Simulation
+
+NORM_RATIO = 1000
+
+REFRESH_SHARES = [1.0, 0.5, 0.25]
+
+
+def measure_refresh(sim: Simulation, steps: int) -> dict:
+    res = {}
+    for share in REFRESH_SHARES:
+        sim.state_refresh = share
+        sim.update_states()  # Write the stride before measuring
+        ms = [measure(sim.update_states) for _ in range(steps)]
+        res["update_states_{:.0%}_ms".format(share)] = sum(ms) / steps
+    sim.state_refresh = 1.0
+    return res
+
+
+def run_governed(sim: Simulation, target_fps: float, frames: int) -> dict:
+    p = sim.params
+    lo, hi = ti.math.vec2(0, 0), ti.math.vec2(p["X"], p["Y"])
+    governor = FrameGovernor(target_fps)
+    frame_ms = []
+    simulation_seconds = [0.0]
+
+    def frame():
+        sim.state_refresh = governor.state_refresh
+        start = time.perf_counter()
+        # A machine that can't keep up always makes the limit of substeps
+        sim.step(governor.substeps)
+        simulation_seconds[0] = time.perf_counter() - start
+        canvas.update_colors(
+            sim.positions,
+            sim.states,
+            -1,
+            sim.N,
+            lo,
+            hi,
+            governor.render_rate,
+            NORM_RATIO,
+            field_pool.generation(),
+        )
+
+    governor.update()
+    for _ in range(frames):
+        frame_ms.append(measure(frame))
+        governor.update(simulation_seconds[0])
+    settled = frame_ms[-frames // 4 :]
+    return {
+        "first_frame_ms": sum(frame_ms[:10]) / 10,
+        "settled_frame_ms": sum(settled) / len(settled),
+        "render_rate": governor.render_rate,
+        "substeps": governor.substeps,
+        "state_refresh": governor.state_refresh,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--target-fps", type=float, default=30)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--out", default="governor.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {"X": args.side, "Y": args.side, "N": n, "R0": args.R0, "R1": args.R1}
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        sim.step()
+        canvas.setup_data_for_scene(
+            params["X"], params["Y"], n, params["R0"], NORM_RATIO
+        )
+        case = {
+            **params,
+            **measure_refresh(sim, args.steps),
+            **run_governed(sim, args.target_fps, args.frames),
+        }
+        results.append(case)
+        print(
+            "N={:>8}: update_states {}".format(
+                n,
+                ", ".join(
+                    "{:.0%} {:.3f} ms".format(
+                        share, case["update_states_{:.0%}_ms".format(share)]
+                    )
+                    for share in REFRESH_SHARES
+                ),
+            )
+        )
+        print(
+            "N={N:>8} governed: frame {first_frame_ms:8.3f} ms -> {settled_frame_ms:8.3f} ms "
+            "with render rate {render_rate}, {substeps} substeps, "
+            "{state_refresh:.0%} states per step".format(**case)
+        )
+
+    meta = metadata(
+        "governor", steps=args.steps, frames=args.frames, target_fps=args.target_fps
+    )
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmark of the grid pipeline: `update_positions` + `compute_states` over a matrix of parameters.
+
+Usage:
+    python -m benchmarks.grid_pipeline --preset quick --out grid.json
+    python -m benchmarks.grid_pipeline --N 1000000 5000000 --side 25000 --pattern 0 --norm 0
+"""
+
+import argparse
+import itertools
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.common import (
+    EUCLIDEAN_NORM,
+    MANHATTAN_NORM,
+    MAX_NORM,
+    MOVE_PATTERN_CAROUSEL,
+    MOVE_PATTERN_COLLIDING,
+    MOVE_PATTERN_FREE,
+)
+from catradar.simulation import Simulation
+
+# Parameters that can be changed without reallocating the simulation
+SOFT_PARAMS = ("pattern", "norm", "skin", "symmetric")
+
+# Requirement from arch.md: recomputing positions and states must take no more than 0.5 s
+TAU_MS = 500
+
+PRESETS = {
+    "quick": {
+        "N": [500, 50_000],
+        "side": [1000, 25000],
+        "radii": [(5.0, 20.0)],
+        "pattern": [MOVE_PATTERN_FREE, MOVE_PATTERN_COLLIDING],
+        "norm": [EUCLIDEAN_NORM],
+        "init_opt": [0, 1],
+        "skin": [0.0],
+        "symmetric": [0],
+    },
+    "full": {
+        "N": [500, 5_000, 50_000, 500_000, 5_000_000],
+        "side": [1000, 5000, 25000],
+        "radii": [(1.0, 10.0), (5.0, 20.0), (10.0, 50.0)],
+        "pattern": [MOVE_PATTERN_FREE, MOVE_PATTERN_CAROUSEL, MOVE_PATTERN_COLLIDING],
+        "norm": [EUCLIDEAN_NORM, MANHATTAN_NORM, MAX_NORM],
+        "init_opt": [0, 1],
+        "skin": [0.0],
+        "symmetric": [0],
+    },
+}
+
+
+def run_case(sim: Simulation, soft_params: dict, warmup: int, steps: int) -> dict:
+    """
+    Measures one case on an already allocated simulation.
+    """
+    sim.restart()
+    sim.movement_pattern = soft_params["pattern"]
+    sim.norm_func = soft_params["norm"]
+    sim.neighbor_skin = soft_params["skin"]
+    sim.symmetric_pairs = bool(soft_params["symmetric"])
+    for _ in range(warmup):
+        sim.step()
+
+    update_ms = []
+    compute_ms = []
+    rebuilds_before = sim.neighbor_list_rebuilds
+    for _ in range(steps):
+        update_ms.append(measure(sim.move))
+        compute_ms.append(measure(sim.update_states))
+
+    update_avg = sum(update_ms) / steps
+    compute_avg = sum(compute_ms) / steps
+    step_ms = update_avg + compute_avg
+    return {
+        "update_positions_ms": update_avg,
+        "compute_states_ms": compute_avg,
+        "step_ms": step_ms,
+        "steps_per_s": 1000 / step_ms if step_ms > 0 else float("inf"),
+        "max_step_ms": max(u + c for u, c in zip(update_ms, compute_ms)),
+        "tau_ok": step_ms <= TAU_MS,
+        "neighbor_list_rebuilds": sim.neighbor_list_rebuilds - rebuilds_before,
+    }
+
+
+def run(matrix: dict, warmup: int, steps: int) -> list:
+    results = []
+    sim = None
+    # Hard parameters require reallocation, so they are iterated in the outer loop
+    for n, side, (r0, r1), init_opt in itertools.product(
+        matrix["N"], matrix["side"], matrix["radii"], matrix["init_opt"]
+    ):
+        params = {
+            "X": side,
+            "Y": side,
+            "N": n,
+            "R0": r0,
+            "R1": r1,
+            "init_opt": init_opt,
+        }
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        for values in itertools.product(*(matrix[key] for key in SOFT_PARAMS)):
+            soft_params = dict(zip(SOFT_PARAMS, values))
+            case = {**params, **soft_params}
+            case.update(run_case(sim, soft_params, warmup, steps))
+            results.append(case)
+            print(
+                "N={N:>8} X=Y={X:>6.0f} R0={R0:>4} R1={R1:>4} init={init_opt} "
+                "pattern={pattern} norm={norm} skin={skin} symmetric={symmetric}: "
+                "{steps_per_s:8.1f} steps/s, "
+                "update_positions {update_positions_ms:8.3f} ms, "
+                "compute_states {compute_states_ms:8.3f} ms".format(**case)
+            )
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--N", type=int, nargs="+", help="Override counts of cats")
+    parser.add_argument(
+        "--side", type=float, nargs="+", help="Override field sizes (X = Y)"
+    )
+    parser.add_argument(
+        "--radii",
+        type=float,
+        nargs="+",
+        help="Override radii as flat pairs: R0 R1 [R0 R1 ...]",
+    )
+    parser.add_argument("--pattern", type=int, nargs="+")
+    parser.add_argument("--norm", type=int, nargs="+")
+    parser.add_argument("--init-opt", dest="init_opt", type=int, nargs="+")
+    parser.add_argument(
+        "--skin",
+        type=float,
+        nargs="+",
+        help="Skins of neighbour lists, 0 disables them",
+    )
+    parser.add_argument(
+        "--symmetric",
+        type=int,
+        nargs="+",
+        help="Whether each pair of cats is evaluated once for both cats (0 or 1)",
+    )
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="grid_pipeline.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    matrix = dict(PRESETS[args.preset])
+    for key in ("N", "side", "init_opt", *SOFT_PARAMS):
+        if getattr(args, key):
+            matrix[key] = getattr(args, key)
+    if args.radii:
+        if len(args.radii) % 2:
+            raise ValueError("--radii expects pairs of values: R0 R1")
+        matrix["radii"] = list(zip(args.radii[::2], args.radii[1::2]))
+
+    results = run(matrix, args.warmup, args.steps)
+    meta = metadata(
+        "grid_pipeline",
+        preset=args.preset,
+        warmup=args.warmup,
+        steps=args.steps,
+        tau_ms=TAU_MS,
+    )
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
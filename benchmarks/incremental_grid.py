@@ -0,0 +1,86 @@
+"""
+Benchmark of the incremental grid: `update_states` time with the grid binned fully every step
+and with only cats that changed cells moved, for movement patterns, with the share of moved cats.
+
+Usage:
+    python -m benchmarks.incremental_grid --N 1000000 5000000 --out incremental_grid.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.simulation import Simulation
+
+PATTERNS = {0: "free", 1: "carousel"}
+
+
+def run_case(sim: Simulation, pattern: int, warmup: int, steps: int) -> dict:
+    sim.restart()
+    sim.movement_pattern = pattern
+    for _ in range(warmup):
+        sim.step()
+
+    update_ms = []
+    mover_shares = []
+    rebuilds = sim.grid_rebuilds
+    for _ in range(steps):
+        sim.move()
+        update_ms.append(measure(sim.update_states))
+        mover_shares.append(sim.mover_share)
+        sim.steps_done += 1
+    return {
+        "pattern": PATTERNS[pattern],
+        "incremental_grid": sim.params["incremental_grid"],
+        "update_states_ms": sum(update_ms) / steps,
+        "mover_share": sum(mover_shares) / steps,
+        "full_rebuilds": sim.grid_rebuilds - rebuilds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[1_000_000, 5_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--out", default="incremental_grid.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        for incremental in (False, True):
+            params = {
+                "X": args.side,
+                "Y": args.side,
+                "N": n,
+                "R0": args.R0,
+                "R1": args.R1,
+                "incremental_grid": incremental,
+            }
+            if sim is None:
+                sim = Simulation(params)
+            else:
+                sim.reset(params)
+            sim.speed_mult = args.speed
+            for pattern in PATTERNS:
+                case = {**params, **run_case(sim, pattern, args.warmup, args.steps)}
+                results.append(case)
+                print(
+                    "N={N:>8} {pattern:>8} incremental={incremental_grid!s:>5}: "
+                    "update_states {update_states_ms:9.3f} ms, moved {mover_share:6.2%}, "
+                    "full rebuilds {full_rebuilds}".format(**case)
+                )
+
+    meta = metadata(
+        "incremental_grid", warmup=args.warmup, steps=args.steps, speed=args.speed
+    )
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Benchmark of layouts of data of cats: memory footprint of each subsystem and time of `compute_states`
+and `update_colors` (the draw path without a window) for each layout.
+
+Usage:
+    python -m benchmarks.layout --N 1000000 5000000 --out layout.json
+"""
+
+import argparse
+
+import taichi as ti
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar import canvas, field_pool
+from catradar.common import LAYOUT_COMPACT, LAYOUT_COMPACT_SOA, LAYOUT_STANDARD
+from catradar.simulation import Simulation
+
+LAYOUT_NAMES = {
+    LAYOUT_STANDARD: "standard",
+    LAYOUT_COMPACT: "compact",
+    LAYOUT_COMPACT_SOA: "compact-soa",
+}
+
+# Field pool groups holding data of cats
+CATS_GROUPS = ("simulation", "positions")
+
+NORM_RATIO = 1000
+
+
+def footprint() -> dict:
+    """
+    Returns allocated memory of each subsystem in MB.
+    """
+    return {
+        name: s["allocated_mb"]
+        for name, s in field_pool.memory_report().items()
+        if s["allocated_mb"] > 0
+    }
+
+
+def run_case(sim: Simulation, warmup: int, steps: int) -> dict:
+    p = sim.params
+    canvas.setup_data_for_scene(p["X"], p["Y"], sim.N, p["R0"], NORM_RATIO)
+
+    def update_colors():
+        # The whole field is in the view
+        canvas.update_colors(
+            sim.positions,
+            sim.states,
+            -1,
+            sim.N,
+            ti.math.vec2(0, 0),
+            ti.math.vec2(p["X"], p["Y"]),
+            100,
+            NORM_RATIO,
+            field_pool.generation(),
+        )
+
+    sim.step(warmup)  # Compile kernels before measuring
+    update_colors()
+    compute_ms = []
+    colors_ms = []
+    for _ in range(steps):
+        sim.move()
+        compute_ms.append(measure(sim.update_states))
+        colors_ms.append(measure(update_colors))
+
+    memory = footprint()
+    cats_mb = sum(memory.get(name, 0) for name in CATS_GROUPS)
+    return {
+        "compute_states_ms": sum(compute_ms) / steps,
+        "update_colors_ms": sum(colors_ms) / steps,
+        "cats_mb": cats_mb,
+        "cats_bytes_per_cat": cats_mb * 2**20 / sim.N,
+        "memory_mb": memory,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument(
+        "--layout",
+        type=int,
+        nargs="+",
+        default=[LAYOUT_STANDARD, LAYOUT_COMPACT, LAYOUT_COMPACT_SOA],
+        help="0 - Standard, 1 - Compact, 2 - Compact SoA",
+    )
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="layout.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        for layout in args.layout:
+            params = {
+                "X": args.side,
+                "Y": args.side,
+                "N": n,
+                "R0": args.R0,
+                "R1": args.R1,
+                "layout": layout,
+            }
+            if sim is None:
+                sim = Simulation(params)
+            else:
+                sim.reset(params)
+            case = {**params, **run_case(sim, args.warmup, args.steps)}
+            results.append(case)
+            print(
+                "N={N:>8} {layout:>11}: compute_states {compute_states_ms:9.3f} ms, "
+                "update_colors {update_colors_ms:8.3f} ms, cats data {cats_mb:8.2f} MB "
+                "({cats_bytes_per_cat:.1f} B/cat)".format(
+                    **{**case, "layout": LAYOUT_NAMES[layout]}
+                )
+            )
+            print(
+                "    "
+                + ", ".join(
+                    "{} {:.2f}".format(name, mb)
+                    for name, mb in case["memory_mb"].items()
+                )
+            )
+
+    meta = metadata("layout", warmup=args.warmup, steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
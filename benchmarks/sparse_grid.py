@@ -0,0 +1,108 @@
+"""
+Benchmark of grid storage: `compute_states` time and memory of grid cells for dense, sparse and hashed grids
+on a large field where cats occupy a small part of it. Collisions of the hashed grid are reported too.
+
+Usage:
+    python -m benchmarks.sparse_grid --N 10000 100000 1000000 --out sparse_grid.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar import field_pool
+from catradar.common import GRID_DENSE, GRID_HASHED, GRID_SPARSE
+from catradar.simulation import Simulation
+
+STORAGE_NAMES = {GRID_DENSE: "dense", GRID_SPARSE: "sparse", GRID_HASHED: "hashed"}
+
+# Field pool groups holding cells of the grid
+GRID_GROUPS = ("grid_cells", "grid_cells_sparse", "grid_blocks")
+
+
+def grid_memory_mb() -> float:
+    report = field_pool.memory_report()
+    return sum(report[name]["allocated_mb"] for name in GRID_GROUPS if name in report)
+
+
+def run_case(sim: Simulation, steps: int) -> dict:
+    sim.update_states()  # Compile kernels before measuring
+    compute_ms = []
+    for _ in range(steps):
+        sim.move()
+        compute_ms.append(measure(sim.update_states))
+    result = {
+        "compute_states_ms": sum(compute_ms) / steps,
+        "max_compute_states_ms": max(compute_ms),
+        "grid_memory_mb": grid_memory_mb(),
+    }
+    if sim.params["grid_storage"] == GRID_HASHED:
+        result["hash_collisions"] = sim.hash_collision_stats()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--side", type=float, default=25000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=10.0)
+    parser.add_argument(
+        "--init-opt",
+        dest="init_opt",
+        type=int,
+        nargs="+",
+        default=[1, 0],
+        help="Presets of initial positions, 1 puts all cats in the corner",
+    )
+    parser.add_argument(
+        "--storage",
+        type=int,
+        nargs="+",
+        default=[GRID_DENSE, GRID_SPARSE, GRID_HASHED],
+        help="0 - Dense grid, 1 - Sparse grid, 2 - Hashed grid",
+    )
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="sparse_grid.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        for init_opt in args.init_opt:
+            for storage in args.storage:
+                params = {
+                    "X": args.side,
+                    "Y": args.side,
+                    "N": n,
+                    "R0": args.R0,
+                    "R1": args.R1,
+                    "init_opt": init_opt,
+                    "grid_storage": storage,
+                }
+                if sim is None:
+                    sim = Simulation(params)
+                else:
+                    sim.reset(params)
+                case = {**params, **run_case(sim, args.steps)}
+                results.append(case)
+                print(
+                    "N={N:>8} init_opt={init_opt} {storage:>6}: compute_states "
+                    "{compute_states_ms:9.3f} ms (max {max_compute_states_ms:9.3f} ms), "
+                    "grid cells {grid_memory_mb:8.2f} MB".format(
+                        **case, storage=STORAGE_NAMES[storage]
+                    )
+                )
+                if "hash_collisions" in case:
+                    print(
+                        "    {occupied_cells} cells in {occupied_buckets} buckets, "
+                        "{colliding_buckets} colliding, foreign share "
+                        "{foreign_share:.3f}".format(**case["hash_collisions"])
+                    )
+
+    meta = metadata("sparse_grid", steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
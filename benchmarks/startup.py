@@ -0,0 +1,98 @@
+"""
+Benchmark of startup: time of importing the package, of initializing the runtime, of importing
+the simulation, of the first steps (compilation of kernels) and of the warm-up of all other kernel
+variants, measured in a fresh process. With the offline cache the first run is cold and the second one
+is warm: it loads kernels compiled by the first run from the cache.
+
+Usage:
+    python -m benchmarks.startup --arch cpu --threads 1 4 --out startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.utils import metadata, write_results
+
+# Measured in a fresh interpreter, takes {"init": arguments of catradar.init, "N": count of cats}
+# and prints stages and their times in seconds as JSON
+SCRIPT = """
+import json, sys, time
+config = json.loads(sys.argv[1])
+times = {}
+start = time.perf_counter()
+import catradar, catradar.common
+times["import_catradar"] = time.perf_counter() - start
+start = time.perf_counter()
+catradar.init(**config["init"])
+times["init"] = time.perf_counter() - start
+start = time.perf_counter()
+from catradar.simulation import Simulation
+times["import_simulation"] = time.perf_counter() - start
+start = time.perf_counter()
+sim = Simulation({"N": config["N"]})
+sim.step(2)
+import taichi as ti
+ti.sync()
+times["first_steps"] = time.perf_counter() - start
+times["warmup"] = sim.warmup()["seconds"]
+print(json.dumps(times))
+"""
+
+
+def run_process(init_args: dict, n: int, cache_dir: str) -> dict:
+    config = json.dumps({"init": init_args, "N": n})
+    output = subprocess.check_output(
+        [sys.executable, "-c", SCRIPT, config],
+        text=True,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "CATRADAR_CACHE_DIR": cache_dir},
+    )
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--arch", nargs="+", default=["cpu"])
+    parser.add_argument(
+        "--threads", type=int, nargs="+", default=[0], help="0 - default of Taichi"
+    )
+    parser.add_argument("--N", type=int, default=10_000)
+    parser.add_argument("--out", default="startup.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    for arch in args.arch:
+        for threads in args.threads:
+            for offline_cache in [False, True]:
+                init_args = {"arch": arch, "offline_cache": offline_cache}
+                if threads:
+                    init_args["cpu_max_num_threads"] = threads
+                # The cache starts empty, the second run finds kernels compiled by the first one
+                cache_dir = tempfile.mkdtemp(prefix="catradar_cache_")
+                for run in range(2 if offline_cache else 1):
+                    case = {
+                        **init_args,
+                        "start": "warm" if run else "cold",
+                        "N": args.N,
+                        **run_process(init_args, args.N, cache_dir),
+                    }
+                    results.append(case)
+                    print(
+                        "{arch} threads={threads} cache={offline_cache!s:<5} {start}: "
+                        "import catradar {import_catradar:.3f} s, init {init:.3f} s, "
+                        "import simulation {import_simulation:.3f} s, "
+                        "first steps {first_steps:.3f} s, warm-up {warmup:.3f} s".format(
+                            threads=threads or "default", **case
+                        )
+                    )
+
+    meta = metadata("startup", N=args.N)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark of capturing state transitions: time of state updates without watching, with the logged cat,
+with a watch set of a share of cats and with all cats watched, and time of draining captured transitions.
+
+Usage:
+    python -m benchmarks.transitions --N 100000 1000000 --out transitions.json
+"""
+
+import argparse
+
+import numpy as np
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.simulation import Simulation
+
+CASES = ["none", "logged", "set", "all"]
+
+
+def run_case(sim: Simulation, case: str, share: float, steps: int) -> dict:
+    sim.unwatch()
+    sim.logged_id = 0 if case == "logged" else -1
+    if case == "set":
+        sim.watch(np.arange(0, sim.N, max(int(1 / share), 1)))
+    elif case == "all":
+        sim.watch_all()
+    sim.step()  # Compile the variant and allocate the buffer before measuring
+    sim.transitions_numpy()
+
+    step_ms = []
+    drain_ms = []
+    drained = []
+    for _ in range(steps):
+        sim.move()
+        step_ms.append(measure(sim.update_states))
+        sim.steps_done += 1
+        drain_ms.append(measure(lambda: drained.append(sim.transitions_numpy())))
+    count = sum(len(events) for events in drained)
+    return {
+        "case": case,
+        "update_states_ms": sum(step_ms) / steps,
+        "drain_ms": sum(drain_ms) / steps,
+        "transitions_per_step": count / steps,
+        "dropped": sim.dropped_transitions,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--side", type=float, default=10000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument(
+        "--share", type=float, default=0.01, help="Share of cats in the watch set"
+    )
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="transitions.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    sim = None
+    for n in args.N:
+        params = {"X": args.side, "Y": args.side, "N": n, "R0": args.R0, "R1": args.R1}
+        if sim is None:
+            sim = Simulation(params)
+        else:
+            sim.reset(params)
+        sim.watch_all()
+        sim.warmup()
+        for case in CASES:
+            result = {**params, **run_case(sim, case, args.share, args.steps)}
+            results.append(result)
+            print(
+                "N={N:>8} {case:>6}: update_states {update_states_ms:9.3f} ms, "
+                "drain {drain_ms:8.3f} ms, {transitions_per_step:10.1f} transitions "
+                "per step, {dropped} dropped".format(**result)
+            )
+
+    meta = metadata("transitions", steps=args.steps, share=args.share)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
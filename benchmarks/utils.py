@@ -0,0 +1,68 @@
+# Helpers shared between benchmarks
+import json
+import os
+import platform
+import subprocess
+import time
+
+# Benchmarks measure the CPU backend unless the caller chose another one explicitly
+os.environ.setdefault("CATRADAR_ARCH", "cpu")
+
+import taichi as ti  # noqa: E402
+
+from catradar import runtime  # noqa: E402
+
+__all__ = ["measure", "metadata", "write_results"]
+
+
+def measure(f) -> float:
+    """
+    Runs `f` and returns its wall-clock time in milliseconds.
+    Taichi kernels are asynchronous, so the runtime is synchronized before and after the call
+    unless this process does not run kernels.
+    """
+    sync = runtime.is_initialized()
+    if sync:
+        ti.sync()
+    start = time.perf_counter()
+    f()
+    if sync:
+        ti.sync()
+    return (time.perf_counter() - start) * 1000
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def metadata(name: str, **extra) -> dict:
+    """
+    Describes the environment of a benchmark run, so results of different commits can be compared.
+    """
+    return {
+        "benchmark": name,
+        "commit": _git_commit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "taichi": ".".join(map(str, ti.__version__)),
+        "arch": runtime.startup_report()["arch"],
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        **extra,
+    }
+
+
+def write_results(path: str, meta: dict, results: list):
+    """
+    Writes benchmark results as JSON: {"meta": {...}, "results": [...]}.
+    """
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print("Results are written to", path)
@@ -0,0 +1,80 @@
+"""
+Benchmark of compiled variants of `compute_states`: time of each combination of the norm function,
+the running mode and logging of a cat, for the grid and the symmetric traversal.
+
+Usage:
+    python -m benchmarks.variants --N 100000 1000000 --out variants.json
+"""
+
+import argparse
+
+from benchmarks.utils import measure, metadata, write_results
+
+from catradar.common import STANDARD_MODE, TESTING_MODE
+from catradar.simulation import Simulation
+
+NORM_NAMES = ["euclidean", "manhattan", "max"]
+MODE_NAMES = {STANDARD_MODE: "standard", TESTING_MODE: "testing"}
+
+
+def run_case(
+    sim: Simulation, norm: int, logged: bool, symmetric: bool, steps: int
+) -> dict:
+    sim.restart()
+    sim.norm_func = norm
+    sim.logged_id = 0 if logged else -1
+    sim.symmetric_pairs = symmetric
+    sim.update_states()  # Compile the variant before measuring
+    compute_ms = [measure(sim.update_states) for _ in range(steps)]
+    return {
+        "norm": NORM_NAMES[norm],
+        "logged": logged,
+        "symmetric": symmetric,
+        "compute_states_ms": sum(compute_ms) / steps,
+        "min_compute_states_ms": min(compute_ms),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--N", type=int, nargs="+", default=[100_000])
+    parser.add_argument("--side", type=float, default=5000)
+    parser.add_argument("--R0", type=float, default=5.0)
+    parser.add_argument("--R1", type=float, default=20.0)
+    parser.add_argument("--norm", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument(
+        "--mode", type=int, nargs="+", default=[STANDARD_MODE, TESTING_MODE]
+    )
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--out", default="variants.json")
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.N:
+        params = {"X": args.side, "Y": args.side, "N": n, "R0": args.R0, "R1": args.R1}
+        for mode in args.mode:
+            sim = Simulation(params, mode=mode)
+            for symmetric in [False, True]:
+                for norm in args.norm:
+                    for logged in [False, True]:
+                        case = {
+                            **params,
+                            "mode": MODE_NAMES[mode],
+                            **run_case(sim, norm, logged, symmetric, args.steps),
+                        }
+                        results.append(case)
+                        print(
+                            "N={N:>8} {mode:>8} {traversal:>9} {norm:>9} "
+                            "logged={logged!s:<5}: compute_states {compute_states_ms:9.3f} ms "
+                            "(min {min_compute_states_ms:9.3f} ms)".format(
+                                traversal="symmetric" if symmetric else "grid",
+                                **case,
+                            )
+                        )
+
+    meta = metadata("variants", steps=args.steps)
+    write_results(args.out, meta, results)
+
+
+if __name__ == "__main__":
+    main()
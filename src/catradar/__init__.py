@@ -1,10 +1,16 @@
-import os
+# The Taichi runtime is initialized lazily: by `catradar.init` or on the first import of a module
+# declaring fields with defaults from environment variables (see `catradar.runtime`)
 
-import taichi as ti
+__all__ = ["Simulation", "init"]
 
-if os.environ.get("GITHUB_ACTIONS") == "true":
-    print("Testing mode, running on the cpu")
-    ti.init(arch=ti.cpu, debug=True)
-else:
-    print("Standard mode, running on the gpu")
-    ti.init(arch=ti.gpu)
+
+def __getattr__(name: str):
+    if name == "Simulation":
+        from catradar.simulation import Simulation
+
+        return Simulation
+    if name == "init":
+        from catradar.runtime import init
+
+        return init
+    raise AttributeError("module 'catradar' has no attribute {!r}".format(name))
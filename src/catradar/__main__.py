@@ -1,44 +1,46 @@
+import argparse
 import time
 import taichi as ti
 import numpy as np
-from catradar.common import STANDARD_MODE
-import tkinter as tk
 
-from catradar.utils import trace
+from catradar import field_pool, runtime
+from catradar.profiler import profiler
 
-from catradar.canvas import draw_circles, setup_data_for_scene, draw_borders
-
-from catradar.positions_updater import (
-    initialize_positions,
-    update_positions,
-    setup_positions_data,
+from catradar.canvas import (
+    CAMERA_ZOOM,
+    draw_circles,
+    setup_data_for_scene,
+    draw_borders,
+    warmup_scene,
+)
+from catradar.common import (
+    ENCODING_FLOAT32,
+    ENCODING_QUANTIZED,
+    GRID_DENSE,
+    GRID_HASHED,
+    GRID_SPARSE,
 )
-from catradar.grid_manager import compute_states, setup_grid_data, update_logs
-
-# Grid parameters
-X: ti.f32 = 1000
-Y: ti.f32 = 1000
-N: ti.i32 = 500  # Count of cats
-R0: ti.f32 = 5.0  # The distance at which cats enter the INTERACT state
-R1: ti.f32 = 20.0  # The distance at which cats enter the INTERSECTION state
-
-# Limit of cats per cell for grid algorithm.
-# User can't change it, this value was obtained by running tests several times with different limits
-LIMIT_PER_CELL: ti.i32 = 100
-
-# Other "soft" parameters. "Soft" means that changing these parameters does not require rebuilding the grid
-init_opt: ti.i32 = 0  # Option for positions initializer
-movement_pattern: ti.i32 = 0
-cursor_push_on: ti.i8 = 0  # Flag that indicates that user enable "cursor push"
-speed_mult: ti.f32 = 1  # Speed modifier
-render_rate: ti.i32 = 100  # Percentage of rendering cats
-norm_func: ti.i32 = 0  # Function for calculating distance
+from catradar.grid_manager import sparse_storage_supported
+
+from catradar.distributed import DistributedSimulation
+from catradar.governor import FrameGovernor
+from catradar.scheduler import MAX_SUBSTEPS, STEP_RATE, FixedStepScheduler
+from catradar.simulation import Simulation, DEFAULT_PARAMS
+from catradar.trajectory import TrajectoryReader, TrajectoryRecorder
+
+# Other "soft" parameters that only affect the UI
+render_rate: ti.i32 = 100  # Percentage of rendering visible cats
+heatmap = True  # Draw a heatmap instead of cats when the camera is far
+drawn_count = 0  # Count of cats drawn in the last frame
+step_rate: ti.i32 = STEP_RATE  # Simulation steps per second of simulated time
+max_substeps: ti.i32 = MAX_SUBSTEPS  # Limit of simulation steps per rendered frame
+# The frame governor lowers the render rate, substeps and updated states within these limits
+governor_on = False
 
 # Logging
 show_logs = True
 print_logs = True
 logged_id: ti.i32 = 0
-logs = []
 current_page = 0
 per_page = 50
 
@@ -46,25 +48,28 @@ per_page = 50
 show_borders = True
 allow_large_n = False
 
+# Chrome trace of the hot path is written here by the "Export trace" button
+TRACE_PATH = "catradar_trace.json"
+
 # The coefficient needed to convert the coordinates of the field to coordinates for the UI
 NORM_RATIO = 1000
 
-# Shared between modules memory
-positions = NotImplemented  # Positions of cats
-states = NotImplemented  # States of cats
+# The simulation shown in the window
+sim: Simulation = NotImplemented
+
+# Recorder of the trajectory of the simulation, None if the run is not recorded
+recorder: TrajectoryRecorder = None
+
+# Steps the simulation on a fixed timestep independently of the frame rate
+scheduler = FixedStepScheduler()
 
-# Data structure for first INTERSECTION_NUM intersections
-INTERSECTION_NUM = 10
-intersections = NotImplemented
+# Adapts the work of a frame to hold the target frame rate when governor_on is set
+governor = FrameGovernor()
 
-settings_buffer = {
-    "X": X,
-    "Y": Y,
-    "N": N,
-    "R0": R0,
-    "R1": R1,
-    "init_opt": init_opt,
-}
+settings_buffer = dict(DEFAULT_PARAMS)
+
+# Collisions of the hashed grid measured on demand: the measurement visits all pairs of cats of each bucket
+collision_text = ""
 
 
 def draw_ui(gui: ti.ui.Gui):
@@ -72,13 +77,7 @@ def draw_ui(gui: ti.ui.Gui):
     Draws the UI controls for parameters like area size, cats count, movement pattern, cats speed and logging.
     This lets users configure and reset the simulation.
     """
-    global \
-        render_rate, \
-        init_opt, \
-        movement_pattern, \
-        cursor_push_on, \
-        speed_mult, \
-        norm_func
+    global render_rate, heatmap, step_rate, max_substeps, governor_on
     global allow_large_n, logged_id, current_page
     LEFT_BORDER = 0.3
     with gui.sub_window("Simulation parameters", 0, 0, LEFT_BORDER, 0.22) as w:
@@ -98,23 +97,109 @@ def draw_ui(gui: ti.ui.Gui):
         settings_buffer["init_opt"] = w.slider_int(
             "Init positions preset", settings_buffer["init_opt"], 0, 1
         )
+        w.text("0 - Dense grid, 1 - Sparse grid, 2 - Hashed grid")
+        settings_buffer["grid_storage"] = w.slider_int(
+            "Grid storage", settings_buffer["grid_storage"], 0, 2
+        )
+        if (
+            settings_buffer["grid_storage"] == GRID_SPARSE
+            and not sparse_storage_supported()
+        ):
+            settings_buffer["grid_storage"] = GRID_DENSE
+        w.text("0 - Standard, 1 - Compact, 2 - Compact SoA")
+        settings_buffer["layout"] = w.slider_int(
+            "Data layout", settings_buffer["layout"], 0, 2
+        )
+        settings_buffer["incremental_grid"] = w.checkbox(
+            "Incremental grid", settings_buffer["incremental_grid"]
+        )
         if w.button("Reset"):
             reset_grid()
-            initialize_positions(positions, init_opt)
 
-    global show_logs, print_logs, logs, show_borders
+    global show_logs, print_logs, show_borders, collision_text
     with gui.sub_window("Settings", 0, 0.22, LEFT_BORDER, 0.23) as w:
         render_rate = w.slider_int("Render rate", render_rate, 0, 100)
-        speed_mult = w.slider_float("Speed", speed_mult, 0.0, 5.0)
+        heatmap = w.checkbox("Heatmap when zoomed out", heatmap)
+        w.text("Heatmap" if drawn_count < 0 else "Drawn cats: {}".format(drawn_count))
+        sim.speed_mult = w.slider_float("Speed", sim.speed_mult, 0.0, 5.0)
+        step_rate = w.slider_int("Simulation steps/s", step_rate, 10, 240)
+        max_substeps = w.slider_int("Max substeps per frame", max_substeps, 1, 8)
+        w.text(
+            "Simulation {:.0f} steps/s, render {:.0f} FPS".format(
+                scheduler.steps_per_second, scheduler.frames_per_second
+            )
+        )
         w.text("0 - Free movement, 1 - Carousel, 2 - Colliding")
-        movement_pattern = w.slider_int("Movement pattern", movement_pattern, 0, 2)
+        sim.movement_pattern = w.slider_int(
+            "Movement pattern", sim.movement_pattern, 0, 2
+        )
         w.text("0 - Euclidean, 1 - Manhattan, 2 - Max")
-        norm_func = w.slider_int("Distance function preset", norm_func, 0, 2)
-        cursor_push_on = w.checkbox("Allow cursor push", cursor_push_on)
+        sim.norm_func = w.slider_int("Distance function preset", sim.norm_func, 0, 2)
+        sim.cursor_push_on = w.checkbox("Allow cursor push", sim.cursor_push_on)
         show_borders = w.checkbox("Show borders", show_borders)
         show_logs = w.checkbox("Show logs", show_logs)
         if not show_logs:
             print_logs = True
+        sim.reorder_interval = w.slider_int(
+            "Cell reorder interval", sim.reorder_interval, 0, 100
+        )
+        sim.symmetric_pairs = w.checkbox("Symmetric pairs", sim.symmetric_pairs)
+        sim.neighbor_cap = w.slider_int(
+            "Neighbour cap per cell (0 - all)", sim.neighbor_cap, 0, 1000
+        )
+        sim.neighbor_skin = w.slider_float(
+            "Neighbour list skin", sim.neighbor_skin, 0.0, 20.0
+        )
+        if sim.neighbor_skin > 0:
+            w.text(
+                "Max displacement {:.2f}, rebuilds {}".format(
+                    sim.max_displacement, sim.neighbor_list_rebuilds
+                )
+            )
+        if sim.params["incremental_grid"]:
+            w.text(
+                "Moved cats {:.2%}, grid rebuilds {}".format(
+                    sim.mover_share, sim.grid_rebuilds
+                )
+            )
+        profiler.enabled = w.checkbox("Profile", profiler.enabled)
+        enabled = w.checkbox("Frame governor", governor_on)
+        if enabled != governor_on:
+            governor.reset()  # Frames without the governor are not measured
+            governor_on = enabled
+        if governor_on:
+            governor.target_fps = w.slider_int(
+                "Target FPS", governor.target_fps, 10, 120
+            )
+            governor.min_render_rate = w.slider_int(
+                "Min render rate", governor.min_render_rate, 0, 100
+            )
+            governor.min_state_refresh = w.slider_float(
+                "Min share of updated states", governor.min_state_refresh, 0.05, 1.0
+            )
+            w.text(
+                "Chosen: render rate {}, {} substeps, {:.0%} states per step, "
+                "frame {:.1f} ms".format(
+                    governor.render_rate,
+                    governor.substeps,
+                    governor.state_refresh,
+                    governor.frame_seconds * 1000,
+                )
+            )
+
+    if profiler.enabled:
+        with gui.sub_window("Profiler", 1 - LEFT_BORDER, 0, LEFT_BORDER, 0.25) as w:
+            if w.button("Export trace"):
+                profiler.export_chrome_trace(TRACE_PATH)
+            if w.button("Clear"):
+                profiler.clear()
+            w.text(profiler.report())
+            w.text(field_pool.format_memory_report())
+            if sim.params["grid_storage"] == GRID_HASHED:
+                if w.button("Measure hash collisions"):
+                    collision_text = format_collision_stats(sim.hash_collision_stats())
+                if collision_text:
+                    w.text(collision_text)
 
     if show_logs:
         with gui.sub_window("Logging", 0, 0.45, LEFT_BORDER, 0.55) as w:
@@ -122,55 +207,123 @@ def draw_ui(gui: ti.ui.Gui):
             if w.button(text_button):
                 print_logs = not print_logs
             if w.button("Clear"):
-                logs = []
-            logged_id = w.slider_int("Logged cat index", logged_id, 0, N - 1)
-            logs_sz = len(logs)
+                sim.logs.clear()
+            logged_id = w.slider_int("Logged cat index", logged_id, 0, sim.N - 1)
+            logs = sim.logs
             current_page = w.slider_int(
-                "Page", current_page, 0, max(logs_sz - 1, 0) // per_page
+                "Page", current_page, 0, logs.page_count(per_page) - 1
             )
-            left = max(0, logs_sz - (current_page + 1) * per_page)
-            right = logs_sz - current_page * per_page - 1
-            w.text("\n".join(reversed(logs[left : right - 1])))
+            w.text(logs.format_page(current_page, per_page))
 
 
-def setup_all_data():
-    """
-    Initializes shared between modules data (positions, states, intersections) and calls setup routines for each.
-    """
-    global positions, states
-    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
-    states = ti.field(dtype=ti.i32, shape=N)
-    global intersections
-    intersections = ti.field(
-        dtype=ti.i32,
-        shape=(N, INTERSECTION_NUM + 1),
+def format_collision_stats(stats: dict) -> str:
+    return (
+        "Hash table {table_size}: {occupied_cells} cells in {occupied_buckets} buckets, "
+        "{colliding_buckets} colliding buckets, {foreign_share:.1%} of visited cats "
+        "are from other cells".format(**stats)
     )
 
-    setup_positions_data(X, Y, N)
-    setup_grid_data(X, Y, N, R0, R1, LIMIT_PER_CELL, INTERSECTION_NUM, STANDARD_MODE)
-    setup_data_for_scene(X, Y, N, R0, NORM_RATIO)
-
 
 def reset_grid():
     """
     Resets simulation parameters from settings_buffer and re-initializes all data.
     """
-    global X, Y, N, R0, R1, init_opt
-    X = settings_buffer["X"]
-    Y = settings_buffer["Y"]
-    N = settings_buffer["N"]
-    R0 = settings_buffer["R0"]
-    R1 = settings_buffer["R1"]
-    init_opt = settings_buffer["init_opt"]
+    global logged_id, collision_text
+    sim.reset(settings_buffer)
+    collision_text = ""
+    stop_recording_if_changed()
+    setup_data_for_scene(
+        sim.params["X"], sim.params["Y"], sim.N, sim.params["R0"], NORM_RATIO
+    )
+    warmup_kernels()
+    logged_id = min(logged_id, sim.N - 1)
+    scheduler.reset()  # Time of the reset is not simulated
+    governor.reset()
 
-    setup_all_data()
+
+def stop_recording_if_changed():
+    """
+    Stops the recording when parameters written to the header of its file changed.
+    """
+    global recorder
+    if recorder is not None and not recorder.matches(sim):
+        print("Recording to {} stopped: parameters changed".format(recorder.path))
+        recorder.close()
+        recorder = None
+
+
+def simulate(n: int, dt: float):
+    """
+    Makes `n` steps of the simulation for the scheduler. While recording, steps are split at steps
+    of frames, so frames are evenly spaced in simulation steps however many substeps a frame makes.
+    """
+    if recorder is not None:
+        stop_recording_if_changed()
+    while n > 0:
+        k = n if recorder is None else min(n, recorder.steps_to_next_frame())
+        sim.step(k, dt)
+        n -= k
+        if recorder is not None:
+            with profiler.stage("record"):
+                recorder.record(sim, k)
+
+
+def warmup_kernels():
+    """
+    Compiles kernels of the simulation and the scene for the current fields,
+    so the first frames and switching settings do not stall.
+    """
+    report = sim.warmup()
+    warmup_scene(sim.positions, sim.states, NORM_RATIO)
+    print("Warmed up {variants} kernel variants in {seconds:.3f} s".format(**report))
 
 
 # Taichi field for storing last position of cursor (it is updated when user clicks on area)
 cursor_pos_field = ti.Vector.field(2, dtype=ti.f32, shape=1)
 
 
-def main():
+class Camera:
+    """
+    Camera over the field moved by keys: Q/E - forward/back, A/D - left/right, W/S - up/down.
+    """
+
+    def __init__(self):
+        self.camera = ti.ui.make_camera()
+        # Initial camera position
+        self.pos = np.array([0.3, 0.5, 1.5])
+        # The camera initially "looks" along the Z axis
+        self.dir = np.array([0.0, 0.0, -1.0])
+        # The "up" vector
+        self.up = np.array([0.0, 1.0, 0.0])
+        self.right = np.cross(self.up, self.dir)
+        self.right = self.right / np.linalg.norm(self.right)
+
+    def update(self, window: ti.ui.Window, scene: ti.ui.Scene):
+        speed = 0.01 * self.pos[2]  # Camera movement speed
+        if window.is_pressed("q"):
+            self.pos += self.dir * speed
+        if window.is_pressed("e"):
+            self.pos -= self.dir * speed
+        if window.is_pressed("a"):
+            self.pos += self.right * speed
+        if window.is_pressed("d"):
+            self.pos -= self.right * speed
+        if window.is_pressed("w"):
+            self.pos += self.up * speed
+        if window.is_pressed("s"):
+            self.pos -= self.up * speed
+        self.pos[2] = max(self.pos[2], 0.2)
+
+        # Setting a new camera position
+        self.camera.position(self.pos[0], self.pos[1], self.pos[2])
+        self.camera.lookat(*(self.pos + self.dir))
+        self.camera.up(self.up[0], self.up[1], self.up[2])
+        scene.set_camera(self.camera)
+
+
+def create_window() -> ti.ui.Window:
+    import tkinter as tk
+
     # Getting resolution of user screen
     root = tk.Tk()
     root.withdraw()
@@ -178,75 +331,49 @@ def main():
     init_resol_y = root.winfo_screenheight()
     root.destroy()
 
-    window = ti.ui.Window(
+    return ti.ui.Window(
         "Catradar: cat interaction simulation",
         res=(init_resol_x, init_resol_y),
         fps_limit=60,
         vsync=True,
     )
+
+
+def main(
+    record_path: str = None, record_interval: int = 1, encoding: int = ENCODING_FLOAT32
+):
+    global recorder, drawn_count
+    window = create_window()
     canvas = window.get_canvas()
     scene = window.get_scene()
-    camera = ti.ui.make_camera()
-
-    # Initial camera position
-    camera_pos = np.array([0.3, 0.5, 1.5])
-    # The camera initially "looks" along the Z axis
-    camera_dir = np.array([0.0, 0.0, -1.0])
-    # The "up" vector
-    up_vector = np.array([0.0, 1.0, 0.0])
-    right_vector = np.cross(up_vector, camera_dir)
-    right_vector = right_vector / np.linalg.norm(right_vector)
+    camera = Camera()
+    camera_pos = camera.pos
 
     scene.ambient_light((1, 1, 1))
 
     gui = window.get_gui()
 
-    setup_all_data()
-    initialize_positions(positions, init_opt)
-
-    prev_update_time = time.time()
+    global sim
+    sim = Simulation(settings_buffer)
+    setup_data_for_scene(
+        sim.params["X"], sim.params["Y"], sim.N, sim.params["R0"], NORM_RATIO
+    )
+    warmup_kernels()
+    if record_path:
+        recorder = TrajectoryRecorder(record_path, sim, record_interval, encoding)
 
+    scheduler.reset()
+    # Host time of the steps of the last frame, read by the governor
+    simulation_seconds = 0.0
     while window.running:
-        speed = 0.01 * camera_pos[2]  # Camera movement speed
-
-        if window.is_pressed("q"):
-            # Moving the camera forward
-            camera_pos += camera_dir * speed
-        if window.is_pressed("e"):
-            # Moving the camera back
-            camera_pos -= camera_dir * speed
-
-        if window.is_pressed("a"):
-            # Moving the camera to the left
-            camera_pos += right_vector * speed
-        if window.is_pressed("d"):
-            # Moving the camera to the right
-            camera_pos -= right_vector * speed
-
-        if window.is_pressed("w"):
-            # Moving the camera up
-            camera_pos += up_vector * speed
-        if window.is_pressed("s"):
-            # Moving the camera down
-            camera_pos -= up_vector * speed
-        camera_pos[2] = max(camera_pos[2], 0.2)
-
-        # Setting a new camera position
-        camera.position(camera_pos[0], camera_pos[1], camera_pos[2])
-        camera.lookat(
-            camera_pos[0] + camera_dir[0],
-            camera_pos[1] + camera_dir[1],
-            camera_pos[2] + camera_dir[2],
-        )
-        camera.up(up_vector[0], up_vector[1], up_vector[2])
-        scene.set_camera(camera)
+        camera.update(window, scene)
 
         cursor_board_pos = ti.math.vec2(-1000, -1000)
         # Cursor info
         if window.is_pressed(ti.GUI.LMB):
             ws = window.get_window_shape()
             cursor_pos = window.get_cursor_pos()
-            zoom = 1.2 / camera_pos[2]
+            zoom = CAMERA_ZOOM / camera_pos[2]
             cursor_board_pos[0] = (
                 ws[0]
                 * (cursor_pos[0] + (camera_pos[0] * zoom * (ws[1] / ws[0]) - 0.5))
@@ -257,54 +384,413 @@ def main():
             )
             cursor_board_pos *= NORM_RATIO / ws[1]
 
-        new_update_time = time.time()
-        trace(
-            lambda: update_positions(
-                positions,
-                intersections,
-                cursor_board_pos,
-                cursor_push_on,
-                speed_mult,
-                movement_pattern,
-                new_update_time - prev_update_time,
-            ),
-            "update_positions",
-        )
-        prev_update_time = new_update_time
-
-        trace(
-            lambda: compute_states(
-                positions,
-                states,
-                intersections,
-                movement_pattern == 2,
-                norm_func,
-                logged_id if (show_logs and print_logs) else -1,
-            ),
-            "compute_states",
-        )
-        if show_logs and print_logs:
-            trace(lambda: update_logs(logged_id, logs), "collect_logs")
+        sim.cursor_pos = cursor_board_pos
+        sim.logged_id = logged_id if (show_logs and print_logs) else -1
+        scheduler.step_rate = step_rate
+        frame_render_rate = render_rate
+        if governor_on:
+            # User settings are upper bounds of the settings chosen by the governor
+            governor.max_render_rate = render_rate
+            governor.max_substeps = max_substeps
+            governor.state_refresh_available = sim.obeys_state_refresh
+            governor.update(simulation_seconds)
+            frame_render_rate = governor.render_rate
+            scheduler.max_substeps = governor.substeps
+            sim.state_refresh = governor.state_refresh
+        else:
+            scheduler.max_substeps = max_substeps
+            sim.state_refresh = 1.0
+        # Kernels of the steps are only dispatched here, on GPU backends they run while the UI is built
+        simulation_start = time.perf_counter()
+        scheduler.advance(simulate)
+        simulation_seconds = time.perf_counter() - simulation_start
+
         if show_borders:
-            trace(lambda: draw_borders(scene), "draw_borders")
+            with profiler.stage("draw_borders"):
+                draw_borders(scene)
 
-        draw_circles(
+        drawn_count = draw_circles(
             scene,
-            positions,
-            states,
-            logged_id if show_logs else -1,
-            render_rate,
+            canvas,
+            sim.positions,
+            sim.states,
+            sim.slot(logged_id) if show_logs else -1,
+            frame_render_rate,
             NORM_RATIO,
             window.get_window_shape(),
+            camera_pos,
+            heatmap,
         )
-        if cursor_push_on and window.is_pressed(ti.GUI.LMB):
+        if sim.cursor_push_on and window.is_pressed(ti.GUI.LMB):
             cursor_pos = window.get_cursor_pos()
             cursor_pos_field[0] = ti.Vector([cursor_pos[0], cursor_pos[1]])
             canvas.circles(cursor_pos_field, radius=0.025 * zoom, color=(0.8, 0.7, 0.7))
-        trace(lambda: draw_ui(gui), "draw_ui")
-        trace(lambda: canvas.scene(scene), "canvas.scene")
-        trace(lambda: window.show(), "window.show")
+        with profiler.stage("draw_ui"):
+            draw_ui(gui)
+        with profiler.stage("canvas.scene"):
+            canvas.scene(scene)
+        with profiler.stage("window.show"):
+            window.show()
+    if recorder is not None:
+        recorder.close()
+
+
+def replay(path: str):
+    """
+    Shows frames of a recorded trajectory file without simulating. Frames are selected by the slider.
+    """
+    global render_rate
+    reader = TrajectoryReader(path)
+    if len(reader) == 0:
+        print("{} has no frames".format(path))
+        return
+
+    window = create_window()
+    canvas = window.get_canvas()
+    scene = window.get_scene()
+    camera = Camera()
+    scene.ambient_light((1, 1, 1))
+    gui = window.get_gui()
+
+    params = reader.params
+    setup_data_for_scene(params["X"], params["Y"], reader.n, params["R0"], NORM_RATIO)
+
+    frame = 0
+    loaded = -1
+    playing = True
+    while window.running:
+        camera.update(window, scene)
+
+        with gui.sub_window("Replay", 0, 0, 0.3, 0.2) as w:
+            w.text(
+                "N={N}, X={X:.0f}, Y={Y:.0f}, R0={R0:.1f}, R1={R1:.1f}".format(**params)
+            )
+            frame = w.slider_int("Frame", frame, 0, len(reader) - 1)
+            w.text("Step {}".format(reader.step(frame)))
+            if w.button("Pause" if playing else "Play"):
+                playing = not playing
+            render_rate = w.slider_int("Render rate", render_rate, 0, 100)
+
+        # Only the shown frame is read from the file
+        if frame != loaded:
+            reader.load(frame)
+            loaded = frame
+        draw_borders(scene)
+        draw_circles(
+            scene,
+            canvas,
+            reader.positions,
+            reader.states,
+            -1,
+            render_rate,
+            NORM_RATIO,
+            window.get_window_shape(),
+            camera.pos,
+        )
+        canvas.scene(scene)
+        window.show()
+        if playing:
+            frame = (frame + 1) % len(reader)
+
+
+def run_headless(args):
+    """
+    Runs the simulation without a window and reports the achieved steps per second.
+    """
+    params = {key: getattr(args, key) for key in DEFAULT_PARAMS}
+    headless_sim = Simulation(params)
+    headless_sim.movement_pattern = args.pattern
+    headless_sim.norm_func = args.norm
+    headless_sim.speed_mult = args.speed
+    headless_sim.reorder_interval = args.reorder_interval
+    headless_sim.neighbor_skin = args.skin
+    headless_sim.symmetric_pairs = args.symmetric
+    headless_sim.neighbor_cap = args.neighbor_cap
+    if args.watch_all:
+        headless_sim.watch_all()
+
+    headless_recorder = None
+    if args.record:
+        headless_recorder = TrajectoryRecorder(
+            args.record, headless_sim, args.record_interval, record_encoding(args)
+        )
+
+    start = time.perf_counter()
+    headless_sim.step(1)  # Compile kernels before measuring
+    profiler.enabled = args.profile
+    ti.sync()
+    startup = runtime.startup_report()
+    print(
+        "Runtime on {} initialized in {:.3f} s, first step took {:.3f} s".format(
+            startup["arch"],
+            startup["init_seconds"] or 0.0,
+            time.perf_counter() - start,
+        )
+    )
+    headless_sim.transitions_numpy()  # Transitions of the first step are not counted
+    transition_count = 0
+    start = time.perf_counter()
+    if headless_recorder is None and not args.watch_all:
+        headless_sim.step(args.steps)
+    else:
+        for _ in range(args.steps):
+            headless_sim.step()
+            if headless_recorder is not None:
+                with profiler.stage("record"):
+                    headless_recorder.record(headless_sim)
+            if args.watch_all:
+                with profiler.stage("transitions"):
+                    transition_count += len(headless_sim.transitions_numpy())
+    ti.sync()
+    elapsed = time.perf_counter() - start
+    print(
+        "Made {} steps with N={} in {:.3f} s: {:.1f} steps/s".format(
+            args.steps, headless_sim.N, elapsed, args.steps / max(elapsed, 1e-9)
+        )
+    )
+    if args.watch_all:
+        print(
+            "Captured {} state transitions, {} dropped".format(
+                transition_count, headless_sim.dropped_transitions
+            )
+        )
+    if args.skin > 0:
+        print(
+            "Neighbour lists were rebuilt {} times, max displacement {:.3f}".format(
+                headless_sim.neighbor_list_rebuilds, headless_sim.max_displacement
+            )
+        )
+    if args.incremental_grid:
+        print(
+            "Grid was rebuilt {} times, {:.2%} of cats moved at the last step".format(
+                headless_sim.grid_rebuilds, headless_sim.mover_share
+            )
+        )
+    if args.profile:
+        print(profiler.report())
+        if args.trace_out:
+            profiler.export_chrome_trace(args.trace_out)
+    if args.memory:
+        print(field_pool.format_memory_report())
+    if args.grid_storage == GRID_HASHED:
+        print(format_collision_stats(headless_sim.hash_collision_stats()))
+    if headless_recorder is not None:
+        headless_recorder.close()
+        print(
+            "Recorded {} frames to {}".format(
+                headless_recorder.frame_count, args.record
+            )
+        )
+
+
+def run_distributed(args):
+    """
+    Runs the simulation split between `args.workers` processes without a window
+    and reports the achieved steps per second and the count of cats owned by each worker.
+    """
+    params = {key: getattr(args, key) for key in DEFAULT_PARAMS}
+    with DistributedSimulation(params, workers=args.workers) as dist_sim:
+        dist_sim.movement_pattern = args.pattern
+        dist_sim.norm_func = args.norm
+        dist_sim.speed_mult = args.speed
+        dist_sim.symmetric_pairs = args.symmetric
+        dist_sim.step(1)  # Compile kernels before measuring
+        start = time.perf_counter()
+        dist_sim.step(args.steps)
+        elapsed = time.perf_counter() - start
+        print(
+            "Made {} steps with N={} on {} workers in {:.3f} s: {:.1f} steps/s".format(
+                args.steps,
+                dist_sim.N,
+                args.workers,
+                elapsed,
+                args.steps / max(elapsed, 1e-9),
+            )
+        )
+        print("Cats owned by workers: {}".format(dist_sim.owned_counts))
+
+
+def run_warmup(args):
+    """
+    Compiles every kernel variant for the given parameters into the offline cache and reports
+    the startup time: cold if the cache was empty and kernels were compiled, warm if they were loaded.
+    """
+    cached = runtime.cache_bytes() > 0
+    params = {key: getattr(args, key) for key in DEFAULT_PARAMS}
+    start = time.perf_counter()
+    warm_sim = Simulation(params)
+    warm_sim.neighbor_skin = args.skin
+    warm_sim.reorder_interval = args.reorder_interval
+    setup_data_for_scene(
+        warm_sim.params["X"],
+        warm_sim.params["Y"],
+        warm_sim.N,
+        warm_sim.params["R0"],
+        NORM_RATIO,
+    )
+    created = time.perf_counter() - start
+    report = warm_sim.warmup()
+    warmup_scene(warm_sim.positions, warm_sim.states, NORM_RATIO)
+    ti.sync()
+    startup = runtime.startup_report()
+    print(
+        "{} start on {}: runtime initialized in {:.3f} s, simulation created in {:.3f} s, "
+        "{} kernel variants warmed up in {:.3f} s, total {:.3f} s".format(
+            "Warm" if cached else "Cold",
+            startup["arch"],
+            startup["init_seconds"] or 0.0,
+            created,
+            report["variants"],
+            report["seconds"],
+            time.perf_counter() - start + (startup["init_seconds"] or 0.0),
+        )
+    )
+    if startup["init_args"] and startup["init_args"]["offline_cache"]:
+        print("Kernels are cached in {}".format(startup["cache_dir"]))
+    else:
+        print("Offline cache is disabled, kernels are not saved")
+
+
+def record_encoding(args) -> int:
+    return ENCODING_QUANTIZED if args.record_quantized else ENCODING_FLOAT32
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="catradar", description="Catradar: cat interaction simulation"
+    )
+    parser.add_argument("--headless", action="store_true", help="Run without a window")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Split the field between this many processes in headless mode, 0 - one process",
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="Compile all kernel variants into the offline cache and exit",
+    )
+    parser.add_argument(
+        "--steps", type=int, default=1000, help="Count of steps in headless mode"
+    )
+    parser.add_argument("--X", type=float, default=DEFAULT_PARAMS["X"])
+    parser.add_argument("--Y", type=float, default=DEFAULT_PARAMS["Y"])
+    parser.add_argument("--N", type=int, default=DEFAULT_PARAMS["N"])
+    parser.add_argument("--R0", type=float, default=DEFAULT_PARAMS["R0"])
+    parser.add_argument("--R1", type=float, default=DEFAULT_PARAMS["R1"])
+    parser.add_argument(
+        "--init-opt", dest="init_opt", type=int, default=DEFAULT_PARAMS["init_opt"]
+    )
+    parser.add_argument(
+        "--grid-storage",
+        dest="grid_storage",
+        type=int,
+        default=DEFAULT_PARAMS["grid_storage"],
+        help="0 - Dense grid, 1 - Sparse grid (CPU and CUDA only), "
+        "2 - Hashed grid (memory depends only on N, cells are not limited to the field)",
+    )
+    parser.add_argument(
+        "--layout",
+        type=int,
+        default=DEFAULT_PARAMS["layout"],
+        help="0 - Standard, 1 - Compact (u8 states), "
+        "2 - Compact SoA (u8 states, components of vectors in separate arrays)",
+    )
+    parser.add_argument(
+        "--incremental-grid",
+        dest="incremental_grid",
+        action="store_true",
+        help="Move only cats that changed grid cells instead of binning all cats every step",
+    )
+    parser.add_argument(
+        "--pattern",
+        type=int,
+        default=0,
+        help="0 - Free movement, 1 - Carousel, 2 - Colliding",
+    )
+    parser.add_argument(
+        "--norm", type=int, default=0, help="0 - Euclidean, 1 - Manhattan, 2 - Max"
+    )
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument(
+        "--reorder-interval",
+        dest="reorder_interval",
+        type=int,
+        default=0,
+        help="Permute cats in grid cell order every K steps, 0 disables it",
+    )
+    parser.add_argument(
+        "--symmetric",
+        action="store_true",
+        help="Evaluate each pair of cats once for both cats",
+    )
+    parser.add_argument(
+        "--skin",
+        type=float,
+        default=0.0,
+        help="Skin of Verlet neighbour lists, 0 disables them",
+    )
+    parser.add_argument(
+        "--neighbor-cap",
+        dest="neighbor_cap",
+        type=int,
+        default=0,
+        help="Cats visited per cell by symmetric pairs and neighbour lists, 0 - all. "
+        "A cap bounds the work in dense clusters, but drops neighbours",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="Report timings of hot path stages"
+    )
+    parser.add_argument(
+        "--trace-out",
+        dest="trace_out",
+        help="Write Chrome trace of profiled stages to this file",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="Report memory of fields of each subsystem",
+    )
+    parser.add_argument(
+        "--watch-all",
+        dest="watch_all",
+        action="store_true",
+        help="Capture state transitions of all cats every step",
+    )
+    parser.add_argument(
+        "--record",
+        help="Record positions and states of cats to this trajectory file",
+    )
+    parser.add_argument(
+        "--record-interval",
+        dest="record_interval",
+        type=int,
+        default=1,
+        help="Record every K-th step",
+    )
+    parser.add_argument(
+        "--record-quantized",
+        dest="record_quantized",
+        action="store_true",
+        help="Store positions as 16-bit fixed point numbers, half of the size",
+    )
+    parser.add_argument(
+        "--replay",
+        help="Show a recorded trajectory file instead of simulating",
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    main()
+    cli_args = parse_args()
+    if cli_args.replay:
+        replay(cli_args.replay)
+    elif cli_args.warmup:
+        run_warmup(cli_args)
+    elif cli_args.headless and cli_args.workers > 0:
+        run_distributed(cli_args)
+    elif cli_args.headless:
+        run_headless(cli_args)
+    else:
+        main(cli_args.record, cli_args.record_interval, record_encoding(cli_args))
@@ -1,17 +1,34 @@
 import taichi as ti
 
+from catradar import field_pool
 from catradar.common import (
     STATE_IDLE,
     STATE_INTERACT,
     STATE_INTERSECTION,
 )
-from catradar.utils import trace
+from catradar.profiler import profiler
 
 N: ti.i32
 R0: ti.f32
 
+# Scale of the scene at the distance 1 from the camera: the view is 1 / CAMERA_ZOOM high.
+# Matches the default field of view of the camera of 45 degrees
+CAMERA_ZOOM = 1.2
+
+# Cats with a radius smaller than this many pixels are drawn as a heatmap instead of circles
+HEATMAP_RADIUS_PX = 0.75
+# Resolution of the heatmap, it is stretched over the window
+HEATMAP_WIDTH = 480
+HEATMAP_HEIGHT = 270
+# Count of cats in a pixel of the heatmap drawn with the full brightness
+HEATMAP_SATURATION = 64
+
 positions_to_draw = NotImplemented
 colors_to_draw = NotImplemented
+draw_count = ti.field(ti.i32, shape=())  # count of cats compacted by `update_colors`
+# Count of cats of each state in each pixel of the heatmap and the image drawn from them
+heatmap_counts = ti.field(ti.i32, shape=(HEATMAP_WIDTH, HEATMAP_HEIGHT, 3))
+heatmap_image = ti.Vector.field(3, dtype=ti.f32, shape=(HEATMAP_WIDTH, HEATMAP_HEIGHT))
 border_vertices = ti.Vector.field(3, dtype=ti.f32, shape=4)
 border_indices = ti.Vector.field(2, dtype=ti.i32, shape=4)
 border_indices[0] = ti.Vector([0, 1])
@@ -19,10 +36,14 @@ border_indices[1] = ti.Vector([1, 2])
 border_indices[2] = ti.Vector([2, 3])
 border_indices[3] = ti.Vector([3, 0])
 
+_fields = field_pool.FieldGroup("scene")
+
 __all__ = [
     "setup_data_for_scene",
     "draw_borders",
     "draw_circles",
+    "visible_rect",
+    "warmup_scene",
 ]
 
 
@@ -31,14 +52,19 @@ def setup_data_for_scene(
 ):
     """
     Setup grid parameters and allocates space for scene-related data.
+    Fields are reused if they are large enough.
     """
     global N, R0
     N = aN
     R0 = aR0
 
     global positions_to_draw, colors_to_draw
-    positions_to_draw = ti.Vector.field(3, dtype=ti.f32, shape=N)
-    colors_to_draw = ti.Vector.field(3, dtype=ti.f32, shape=N)
+    _fields.allocate(
+        positions_to_draw=(ti.f32, N, 3),
+        colors_to_draw=(ti.f32, N, 3),
+    )
+    positions_to_draw = _fields["positions_to_draw"]
+    colors_to_draw = _fields["colors_to_draw"]
 
     fill_vertices(aX / norm_ratio, aY / norm_ratio, R0 / norm_ratio / 2)
 
@@ -48,23 +74,77 @@ def update_colors(
     positions: ti.template(),
     states: ti.template(),
     logged_id: ti.i32,
+    count: ti.i32,
+    lo: ti.math.vec2,
+    hi: ti.math.vec2,
     render_rate: ti.i32,
     norm_ratio: ti.f32,
+    generation: ti.template(),
+):
+    """
+    Compacts cats among the first `count` inside the rectangle [lo, hi] to the beginning of
+    `positions_to_draw` and `colors_to_draw` and stores their count in `draw_count`.
+    Of the visible cats `render_rate` percent are drawn, picked by a hash of the index,
+    so the drawn cats are spread over the view.
+    """
+    draw_count[None] = 0
+    for i in range(count):
+        p = positions[i]
+        sampled = render_rate >= 100 or (
+            ti.cast(i, ti.u32) * ti.u32(2654435761) % 100 < ti.cast(render_rate, ti.u32)
+        )
+        if all(p >= lo) and all(p <= hi) and (sampled or logged_id == i):
+            k = ti.atomic_add(draw_count[None], 1)
+            fixed = p / norm_ratio
+            positions_to_draw[k] = ti.Vector([fixed[0], fixed[1], 0])
+            color = ti.Vector([0.0, 0.0, 0.0])
+            if logged_id == i:
+                color = ti.Vector([0.5, 0.5, 0.5])
+
+            if states[i] == STATE_IDLE:
+                color += ti.Vector([0.0, 0.0, 0.5])
+            elif states[i] == STATE_INTERACT:
+                color += ti.Vector([0.0, 0.5, 0.0])
+            elif states[i] == STATE_INTERSECTION:
+                color += ti.Vector([0.5, 0.0, 0.0])
+            colors_to_draw[k] = color
+
+
+@ti.kernel
+def update_heatmap(
+    positions: ti.template(),
+    states: ti.template(),
+    count: ti.i32,
+    lo: ti.math.vec2,
+    hi: ti.math.vec2,
+    generation: ti.template(),
 ):
-    for i in range(int(N * render_rate / 100)):
-        fixed = positions[i] / norm_ratio
-        positions_to_draw[i] = ti.Vector([fixed[0], fixed[1], 0])
-        if logged_id == i:
-            colors_to_draw[i] = ti.Vector([0.5, 0.5, 0.5])
-        else:
-            colors_to_draw[i] = ti.Vector([0.0, 0.0, 0.0])
-
-        if states[i] == STATE_IDLE:
-            colors_to_draw[i] += ti.Vector([0.0, 0.0, 0.5])
-        elif states[i] == STATE_INTERACT:
-            colors_to_draw[i] += ti.Vector([0.0, 0.5, 0.0])
-        elif states[i] == STATE_INTERSECTION:
-            colors_to_draw[i] += ti.Vector([0.5, 0.0, 0.0])
+    """
+    Fills `heatmap_image` with the density and the states of the first `count` cats in the rectangle [lo, hi]:
+    the brightness of a pixel grows with the logarithm of the count of cats in it, and its color mixes
+    colors of the states by their shares.
+    """
+    for u, v, s in heatmap_counts:
+        heatmap_counts[u, v, s] = 0
+    scale = ti.Vector([HEATMAP_WIDTH, HEATMAP_HEIGHT]) / (hi - lo)
+    for i in range(count):
+        pixel = ti.floor((positions[i] - lo) * scale, int)
+        if 0 <= pixel[0] < HEATMAP_WIDTH and 0 <= pixel[1] < HEATMAP_HEIGHT:
+            ti.atomic_add(
+                heatmap_counts[pixel[0], pixel[1], ti.cast(states[i], ti.i32)], 1
+            )
+    for u, v in heatmap_image:
+        idle = heatmap_counts[u, v, STATE_IDLE]
+        interact = heatmap_counts[u, v, STATE_INTERACT]
+        intersection = heatmap_counts[u, v, STATE_INTERSECTION]
+        total = idle + interact + intersection
+        color = ti.Vector([0.0, 0.0, 0.0])
+        if total > 0:
+            brightness = ti.min(
+                0.3 + 0.7 * ti.log(total + 1.0) / ti.log(HEATMAP_SATURATION + 1.0), 1.0
+            )
+            color = ti.Vector([intersection, interact, idle]) / total * brightness
+        heatmap_image[u, v] = color
 
 
 @ti.kernel
@@ -75,6 +155,32 @@ def fill_vertices(X: ti.f32, Y: ti.f32, R: ti.f32):
     border_vertices[3] = ti.Vector([-R, Y + R, 0])
 
 
+def visible_rect(camera_pos, window_size: tuple, norm_ratio) -> tuple:
+    """
+    Returns corners (lo, hi) of the part of the field seen by the camera looking along the Z axis.
+
+    :param camera_pos: Position of the camera in the scene.
+    :param window_size: Size of the app window (width, height).
+    :param norm_ratio: Normalization factor for scaling positions.
+    """
+    half_height = camera_pos[2] / CAMERA_ZOOM / 2
+    half_width = half_height * window_size[0] / window_size[1]
+    center = ti.math.vec2(camera_pos[0], camera_pos[1])
+    half = ti.math.vec2(half_width, half_height)
+    return (center - half) * norm_ratio, (center + half) * norm_ratio
+
+
+def warmup_scene(positions: ti.template(), states: ti.template(), norm_ratio):
+    """
+    Compiles `update_colors` and `update_heatmap` for the current fields without drawing any cat.
+    """
+    lo = ti.math.vec2(0, 0)
+    update_colors(
+        positions, states, -1, 0, lo, lo, 100, norm_ratio, field_pool.generation()
+    )
+    update_heatmap(positions, states, 0, lo, lo + 1, field_pool.generation())
+
+
 def draw_borders(scene: ti.ui.Scene):
     """
     Render borders in the scene.
@@ -84,38 +190,68 @@ def draw_borders(scene: ti.ui.Scene):
 
 def draw_circles(
     scene: ti.ui.Scene,
+    canvas: ti.ui.Canvas,
     positions: ti.template(),
     states: ti.template(),
     logged_id: ti.i32,
     render_rate: ti.i32,
     norm_ratio,
     window_size: tuple,
-):
+    camera_pos,
+    heatmap: bool = True,
+) -> int:
     """
-    Render circles representing cats in the scene.
+    Render circles representing cats seen by the camera in the scene. Cats outside the view are culled,
+    so the cost of drawing depends on the count of visible cats. When the camera is so far that cats
+    are smaller than `HEATMAP_RADIUS_PX`, a heatmap of the view is drawn on the canvas instead.
 
     :param scene: The Taichi UI scene to render to.
+    :param canvas: The canvas of the window the heatmap is drawn on.
     :param positions: 2D-vector positions of the cats.
     :param states: Current states of the cats.
     :param logged_id: ID of the cat to highlight.
-    :param render_rate: Percentage of cats to render.
+    :param render_rate: Percentage of visible cats to render.
     :param norm_ratio: Normalization factor for scaling positions.
     :param window_size: Size of the app window (width, height).
+    :param camera_pos: Position of the camera in the scene.
+    :param heatmap: Whether the heatmap replaces circles when the camera is far.
+    :return: Count of drawn circles, -1 if the heatmap is drawn.
     """
     if render_rate == 0:  # Do not render at all
-        return
-    trace(
-        lambda: update_colors(positions, states, logged_id, render_rate, norm_ratio),
-        "update_colors",
-    )
+        return 0
+    lo, hi = visible_rect(camera_pos, window_size, norm_ratio)
+    radius_px = R0 / 2 / (hi[1] - lo[1]) * window_size[1]
+    if heatmap and radius_px < HEATMAP_RADIUS_PX:
+        with profiler.stage("update_heatmap"):
+            update_heatmap(positions, states, N, lo, hi, field_pool.generation())
+        with profiler.stage("draw heatmap"):
+            canvas.set_image(heatmap_image)
+        return -1
+
+    # Circles crossing the border of the view are drawn too
+    margin = R0 / 2
+    with profiler.stage("update_colors"):
+        update_colors(
+            positions,
+            states,
+            logged_id,
+            N,
+            lo - margin,
+            hi + margin,
+            render_rate,
+            norm_ratio,
+            field_pool.generation(),
+        )
+        count = draw_count[None]
+    if count == 0:
+        return 0
 
-    trace(
-        lambda: scene.particles(
+    with profiler.stage("draw particles"):
+        scene.particles(
             positions_to_draw,
             radius=R0 / 2 / norm_ratio * (window_size[1] / window_size[0]),
             per_vertex_color=colors_to_draw,
             index_offset=0,
-            index_count=int(N * render_rate / 100),
-        ),
-        "draw particles",
-    )
+            index_count=count,
+        )
+    return count
@@ -0,0 +1,95 @@
+# Reordering of cats data in the order of grid cells, so the neighbour search in compute_states
+# reads positions of cats from the same cell from contiguous memory
+import taichi as ti
+
+from catradar import field_pool, grid_manager, positions_updater
+
+__all__ = ["setup_cell_order_data", "reorder_by_cells"]
+
+# Index map between stable external ids of cats and slots where their data is stored
+cat_ids = NotImplemented  # cat_ids[slot] - id of the cat stored in the slot
+slot_of = NotImplemented  # slot_of[id] - slot of the cat with the id
+
+# Buffers for gathering data in the new order
+tmp_vec2 = NotImplemented
+tmp_f32 = NotImplemented
+tmp_i32 = NotImplemented
+
+N: ti.i32
+
+_fields = field_pool.FieldGroup("cell_order", read_as_globals=False)
+
+
+def setup_cell_order_data(aN: ti.i32):
+    """
+    Allocates space for the index map and gathering buffers. The map is initialized with identity.
+    Fields are reused if they are large enough.
+    """
+    global N
+    N = aN
+
+    global cat_ids, slot_of, tmp_vec2, tmp_f32, tmp_i32
+    _fields.allocate(
+        cat_ids=(ti.i32, N),
+        slot_of=(ti.i32, N),
+        tmp_vec2=(ti.f32, N, 2),
+        tmp_f32=(ti.f32, N),
+        tmp_i32=(ti.i32, N),
+    )
+    cat_ids = _fields["cat_ids"]
+    slot_of = _fields["slot_of"]
+    tmp_vec2 = _fields["tmp_vec2"]
+    tmp_f32 = _fields["tmp_f32"]
+    tmp_i32 = _fields["tmp_i32"]
+    init_index_map(cat_ids, slot_of, N)
+
+
+@ti.kernel
+def init_index_map(ids: ti.template(), slots: ti.template(), n: ti.i32):
+    for i in range(n):
+        ids[i] = i
+        slots[i] = i
+
+
+@ti.kernel
+def _permute(order: ti.template(), data: ti.template(), tmp: ti.template(), n: ti.i32):
+    for k in range(n):
+        tmp[k] = data[order[k]]
+    for k in range(n):
+        data[k] = tmp[k]
+
+
+@ti.kernel
+def _permute_index_map(
+    order: ti.template(),
+    ids: ti.template(),
+    slots: ti.template(),
+    tmp: ti.template(),
+    n: ti.i32,
+):
+    for k in range(n):
+        tmp[k] = ids[order[k]]
+    for k in range(n):
+        ids[k] = tmp[k]
+        slots[tmp[k]] = k
+
+
+def reorder_by_cells(positions, states):
+    """
+    Permutes positions, velocities, states and carousel data of cats into the order of grid cells
+    computed by the last `compute_states` call and updates the index map.
+
+    Contacts are not permuted: they refer to old slots and must be rebuilt by `contacts.build_contacts`
+    before being used again.
+
+    :param positions: positions of cats.
+    :param states: states of cats.
+    """
+    # order[k] - old slot of the cat that goes to slot k
+    order = grid_manager.ids_in_cell_order()
+    _permute(order, positions, tmp_vec2, N)
+    _permute(order, positions_updater.velocities, tmp_vec2, N)
+    _permute(order, positions_updater.p1_angles, tmp_f32, N)
+    _permute(order, positions_updater.p1_speeds, tmp_f32, N)
+    _permute(order, states, tmp_i32, N)
+    _permute_index_map(order, cat_ids, slot_of, tmp_i32, N)
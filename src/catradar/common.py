@@ -19,7 +19,41 @@ state_to_str = {
 STANDARD_MODE = 0
 TESTING_MODE = 1
 
+# Which cats have their state transitions captured (see transitions.py)
+WATCH_NONE = 0
+WATCH_SET = 1  # cats marked in the watch mask
+WATCH_ALL = 2
+
 # Cats movement patterns
 MOVE_PATTERN_FREE = 0
 MOVE_PATTERN_CAROUSEL = 1
 MOVE_PATTERN_COLLIDING = 2
+
+# Storage of grid cells
+GRID_DENSE = 0
+GRID_SPARSE = 1
+GRID_HASHED = 2
+
+# Encodings of positions in trajectory files
+ENCODING_FLOAT32 = 0
+ENCODING_QUANTIZED = 1  # 16-bit fixed point over the field
+
+# Layouts of data of cats
+LAYOUT_STANDARD = 0  # i32 states, vectors stored as arrays of structures
+LAYOUT_COMPACT = 1  # u8 states, vectors stored as arrays of structures
+# LAYOUT_COMPACT with components of vectors stored in separate arrays
+LAYOUT_COMPACT_SOA = 2
+
+# "Hard" parameters of the simulation. Changing any of them requires reallocating the data,
+# so they are applied only on reset
+DEFAULT_PARAMS = {
+    "X": 1000.0,
+    "Y": 1000.0,
+    "N": 500,
+    "R0": 5.0,  # The distance at which cats enter the INTERSECTION state
+    "R1": 20.0,  # The distance at which cats enter the INTERACT state
+    "init_opt": 0,  # Option for positions initializer
+    "grid_storage": GRID_DENSE,  # Storage of grid cells: dense, sparse or hashed
+    "incremental_grid": False,  # Move only cats that changed cells instead of binning all cats every step
+    "layout": LAYOUT_STANDARD,  # Types and placement of data of cats
+}
@@ -0,0 +1,196 @@
+# Contacts of cats (pairs within R0) in CSR format for the colliding movement pattern and exports.
+# Contacts of each cat are counted, the counts are scanned and ids are written to a buffer sized
+# by the total count, so memory scales with the actual count of contacts and no contact is dropped.
+import taichi as ti
+
+from catradar import field_pool, grid_manager
+from catradar.grid_manager import (
+    _build_grid,
+    _cell_key,
+    _cell_range,
+    _cells_begin,
+    _cells_end,
+    _dense_slot,
+    _dist_measure,
+    _in_cell,
+    _radius_measure,
+)
+from catradar.scan import exclusive_scan, scan_block_count
+
+__all__ = [
+    "setup_contacts_data",
+    "release_contacts_data",
+    "build_contacts",
+    "contacts_numpy",
+]
+
+N: ti.i32
+
+# Data for contacts in CSR format
+contact_count = NotImplemented  # count of contacts of each cat
+contact_start = NotImplemented  # contacts of cat i are contact_ids[contact_start[i]:contact_start[i + 1]]
+contact_ids = NotImplemented
+block_sum = NotImplemented  # buffer for the prefix sum of contact_count
+
+_fields = field_pool.FieldGroup("contacts")
+# Ids are kept in a separate tree, which grows with more headroom,
+# so small fluctuations of the count of contacts do not cause reallocations
+_ids_fields = field_pool.FieldGroup("contact_ids", headroom=1.5, read_as_globals=False)
+
+
+def setup_contacts_data(aN: ti.i32):
+    """
+    Setup contacts parameters and allocates space for contacts data.
+    Must be called after `setup_grid_data`. Fields are reused if they are large enough.
+    """
+    global N
+    N = aN
+
+    global contact_count, contact_start, block_sum
+    _fields.allocate(
+        contact_count=(ti.i32, N),
+        contact_start=(ti.i32, N + 1),
+        block_sum=(ti.i32, scan_block_count(N)),
+    )
+    contact_count = _fields["contact_count"]
+    contact_start = _fields["contact_start"]
+    block_sum = _fields["block_sum"]
+    _allocate_ids(N)
+
+
+def release_contacts_data():
+    """
+    Frees memory of contacts. `setup_contacts_data` must be called before building contacts again.
+    """
+    _fields.destroy()
+    _ids_fields.destroy()
+
+
+def _allocate_ids(count: int):
+    global contact_ids
+    _ids_fields.allocate(contact_ids=(ti.i32, max(count, 1)))
+    contact_ids = _ids_fields["contact_ids"]
+
+
+@ti.func
+def _for_each_contact(
+    positions: ti.template(),
+    i: ti.i32,
+    norm_func: ti.template(),
+    ids: ti.template(),
+    fill: ti.template(),
+) -> ti.i32:
+    """
+    Visits cats within R0 from the cat `i` and returns their count. In dense cells only subcells
+    within R0 are visited, so a cluster costs about as much as its contacts.
+    If `fill` is true, ids of contacts are written to the list of the cat `i` in `ids`.
+    """
+    grid = grid_manager.params[None]
+    pos = positions[i]
+    cells_begin = _cells_begin(ti.floor((pos - grid.r0) / grid.cell_size, int))
+    cells_end = _cells_end(ti.floor((pos + grid.r0) / grid.cell_size, int))
+    r0 = _radius_measure(grid.r0, norm_func)
+
+    count = 0
+    for neigh_x in range(cells_begin[0], cells_end[0]):
+        for neigh_y in range(cells_begin[1], cells_end[1]):
+            linear_idx = _cell_key(ti.Vector([neigh_x, neigh_y]))
+            slot = _dense_slot(linear_idx)
+            cell_range = _cell_range(linear_idx)
+            sub_begin = ti.Vector([0, 0])
+            sub_end = ti.Vector([1, 1])
+            if slot >= 0:
+                cell_origin = ti.Vector([neigh_x, neigh_y]) * grid.subdivision
+                sub_begin = ti.math.clamp(
+                    ti.floor((pos - grid.r0) / grid.subcell_size, int) - cell_origin,
+                    0,
+                    grid.subdivision - 1,
+                )
+                sub_end = ti.math.clamp(
+                    ti.floor((pos + grid.r0) / grid.subcell_size, int)
+                    - cell_origin
+                    + 1,
+                    1,
+                    grid.subdivision,
+                )
+            for sub_x in range(sub_begin[0], sub_end[0]):
+                for sub_y in range(sub_begin[1], sub_end[1]):
+                    begin = cell_range[0]
+                    end = cell_range[1]
+                    if slot >= 0:
+                        sub_idx = (
+                            slot * grid.subcell_count + sub_x * grid.subdivision + sub_y
+                        )
+                        subgrid_start = grid_manager.subcell_start[
+                            slot * grid.subcell_count
+                        ]
+                        begin += grid_manager.subcell_start[sub_idx] - subgrid_start
+                        end = (
+                            begin
+                            + grid_manager.subcell_start[sub_idx + 1]
+                            - grid_manager.subcell_start[sub_idx]
+                        )
+                    for p in range(begin, end):
+                        j = grid_manager.circles_id[p]
+                        if i != j and _in_cell(positions[j], neigh_x, neigh_y):
+                            if _dist_measure(pos, positions[j], norm_func) <= r0:
+                                if ti.static(fill):
+                                    ids[contact_start[i] + count] = j
+                                count += 1
+    return count
+
+
+@ti.kernel
+def _count_contacts(
+    positions: ti.template(),
+    norm_func: ti.template(),
+    rebuild_grid: ti.template(),
+    generation: ti.template(),
+):
+    if ti.static(rebuild_grid):
+        _build_grid(positions)
+    n = grid_manager.params[None].n
+    for i in range(n):
+        contact_count[i] = _for_each_contact(
+            positions, i, norm_func, contact_count, False
+        )
+    exclusive_scan(contact_count, contact_start, block_sum, n)
+
+
+@ti.kernel
+def _fill_contacts(
+    positions: ti.template(),
+    norm_func: ti.template(),
+    ids: ti.template(),
+    generation: ti.template(),
+):
+    for i in range(grid_manager.params[None].n):
+        _for_each_contact(positions, i, norm_func, ids, True)
+
+
+def build_contacts(positions, norm_func: ti.i32, rebuild_grid: bool = False) -> int:
+    """
+    Collects contacts of all cats and returns their total count.
+    Contacts of each cat are listed in the order of grid cells, both cats of a pair list each other.
+
+    :param positions: 2D-vector positions of cats.
+    :param norm_func: norm function for distance calculation.
+    :param rebuild_grid: Whether to rebuild the grid first. The grid built by `compute_states`
+        for the same positions is used otherwise.
+    """
+    _count_contacts(
+        positions, int(norm_func), bool(rebuild_grid), field_pool.generation()
+    )
+    total = int(contact_start[N])
+    _allocate_ids(total)
+    _fill_contacts(positions, int(norm_func), contact_ids, field_pool.generation())
+    return total
+
+
+def contacts_numpy():
+    """
+    Returns contacts built by the last call of `build_contacts` as numpy arrays (starts, ids),
+    contacts of the cat in slot i are ids[starts[i]:starts[i + 1]].
+    """
+    starts = contact_start.to_numpy()[: N + 1]
+    return starts, contact_ids.to_numpy()[: starts[N]]
@@ -0,0 +1,621 @@
+# Domain decomposition of the simulation over worker processes. The field is split along X into strips,
+# each strip is owned by a worker process with its own Taichi runtime and `Simulation` of the cats
+# of the strip plus halo copies of cats of the neighbour strips within max(R0, R1): R0 for contacts
+# of the colliding pattern and R1 for states. Cats stay in slots of the worker's simulation between steps,
+# so its incremental grid moves only cats that came or left. After moving, each worker leaves cats
+# that crossed its borders and positions of its cats near the borders in its outbox in shared memory,
+# and its neighbours take them from there before computing states. Strips must be wider than the halo,
+# and a cat crossing a whole strip in one step is passed further by the next step.
+# The coordinator does not start a Taichi runtime and does not hold data of cats.
+import multiprocessing
+import os
+import sys
+from math import pi
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from catradar import runtime
+from catradar.common import (
+    DEFAULT_PARAMS,
+    EUCLIDEAN_NORM,
+    MOVE_PATTERN_FREE,
+    STANDARD_MODE,
+)
+
+__all__ = ["DistributedSimulation", "strip_edges"]
+
+# Arrays of data of cats changed by moving: name -> components of a cat
+MOTION_ARRAYS = {"positions": 2, "velocities": 2, "angles": 1, "speeds": 1}
+# Data of a worker is allocated for 1 / CAPACITY_MARGIN more cats than it starts with plus MIN_CAPACITY,
+# so cats coming into the strip rarely reallocate it
+CAPACITY_MARGIN = 4
+MIN_CAPACITY = 64
+# Arrays of an outbox for one side: IDs and `MOTION_ARRAYS` of migrating cats, IDs and positions of halo copies
+SIDE_ARRAYS = 1 + len(MOTION_ARRAYS) + 2
+MAX_OUTBOX_ARRAYS = 2 * SIDE_ARRAYS
+
+
+def strip_edges(x: float, workers: int) -> list:
+    """
+    Returns bounds of strips along X: the worker k owns cats with edges[k] <= x < edges[k + 1].
+    The outer bounds are infinite, so cats on the borders of the field are owned too.
+    """
+    edges = [x * k / workers for k in range(workers + 1)]
+    edges[0] = -np.inf
+    edges[-1] = np.inf
+    return edges
+
+
+class _Outbox:
+    """
+    Block of shared memory where a worker leaves cats for its neighbours after moving: for each side,
+    cats migrating to the neighbour and positions of its own cats within the halo of the side.
+    The worker replaces the block with a larger one when cats do not fit, neighbours attach to it
+    by the name the coordinator sends with the next phase.
+    """
+
+    # Header of int32 values: count of arrays, then the type (0 - float32, 1 - int32), rows and columns of each array
+    HEADER_SIZE = 4 * (1 + 3 * MAX_OUTBOX_ARRAYS)
+
+    def __init__(self, size: int = 0, name: str = None):
+        if name is None:
+            self._shm = shared_memory.SharedMemory(
+                create=True, size=max(size, self.HEADER_SIZE)
+            )
+        elif sys.version_info >= (3, 13):
+            # Neighbours must not unlink the block when they exit
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+
+    @classmethod
+    def size_of(cls, arrays: list) -> int:
+        return cls.HEADER_SIZE + sum(array.size * 4 for array in arrays)
+
+    def write(self, arrays: list) -> bool:
+        """
+        Writes arrays of 32-bit values. Returns False if they do not fit into the block.
+        """
+        if self.size_of(arrays) > self._shm.size:
+            return False
+        header = np.ndarray(
+            (1 + 3 * MAX_OUTBOX_ARRAYS,), np.int32, buffer=self._shm.buf
+        )
+        header[0] = len(arrays)
+        offset = self.HEADER_SIZE
+        for k, array in enumerate(arrays):
+            kind = 1 if array.dtype.kind in "iu" else 0
+            columns = array.shape[1] if array.ndim > 1 else 0
+            header[1 + 3 * k : 4 + 3 * k] = (kind, len(array), columns)
+            view = np.ndarray(
+                array.shape,
+                np.int32 if kind else np.float32,
+                buffer=self._shm.buf,
+                offset=offset,
+            )
+            view[...] = array
+            offset += array.size * 4
+        return True
+
+    def read(self) -> list:
+        """
+        Returns copies of the arrays written last.
+        """
+        header = np.ndarray(
+            (1 + 3 * MAX_OUTBOX_ARRAYS,), np.int32, buffer=self._shm.buf
+        )
+        arrays = []
+        offset = self.HEADER_SIZE
+        for k in range(int(header[0])):
+            kind, rows, columns = (
+                int(value) for value in header[1 + 3 * k : 4 + 3 * k]
+            )
+            shape = (rows, columns) if columns > 0 else (rows,)
+            view = np.ndarray(
+                shape,
+                np.int32 if kind else np.float32,
+                buffer=self._shm.buf,
+                offset=offset,
+            )
+            arrays.append(view.copy())
+            offset += view.size * 4
+        return arrays
+
+    def close(self, unlink: bool = False):
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+def _random_cats(params: dict, seed: int = None) -> dict:
+    """
+    Returns data of cats initialized like by `positions_updater.initialize_positions`.
+    """
+    rng = np.random.default_rng(seed)
+    n = params["N"]
+    if params["init_opt"] == 0:
+        positions = rng.random((n, 2)) * [params["X"], params["Y"]]
+        velocities = (rng.random((n, 2)) * 100 - 50) * 0.01
+    else:
+        positions = [50, 50] + rng.random((n, 2)) * [10, 1]
+        velocities = ([10, 10] + rng.random((n, 2))) * 0.5
+    return {
+        "positions": positions,
+        "velocities": velocities,
+        "angles": rng.random(n) * 2 * pi,
+        "speeds": rng.random(n) * 2 + 2,
+    }
+
+
+def _select(x: np.ndarray, lo: float, hi: float, halo: float):
+    """
+    Returns IDs of cats owned by the strip [lo, hi) followed by IDs of cats within `halo` of it,
+    and the count of owned cats.
+    """
+    owned = np.flatnonzero((x >= lo) & (x < hi))
+    if halo <= 0:
+        return owned, len(owned)
+    near = np.flatnonzero(
+        ((x >= lo - halo) & (x < lo)) | ((x >= hi) & (x <= hi + halo))
+    )
+    return np.concatenate((owned, near)), len(owned)
+
+
+class _Partition:
+    """
+    Cats of a worker in slots of its simulation: cats owned by its strip and halo copies of cats
+    of the neighbour strips. Slots of cats that stay local are kept between steps.
+    """
+
+    def __init__(
+        self, index: int, edges: list, params: dict, mode: int, ids, cats, owned: int
+    ):
+        from catradar.simulation import Simulation
+
+        self.lo, self.hi = edges[index], edges[index + 1]
+        self.halo = max(params["R0"], params["R1"])
+        n = len(ids)
+        self.ids = np.asarray(ids, np.int32)  # IDs of cats in slots
+        self.owned = np.arange(n) < owned  # Whether the cat of a slot is owned
+        self.sim = Simulation(
+            {**params, "N": max(n, 1), "incremental_grid": True}, mode=mode
+        )
+        self.sim.reserve(n + n // CAPACITY_MARGIN + MIN_CAPACITY)
+        if n > 0:
+            self.sim.load_cats(cats)
+        else:
+            self.sim.resize(0)
+        self.outbox = _Outbox()
+        self._inboxes = [None, None]  # Outboxes of the left and right neighbours
+        # Data of cats after the last move and slots of cats that left the strip, until the exchange
+        self._moved = None
+        self._leaving = None
+
+    def apply(self, soft: dict):
+        self.sim.movement_pattern = soft["movement_pattern"]
+        self.sim.norm_func = soft["norm_func"]
+        self.sim.speed_mult = soft["speed_mult"]
+        self.sim.symmetric_pairs = soft["symmetric_pairs"]
+
+    def move(self, dt: float):
+        """
+        Moves local cats and leaves cats that crossed the borders and halo copies for neighbours in the outbox.
+        """
+        if self.sim.N > 0:
+            self.sim.move(dt)
+        cats = self.sim.cats_numpy()
+        x = cats["positions"][:, 0]
+        left = self.owned & (x < self.lo)
+        right = self.owned & (x >= self.hi)
+        staying = self.owned & ~left & ~right
+        arrays = []
+        for leaving, near in (
+            (left, staying & (x < self.lo + self.halo)),
+            (right, staying & (x >= self.hi - self.halo)),
+        ):
+            arrays.append(self.ids[leaving])
+            arrays.extend(cats[key][leaving] for key in MOTION_ARRAYS)
+            arrays.append(self.ids[near])
+            arrays.append(cats["positions"][near])
+        if not self.outbox.write(arrays):
+            self.outbox.close(unlink=True)
+            self.outbox = _Outbox(2 * _Outbox.size_of(arrays))
+            self.outbox.write(arrays)
+        self.owned = staying
+        self._moved = cats
+        self._leaving = left | right
+
+    def exchange(self, left_name: str, right_name: str):
+        """
+        Takes cats that came into the strip and halo copies from outboxes of neighbours. Slots of cats
+        that are not local anymore are taken by new cats or by cats from the end, and the simulation
+        is resized, so only cats of changed slots are written.
+        """
+        if self._moved is None:
+            return
+        cats, self._moved = self._moved, None
+        x = cats["positions"][:, 0]
+        n = len(self.ids)
+        # Cats that left stay as halo copies while they are near the strip
+        used = self.owned | (
+            self._leaving & (x >= self.lo - self.halo) & (x <= self.hi + self.halo)
+        )
+
+        # The left neighbour leaves cats for its right side and vice versa
+        in_ids, in_owned = [], []
+        in_cats = {key: [] for key in MOTION_ARRAYS}
+        for neighbour, name in enumerate((left_name, right_name)):
+            if name is None:
+                continue
+            side = 1 - neighbour
+            arrays = self._inbox(neighbour, name).read()[side * SIDE_ARRAYS :]
+            arrays = arrays[:SIDE_ARRAYS]
+            migrant_ids, halo_ids, halo_positions = arrays[0], arrays[-2], arrays[-1]
+            in_ids += [migrant_ids, halo_ids]
+            in_owned += [np.ones(len(migrant_ids), bool), np.zeros(len(halo_ids), bool)]
+            for k, (key, components) in enumerate(MOTION_ARRAYS.items()):
+                in_cats[key].append(arrays[1 + k])
+                if key == "positions":
+                    in_cats[key].append(halo_positions)
+                else:
+                    # Halo copies are not moved by this worker
+                    shape = (
+                        (len(halo_ids), components)
+                        if components > 1
+                        else (len(halo_ids),)
+                    )
+                    in_cats[key].append(np.zeros(shape, np.float32))
+        if in_ids:
+            in_ids = np.concatenate(in_ids)
+            in_owned = np.concatenate(in_owned)
+            in_cats = {key: np.concatenate(arrays) for key, arrays in in_cats.items()}
+        else:
+            in_ids = np.zeros(0, np.int32)
+            in_owned = np.zeros(0, bool)
+            in_cats = {key: array[:0] for key, array in cats.items()}
+
+        # Cats already held as halo copies keep their slots
+        found = np.zeros(len(in_ids), np.int64)
+        held = np.zeros(len(in_ids), bool)
+        if n > 0:
+            order = np.argsort(self.ids)
+            found = order[
+                np.minimum(np.searchsorted(self.ids, in_ids, sorter=order), n - 1)
+            ]
+            held = self.ids[found] == in_ids
+        found = found[held]
+        for key, array in cats.items():
+            array[found] = in_cats[key][held]
+        owned = self.owned.copy()
+        owned[found] = in_owned[held]
+        used[found] = True
+        written = np.zeros(n, bool)
+        written[found] = True
+
+        # Cats from slots beyond the new count and new cats fill free slots below it
+        new = ~held
+        total = int(used.sum()) + int(new.sum())
+        relocated = np.flatnonzero(used[total:]) + total
+        free = np.concatenate((np.flatnonzero(~used[:total]), np.arange(n, total)))
+        relocated_to, new_to = free[: len(relocated)], free[len(relocated) :]
+        stay = np.flatnonzero(written[:total])
+
+        ids = np.empty(total, np.int32)
+        ids[: min(n, total)] = self.ids[:total]
+        ids[relocated_to] = self.ids[relocated]
+        ids[new_to] = in_ids[new]
+        self.owned = np.zeros(total, bool)
+        self.owned[: min(n, total)] = owned[:total]
+        self.owned[relocated_to] = owned[relocated]
+        self.owned[new_to] = in_owned[new]
+        self.ids = ids
+
+        slots = np.concatenate((stay, relocated_to, new_to))
+        data = {
+            key: np.concatenate((array[stay], array[relocated], in_cats[key][new]))
+            for key, array in cats.items()
+        }
+        self.sim.resize(max(total, n))
+        if len(slots) > 0:
+            self.sim.write_cats(slots, data)
+        self.sim.resize(total)
+
+    def update_states(self):
+        if self.sim.N > 0:
+            self.sim.update_states()
+
+    def gather(self):
+        """
+        Returns IDs, data and states of owned cats.
+        """
+        cats = self.sim.cats_numpy()
+        states = self.sim.states_numpy()
+        return (
+            self.ids[self.owned],
+            {key: array[self.owned] for key, array in cats.items()},
+            states[self.owned],
+        )
+
+    def _inbox(self, neighbour: int, name: str) -> _Outbox:
+        inbox = self._inboxes[neighbour]
+        if inbox is None or inbox.name != name:
+            # The neighbour made a larger outbox, the previous one is not used anymore
+            if inbox is not None:
+                inbox.close()
+            inbox = self._inboxes[neighbour] = _Outbox(name=name)
+        return inbox
+
+    def close(self):
+        for inbox in self._inboxes:
+            if inbox is not None:
+                inbox.close()
+        self.outbox.close(unlink=True)
+
+
+def _run_worker(
+    index: int,
+    edges: list,
+    params: dict,
+    mode: int,
+    ids: np.ndarray,
+    cats: dict,
+    owned: int,
+    conn,
+):
+    """
+    Entry point of a worker process: executes phases sent by the coordinator until "close".
+    """
+    # The runtime may be already initialized by the main module, which spawn imports first,
+    # so arguments of `init` come from environment variables in both cases
+    partition = _Partition(index, edges, params, mode, ids, cats, owned)
+    try:
+        while True:
+            command, soft, dt, neighbours = conn.recv()
+            if command == "close":
+                break
+            if command == "gather":
+                partition.exchange(*neighbours)
+                conn.send(partition.gather())
+                continue
+            partition.apply(soft)
+            if command == "move":
+                partition.move(dt)
+            else:
+                partition.exchange(*neighbours)
+                if command == "states":
+                    partition.update_states()
+            conn.send(
+                (
+                    int(partition.owned.sum()),
+                    partition.outbox.name,
+                    partition.sim.grid_rebuilds,
+                )
+            )
+    finally:
+        partition.close()
+
+
+class DistributedSimulation:
+    """
+    Simulation split along X into strips owned by worker processes, see the comment of the module.
+    Steps and returns states and positions like `Simulation`. Neighbour lists, reordering,
+    logging and the cursor are not supported.
+    """
+
+    def __init__(
+        self,
+        params: dict = None,
+        workers: int = 2,
+        mode: int = STANDARD_MODE,
+        cats: dict = None,
+        init_args: dict = None,
+        seed: int = None,
+    ):
+        """
+        :param params: "Hard" parameters of the simulation, see `DEFAULT_PARAMS`. Workers always update
+            their grids incrementally.
+        :param workers: Count of worker processes, one per strip.
+        :param mode: Running mode of the workers.
+        :param cats: Initial data of cats in the format of `Simulation.cats_numpy`,
+            random data for `init_opt` by default.
+        :param init_args: Arguments of `catradar.init` in workers. By default workers run on the CPU
+            and share its cores.
+        :param seed: Seed of random initial data.
+        """
+        self.params = dict(DEFAULT_PARAMS)
+        if params is not None:
+            unknown = set(params) - set(DEFAULT_PARAMS)
+            if unknown:
+                raise ValueError("Unknown simulation parameters: {}".format(unknown))
+            self.params.update(params)
+        halo = max(self.params["R0"], self.params["R1"])
+        if workers > 1 and self.params["X"] / workers <= halo:
+            raise ValueError(
+                "Strips of {} workers are not wider than the halo {}".format(
+                    workers, halo
+                )
+            )
+        self.mode = mode
+        self.workers = workers
+
+        # "Soft" parameters sent to workers with each phase
+        self.movement_pattern = MOVE_PATTERN_FREE
+        self.norm_func = EUCLIDEAN_NORM
+        self.speed_mult = 1.0
+        self.symmetric_pairs = False
+
+        self.steps_done = 0
+        # Count of cats owned by each worker after the last phase
+        self.owned_counts = [0] * workers
+        # Full rebuilds of grids of workers since their data was allocated
+        self.grid_rebuilds = [0] * workers
+        self.edges = strip_edges(self.params["X"], workers)
+        self._outboxes = [None] * workers  # Names of outboxes of workers
+        # Whether workers moved cats and did not take cats from outboxes of neighbours yet
+        self._exchange_pending = False
+
+        if cats is None:
+            cats = _random_cats(self.params, seed)
+        x = np.asarray(cats["positions"])[:, 0]
+
+        if init_args is None:
+            threads = max((os.cpu_count() or 1) // workers, 1)
+            init_args = {"arch": "cpu", "cpu_max_num_threads": threads}
+        # Forking a process with a Taichi runtime is not safe, workers start from scratch.
+        # Spawned processes inherit the environment at start
+        context = multiprocessing.get_context("spawn")
+        self._connections = []
+        self._processes = []
+        saved_env = dict(os.environ)
+        os.environ.update(runtime.init_env(**init_args))
+        try:
+            for index in range(workers):
+                ids, owned = _select(x, self.edges[index], self.edges[index + 1], halo)
+                self.owned_counts[index] = owned
+                parent_conn, child_conn = context.Pipe()
+                process = context.Process(
+                    target=_run_worker,
+                    args=(
+                        index,
+                        self.edges,
+                        self.params,
+                        mode,
+                        ids,
+                        {key: np.asarray(cats[key])[ids] for key in MOTION_ARRAYS},
+                        owned,
+                        child_conn,
+                    ),
+                    daemon=True,
+                )
+                process.start()
+                child_conn.close()
+                self._connections.append(parent_conn)
+                self._processes.append(process)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved_env)
+
+    @property
+    def N(self) -> int:
+        return self.params["N"]
+
+    def _neighbours(self, index: int) -> tuple:
+        """
+        Returns names of outboxes of the left and right neighbours of the worker `index`.
+        """
+        left = self._outboxes[index - 1] if index > 0 else None
+        right = self._outboxes[index + 1] if index + 1 < self.workers else None
+        return left, right
+
+    def _receive(self, index: int):
+        try:
+            return self._connections[index].recv()
+        except EOFError:
+            self.close()
+            raise RuntimeError("Worker {} exited unexpectedly".format(index))
+
+    def _run_phase(self, command: str, dt: float = 0.0) -> list:
+        """
+        Sends a phase to all workers and waits until all of them finish it. Returns replies of workers.
+        """
+        soft = {
+            "movement_pattern": self.movement_pattern,
+            "norm_func": self.norm_func,
+            "speed_mult": self.speed_mult,
+            "symmetric_pairs": self.symmetric_pairs,
+        }
+        for index, conn in enumerate(self._connections):
+            conn.send((command, soft, dt, self._neighbours(index)))
+        replies = [self._receive(index) for index in range(self.workers)]
+        self._exchange_pending = command == "move"
+        if command != "gather":
+            for index, (owned, outbox, rebuilds) in enumerate(replies):
+                self.owned_counts[index] = owned
+                self._outboxes[index] = outbox
+                self.grid_rebuilds[index] = rebuilds
+        return replies
+
+    def move(self, dt: float = 1 / 60):
+        """
+        Moves cats according to the current movement pattern.
+
+        :param dt: Time interval of the step in seconds.
+        """
+        if self._exchange_pending:
+            self._run_phase("exchange")
+        self._run_phase("move", dt)
+
+    def update_states(self):
+        """
+        Recomputes states of cats.
+        """
+        self._run_phase("states")
+
+    def step(self, n: int = 1, dt: float = 1 / 60):
+        """
+        Makes `n` simulation steps: moves cats and recomputes their states.
+
+        :param n: Count of steps.
+        :param dt: Time interval of each step in seconds.
+        """
+        for _ in range(n):
+            self.move(dt)
+            self.update_states()
+            self.steps_done += 1
+
+    def _gather(self):
+        """
+        Collects IDs, data and states of cats from workers and orders them by IDs of cats.
+        """
+        replies = self._run_phase("gather")
+        order = np.argsort(np.concatenate([reply[0] for reply in replies]))
+        cats = {
+            key: np.concatenate([reply[1][key] for reply in replies])[order]
+            for key in MOTION_ARRAYS
+        }
+        return cats, np.concatenate([reply[2] for reply in replies])[order]
+
+    def states_numpy(self):
+        """
+        Returns states of all cats as a numpy array indexed by IDs of cats.
+        """
+        return self._gather()[1]
+
+    def positions_numpy(self):
+        """
+        Returns positions of all cats as a numpy array of shape (N, 2) indexed by IDs of cats.
+        """
+        return self._gather()[0]["positions"]
+
+    def cats_numpy(self) -> dict:
+        """
+        Returns data of all cats in the format of `Simulation.cats_numpy`.
+        """
+        return self._gather()[0]
+
+    def close(self):
+        """
+        Stops workers, which free their shared memory. The simulation must not be used afterwards.
+        """
+        if self._processes is None:
+            return
+        for conn in self._connections:
+            try:
+                conn.send(("close", None, 0.0, None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._connections:
+            conn.close()
+        self._processes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
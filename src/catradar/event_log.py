@@ -0,0 +1,105 @@
+# Log of state changes of the logged cat. Events are fixed-size records in a ring buffer,
+# so the log takes constant memory in long runs, and text of a page is formatted only
+# when the page or the log changes rather than on every frame.
+import numpy as np
+
+from catradar.common import state_to_str
+
+__all__ = ["EventLog", "EVENT_DTYPE", "LOG_CAPACITY"]
+
+# Count of the last events kept by default
+LOG_CAPACITY = 10_000
+
+EVENT_DTYPE = np.dtype(
+    [
+        ("frame", np.int64),  # step of the simulation
+        ("cat_id", np.int32),  # the logged cat
+        ("prev", np.int8),  # state before the change
+        ("new", np.int8),  # state after the change
+        ("cause_id", np.int32),  # the cat that caused the change, -1 if none
+    ]
+)
+
+
+class EventLog:
+    """
+    Ring buffer of the last `capacity` events. The oldest events are overwritten by new ones.
+    """
+
+    def __init__(self, capacity: int = LOG_CAPACITY):
+        self.capacity = capacity
+        self.records = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.total = 0  # count of events appended since the last clear, including overwritten ones
+        self._version = 0  # changed by every append and clear
+        self._page_key = None
+        self._page_text = ""
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def append(self, frame: int, cat_id: int, prev: int, new: int, cause_id: int = -1):
+        self.records[self.total % self.capacity] = (frame, cat_id, prev, new, cause_id)
+        self.total += 1
+        self._version += 1
+
+    def extend(self, records: np.ndarray):
+        """
+        Appends a structured array of `EVENT_DTYPE` records at once, in their order.
+        """
+        count = len(records)
+        if count == 0:
+            return
+        kept = records[-self.capacity :]
+        # Records that do not fit are overwritten by the newer ones anyway
+        first = self.total + count - len(kept)
+        self.records[(first + np.arange(len(kept))) % self.capacity] = kept
+        self.total += count
+        self._version += 1
+
+    def clear(self):
+        self.total = 0
+        self._version += 1
+
+    def events(self) -> np.ndarray:
+        """
+        Returns kept events from the oldest to the newest as a structured array of `EVENT_DTYPE`.
+        """
+        if self.total <= self.capacity:
+            return self.records[: self.total].copy()
+        start = self.total % self.capacity
+        return np.concatenate((self.records[start:], self.records[:start]))
+
+    def page_count(self, per_page: int) -> int:
+        return max((len(self) + per_page - 1) // per_page, 1)
+
+    def page(self, page: int, per_page: int) -> np.ndarray:
+        """
+        Returns events of the page from the newest to the oldest, page 0 holds the newest events.
+        """
+        first = page * per_page
+        count = max(min(per_page, len(self) - first), 0)
+        # Index of the k-th newest event in the ring
+        indices = (self.total - 1 - first - np.arange(count)) % self.capacity
+        return self.records[indices]
+
+    def format_page(self, page: int, per_page: int) -> str:
+        """
+        Returns text of the page, one event per line. The text is cached until the page or the log changes.
+        """
+        key = (page, per_page, self._version)
+        if key != self._page_key:
+            self._page_key = key
+            # Records are converted to tuples at once, reading fields of records one by one is slow
+            self._page_text = "\n".join(
+                _format_event(*event) for event in self.page(page, per_page).tolist()
+            )
+        return self._page_text
+
+
+def _format_event(frame: int, cat_id: int, prev: int, new: int, cause_id: int) -> str:
+    text = "Frame {}: state of {} id changed: {} -> {}".format(
+        frame, cat_id, state_to_str[prev], state_to_str[new]
+    )
+    if cause_id >= 0:
+        text += " by {} id".format(cause_id)
+    return text
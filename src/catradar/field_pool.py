@@ -0,0 +1,310 @@
+# Pool of Taichi fields grouped by subsystems. Fields of each group live in their own SNode tree
+# allocated with headroom, so a reset with sizes that fit reuses the buffers and compiled kernels,
+# and a reset with larger sizes destroys the old tree before allocating a new one.
+# Fields of sparse groups are placed under one pointer SNode, so memory is allocated only for active blocks
+import math
+
+import taichi as ti
+
+from catradar import runtime
+
+__all__ = [
+    "FieldGroup",
+    "HEADROOM",
+    "generation",
+    "memory_report",
+    "format_memory_report",
+]
+
+# Fields are allocated for this many times more elements than requested
+HEADROOM = 1.25
+
+# Modules using the pool also declare fields at import, so the runtime must be initialized before them
+runtime.ensure_initialized()
+
+_DTYPE_SIZES = {
+    ti.i8: 1,
+    ti.u8: 1,
+    ti.i16: 2,
+    ti.f16: 2,
+    ti.i32: 4,
+    ti.u32: 4,
+    ti.f32: 4,
+    ti.i64: 8,
+    ti.u64: 8,
+    ti.f64: 8,
+}
+
+# All groups by their names for the memory report
+_groups = {}
+
+# Incremented on every allocation of any group. Kernels that read fields of groups from module globals
+# take it as a template argument, so they are recompiled instead of reading fields of destroyed trees
+_generation = 0
+
+# Count of allocated trees. Ids of SNodes of destroyed trees are reused, so kernels taking SNodes
+# as template arguments also take the number of their tree
+_trees = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+class FieldGroup:
+    """
+    Fields of one subsystem allocated together in one SNode tree.
+
+    Usage:
+        group = FieldGroup("grid")
+        group.allocate(
+            cell_start=(ti.i32, cell_count + 1),
+            positions=(ti.f32, N, 2),  # vector field with 2 components
+            velocities=(ti.f32, N, 2, ti.Layout.SOA),  # components in separate arrays
+        )
+        cell_start = group["cell_start"]
+
+    Only the first axis of each shape grows with headroom, so fields may be larger than requested.
+    Kernels must take the used sizes from their parameters rather than from `field.shape`.
+
+    If `sparse_block` is set, all fields of the group must be 1D fields of the same size. They are placed
+    under one pointer SNode (`group.blocks`) with blocks of `sparse_block` elements: writing an element
+    activates its block for all fields of the group, reading an inactive element returns 0, and
+    `ti.deactivate(group.blocks, [b])` frees the block `b`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        headroom: float = HEADROOM,
+        read_as_globals=True,
+        sparse_block: int = 0,
+    ):
+        """
+        :param name: Name of the subsystem in the memory report.
+        :param headroom: Factor of extra elements allocated over the requested count.
+        :param read_as_globals: Whether kernels read the fields from module globals. Otherwise the fields
+            are passed to kernels as template arguments and reallocating them does not change `generation()`.
+        :param sparse_block: Count of elements in a block of sparse fields, 0 for dense fields.
+        """
+        self.name = name
+        self.headroom = headroom
+        self.read_as_globals = read_as_globals
+        self.sparse_block = sparse_block
+        self.blocks = None  # pointer SNode of sparse fields
+        self.allocations = 0  # count of allocated trees
+        self.reuses = 0  # count of requests served by already allocated fields
+        self._tree = None
+        self._fields = {}
+        self._specs = {}  # name -> (dtype, shape with headroom, count of components, layout)
+        self._used = {}  # name -> requested shape
+        _groups[name] = self
+
+    def __getitem__(self, name: str):
+        return self._fields[name]
+
+    def allocate(self, **specs) -> bool:
+        """
+        Makes fields of the group fit the requested shapes and returns whether they were reallocated.
+
+        :param specs: name=(dtype, shape) for scalar fields or name=(dtype, shape, n[, layout]) for vector fields
+            with n components. Shape is an int or a tuple. By default values of an element (components of a vector,
+            values along inner axes) are stored together. With `ti.Layout.SOA` as the last item of a spec
+            each component of a vector field or each column of a multidimensional field is stored
+            in a separate array, e.g. `(ti.i32, (N, 11), None, ti.Layout.SOA)`.
+        """
+        requested = {}
+        for name, spec in specs.items():
+            dtype, shape = spec[0], spec[1]
+            n = spec[2] if len(spec) > 2 else None
+            layout = spec[3] if len(spec) > 3 else ti.Layout.AOS
+            shape = (shape,) if isinstance(shape, int) else tuple(shape)
+            requested[name] = (dtype, shape, n, layout)
+
+        if self._fits(requested):
+            self.reuses += 1
+            self._used = {name: spec[1] for name, spec in requested.items()}
+            return False
+
+        self.destroy()
+        if self.read_as_globals:
+            global _generation
+            _generation += 1
+
+        builder = ti.FieldsBuilder()
+        if self.sparse_block:
+            self._place_sparse(builder, requested)
+        else:
+            self._place_dense(builder, requested)
+        self._tree = builder.finalize()
+        self._used = {name: spec[1] for name, spec in requested.items()}
+        self.allocations += 1
+        global _trees
+        _trees += 1
+        self._tree_number = _trees
+        return True
+
+    def _place_dense(self, builder: ti.FieldsBuilder, requested: dict):
+        for name, (dtype, shape, n, layout) in requested.items():
+            capacity = (max(math.ceil(shape[0] * self.headroom), 1),) + shape[1:]
+            axes = ti.axes(*range(len(capacity)))
+            if n is None:
+                field = ti.field(dtype=dtype)
+                if layout == ti.Layout.SOA and len(capacity) > 1:
+                    inner = ti.axes(*range(1, len(capacity)))
+                    builder.dense(inner, capacity[1:]).dense(ti.i, capacity[0]).place(
+                        field
+                    )
+                else:
+                    builder.dense(axes, capacity).place(field)
+            else:
+                field = ti.Vector.field(n, dtype=dtype)
+                if layout == ti.Layout.SOA:
+                    for k in range(n):
+                        builder.dense(axes, capacity).place(field.get_scalar_field(k))
+                else:
+                    builder.dense(axes, capacity).place(field)
+            self._fields[name] = field
+            self._specs[name] = (dtype, capacity, n, layout)
+
+    def _place_sparse(self, builder: ti.FieldsBuilder, requested: dict):
+        sizes = {spec[1] for spec in requested.values()}
+        if len(sizes) != 1 or len(next(iter(sizes))) != 1:
+            raise ValueError(
+                "Sparse fields of a group must be 1D fields of the same size"
+            )
+        if any(spec[2] is not None for spec in requested.values()):
+            raise ValueError("Sparse fields of a group must be scalar fields")
+        (size,) = sizes.pop()
+        block_count = max(math.ceil(size * self.headroom / self.sparse_block), 1)
+        self.blocks = builder.pointer(ti.i, block_count)
+        for name, (dtype, _, _, layout) in requested.items():
+            field = ti.field(dtype=dtype)
+            self.blocks.dense(ti.i, self.sparse_block).place(field)
+            self._fields[name] = field
+            self._specs[name] = (
+                dtype,
+                (block_count * self.sparse_block,),
+                None,
+                layout,
+            )
+
+    def _fits(self, requested: dict) -> bool:
+        if self._tree is None or set(requested) != set(self._specs):
+            return False
+        for name, (dtype, shape, n, layout) in requested.items():
+            cur_dtype, capacity, cur_n, cur_layout = self._specs[name]
+            if dtype != cur_dtype or n != cur_n or layout != cur_layout:
+                return False
+            if shape[1:] != capacity[1:]:
+                return False
+            if shape[0] > capacity[0]:
+                return False
+        return True
+
+    def destroy(self):
+        """
+        Frees memory of the group. Fields of the group must not be used afterwards.
+        """
+        if self._tree is not None:
+            # Taichi checks shapes of vector fields created since the last materialization on the next one,
+            # and SNodes of a destroyed tree are reused by later trees. Materializing first lets it
+            # check fields of the tree while they are alive
+            ti.sync()
+            self._tree.destroy()
+            self._tree = None
+            self.blocks = None
+        self._fields = {}
+        self._specs = {}
+        self._used = {}
+
+    def _bytes(self, shapes: dict) -> int:
+        total = 0
+        for name, shape in shapes.items():
+            dtype, _, n, _ = self._specs[name]
+            total += math.prod(shape) * _DTYPE_SIZES[dtype] * (n or 1)
+        return total
+
+    def active_blocks(self) -> int:
+        """
+        Returns the count of active blocks of sparse fields.
+        """
+        if self.blocks is None:
+            return 0
+        return _count_active(self.blocks, self.blocks.shape[0], self._tree_number)
+
+    def deactivate_all(self):
+        """
+        Frees all blocks of sparse fields, their elements read as 0 afterwards.
+        """
+        if self.blocks is not None:
+            _deactivate_all(self.blocks, self.blocks.shape[0], self._tree_number)
+
+    def allocated_bytes(self) -> int:
+        if self.sparse_block:
+            # Table of pointers to blocks and memory of active blocks
+            element_bytes = sum(_DTYPE_SIZES[spec[0]] for spec in self._specs.values())
+            pointers = self.blocks.shape[0] * 8 if self.blocks is not None else 0
+            return pointers + self.active_blocks() * self.sparse_block * element_bytes
+        return self._bytes({name: spec[1] for name, spec in self._specs.items()})
+
+    def used_bytes(self) -> int:
+        if self.sparse_block:
+            return self.allocated_bytes()
+        return self._bytes(self._used)
+
+
+@ti.kernel
+def _deactivate_all(
+    blocks: ti.template(), block_count: ti.i32, tree_number: ti.template()
+):
+    for b in range(block_count):
+        ti.deactivate(blocks, [ti.cast(b, ti.i32)])
+
+
+@ti.kernel
+def _count_active(
+    blocks: ti.template(), block_count: ti.i32, tree_number: ti.template()
+) -> ti.i32:
+    count = 0
+    for b in range(block_count):
+        if ti.is_active(blocks, [ti.cast(b, ti.i32)]):
+            count += 1
+    return count
+
+
+def memory_report() -> dict:
+    """
+    Returns memory of fields of each subsystem:
+    {name: {"allocated_mb", "used_mb", "allocations", "reuses"}}.
+    """
+    return {
+        name: {
+            "allocated_mb": group.allocated_bytes() / 2**20,
+            "used_mb": group.used_bytes() / 2**20,
+            "allocations": group.allocations,
+            "reuses": group.reuses,
+        }
+        for name, group in _groups.items()
+    }
+
+
+def format_memory_report() -> str:
+    """
+    Returns the memory report formatted as a table.
+    """
+    lines = [
+        "{:<16} {:>10} {:>10} {:>6} {:>6}".format(
+            "memory, MB", "allocated", "used", "allocs", "reuses"
+        )
+    ]
+    total = 0.0
+    for name, s in memory_report().items():
+        total += s["allocated_mb"]
+        lines.append(
+            "{:<16} {:>10.2f} {:>10.2f} {:>6} {:>6}".format(
+                name, s["allocated_mb"], s["used_mb"], s["allocations"], s["reuses"]
+            )
+        )
+    lines.append("{:<16} {:>10.2f}".format("total", total))
+    return "\n".join(lines)
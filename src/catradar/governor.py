@@ -0,0 +1,213 @@
+# Frame-budget governor. Each frame the smoothed frame time is compared with the target, and when the frame
+# is over or well under the budget one knob is moved within bounds set by the user: the rate of rendering
+# visible cats, the limit of simulation substeps per frame and the share of cats whose states are recomputed
+# each step. The frame time is measured by the wall clock only. Whether rendering or simulation takes the frame
+# is told by the host time of simulation steps passed by the caller, or by timings of profiler stages when
+# the user enabled the profiler. The governor never enables the profiler: its stages synchronize the device.
+import math
+import time
+
+from catradar.profiler import profiler as default_profiler
+from catradar.scheduler import MAX_SUBSTEPS
+
+__all__ = ["FrameGovernor", "TARGET_FPS"]
+
+# Frames per second held by default
+TARGET_FPS = 30
+# Stages of the frame attributed to rendering and to simulation
+RENDER_STAGES = (
+    "update_colors",
+    "draw particles",
+    "update_heatmap",
+    "draw heatmap",
+    "canvas.scene",
+)
+SIMULATION_STAGES = (
+    "update_positions",
+    "update_grid",
+    "compute_states",
+    "update_logs",
+    "transitions",
+    "reorder",
+    "contacts",
+)
+# Waiting for vsync in window.show is not work, so it is not counted in the frame time
+IDLE_STAGES = ("window.show",)
+# Knobs are not moved while the frame time is within this share of the target
+HYSTERESIS = 0.15
+# Weight of the last frame in the smoothed frame time
+SMOOTHING = 0.2
+# Frames after a change of a knob before the next change, so the effect of the change is measured
+COOLDOWN_FRAMES = 10
+# Factors of the render rate and of the share of updated states when they are lowered
+RENDER_RATE_FACTOR = 0.75
+STATE_REFRESH_FACTOR = 0.5
+
+KNOB_RENDER = "render_rate"
+KNOB_SUBSTEPS = "substeps"
+KNOB_STATE_REFRESH = "state_refresh"
+
+
+class FrameGovernor:
+    """
+    Adapts the work of a frame to hold the target frame rate.
+    Knobs are lowered starting with the part of the frame that takes more time and are raised back
+    in the reverse order of their cost for the simulation: substeps, updated states, then rendering.
+    """
+
+    def __init__(
+        self,
+        target_fps: float = TARGET_FPS,
+        clock=time.perf_counter,
+        profiler=default_profiler,
+    ):
+        """
+        :param target_fps: Frames per second to hold.
+        :param clock: Function returning the current time in seconds.
+        :param profiler: Profiler whose stages of the last frame are read when the user enabled it.
+        """
+        self.target_fps = target_fps
+        self.clock = clock
+        self.profiler = profiler
+
+        # Bounds of knobs set by the user
+        self.min_render_rate = 10
+        self.max_render_rate = 100
+        self.max_substeps = MAX_SUBSTEPS
+        self.min_state_refresh = 0.25
+        # Whether the simulation obeys the share of updated states, e.g. symmetric pairs update all cats
+        self.state_refresh_available = True
+
+        # Chosen settings
+        self.render_rate = self.max_render_rate  # Percentage of rendering visible cats
+        self.substeps = self.max_substeps  # Limit of simulation steps per frame
+        self.state_refresh = 1.0  # Share of cats whose states are recomputed each step
+
+        self.frame_seconds = 0.0  # Smoothed time of frames
+        self._last = None
+        self._cooldown = 0
+
+    @property
+    def target_seconds(self) -> float:
+        return 1.0 / self.target_fps
+
+    def update(self, simulation_seconds: float = None) -> bool:
+        """
+        Measures the frame finished since the previous call and moves a knob if needed.
+        The first call only starts the clock.
+
+        :param simulation_seconds: Host time of simulation steps in the finished frame, measured without
+            synchronizing the device. On GPU backends it covers only dispatching kernels and possible reads
+            of results, so it understates the simulation. Used when the profiler is disabled.
+        :return: Whether a knob was changed.
+        """
+        now = self.clock()
+        last, self._last = self._last, now
+        self._clamp()
+        if last is None:
+            return False
+
+        stages = self.profiler.totals_since(last) if self.profiler.enabled else {}
+        frame = now - last - sum(stages.get(name, 0.0) for name in IDLE_STAGES)
+        if self.frame_seconds == 0:
+            self.frame_seconds = frame
+        else:
+            self.frame_seconds += SMOOTHING * (frame - self.frame_seconds)
+
+        if self._cooldown > 0:
+            self._cooldown -= 1
+            return False
+        target = self.target_seconds
+        changed = False
+        if self.frame_seconds > target * (1 + HYSTERESIS):
+            order = self._lowering_order(stages, simulation_seconds)
+            changed = any(self._lower(knob) for knob in order)
+        elif self.frame_seconds < target * (1 - HYSTERESIS):
+            changed = any(
+                self._raise(knob)
+                for knob in self._knobs(
+                    (KNOB_SUBSTEPS, KNOB_STATE_REFRESH, KNOB_RENDER)
+                )
+            )
+        if changed:
+            self._cooldown = COOLDOWN_FRAMES
+        return changed
+
+    def reset(self):
+        """
+        Returns knobs to their upper bounds, e.g. after a reset of the simulation.
+        """
+        self.render_rate = self.max_render_rate
+        self.substeps = self.max_substeps
+        self.state_refresh = 1.0
+        self.frame_seconds = 0.0
+        self._last = None
+        self._cooldown = 0
+
+    def _lowering_order(self, stages: dict, simulation_seconds: float = None) -> tuple:
+        render = sum(stages.get(name, 0.0) for name in RENDER_STAGES)
+        simulation = sum(stages.get(name, 0.0) for name in SIMULATION_STAGES)
+        if not stages and simulation_seconds is not None:
+            # The rest of the smoothed frame is attributed to rendering
+            simulation = simulation_seconds
+            render = self.frame_seconds - simulation_seconds
+        if simulation > render:
+            return self._knobs((KNOB_STATE_REFRESH, KNOB_SUBSTEPS, KNOB_RENDER))
+        # Without timings rendering is lowered first, it does not change the simulation
+        return self._knobs((KNOB_RENDER, KNOB_STATE_REFRESH, KNOB_SUBSTEPS))
+
+    def _knobs(self, order: tuple) -> tuple:
+        """
+        Leaves out knobs that have no effect on the simulation.
+        """
+        if self.state_refresh_available:
+            return order
+        return tuple(knob for knob in order if knob != KNOB_STATE_REFRESH)
+
+    def _lower(self, knob: str) -> bool:
+        """
+        Lowers the knob a step down to its bound. Returns whether it was lowered.
+        """
+        if knob == KNOB_RENDER:
+            value = max(
+                int(self.render_rate * RENDER_RATE_FACTOR), self.min_render_rate
+            )
+        elif knob == KNOB_SUBSTEPS:
+            value = max(self.substeps - 1, 1)
+        else:
+            value = max(
+                self.state_refresh * STATE_REFRESH_FACTOR, self.min_state_refresh
+            )
+        return self._set(knob, value)
+
+    def _raise(self, knob: str) -> bool:
+        """
+        Raises the knob a step up to its bound. Returns whether it was raised.
+        """
+        if knob == KNOB_RENDER:
+            value = min(
+                math.ceil(self.render_rate / RENDER_RATE_FACTOR), self.max_render_rate
+            )
+        elif knob == KNOB_SUBSTEPS:
+            value = min(self.substeps + 1, self.max_substeps)
+        else:
+            value = min(self.state_refresh / STATE_REFRESH_FACTOR, 1.0)
+        return self._set(knob, value)
+
+    def _set(self, knob: str, value) -> bool:
+        changed = value != getattr(self, knob)
+        setattr(self, knob, value)
+        return changed
+
+    def _clamp(self):
+        """
+        Keeps chosen settings within bounds, which the user may change at any time.
+        """
+        self.min_render_rate = min(self.min_render_rate, self.max_render_rate)
+        self.render_rate = min(
+            max(self.render_rate, self.min_render_rate), self.max_render_rate
+        )
+        self.substeps = min(max(self.substeps, 1), self.max_substeps)
+        self.state_refresh = min(max(self.state_refresh, self.min_state_refresh), 1.0)
+        if not self.state_refresh_available:
+            self.state_refresh = 1.0
@@ -1,49 +1,169 @@
 # Implementation based on https://docs.taichi-lang.org/blog/acclerate-collision-detection-with-taichi
+import math
+
 import taichi as ti
 
 __all__ = [
     "setup_grid_data",
+    "sparse_storage_supported",
+    "hash_collision_stats",
     "compute_states",
-    "update_logs",
+    "compute_states_symmetric",
+    "set_state_refresh",
+    "set_neighbor_cap",
+    "update_grid",
+    "request_full_rebuild",
+    "set_circle_count",
+    "ids_in_cell_order",
 ]
 
+from catradar import field_pool, transitions
 from catradar.common import (
     EUCLIDEAN_NORM,
+    GRID_DENSE,
+    GRID_HASHED,
+    GRID_SPARSE,
     MANHATTAN_NORM,
     MAX_NORM,
     STATE_IDLE,
     STATE_INTERSECTION,
     STATE_INTERACT,
     TESTING_MODE,
-    state_to_str,
+    WATCH_NONE,
 )
+from catradar.scan import exclusive_scan, scan_block_count
 
 EPS: ti.f32 = 1e-8
+MAX_SUBDIVISION = 8  # limit of subcells of a dense cell by each coordinate
+SPARSE_BLOCK_SIZE = 64  # count of cells in a block of the sparse grid
+# Taichi breaks when trees with pointer SNodes are allocated many times in one process, so cells
+# of the sparse grid are allocated once for the largest grid of the UI (X = Y = 25000, R1 = 10)
+# and kept while the dense storage is used. Only the table of pointers to blocks takes memory then
+SPARSE_GRID_CELLS = 1 << 23
+# Buckets of the hashed grid per cat, rounded up to a power of two
+HASH_BUCKETS_PER_CAT = 2
+# Incremental grid: a cell of c > 0 circles gets c // SLOT_SLACK + SLOT_MIN_FREE free slots for circles coming in
+# later steps. Sparse cells need the fixed part: a cat wandering on the border of two cells fills it alone
+SLOT_SLACK = 4
+SLOT_MIN_FREE = 4
+# Free slots of empty cells are limited to EMPTY_SLOTS_PER_CIRCLE * N in total (and SLOT_MIN_FREE per cell),
+# so they take O(N) memory on large sparse fields. A circle coming into a cell without free slots makes
+# a full rebuild
+EMPTY_SLOTS_PER_CIRCLE = 8
+MAX_MOVER_SHARE = 0.05  # the grid is rebuilt fully when more circles changed cells
+# Updates between full rebuilds, which spread free slots over cells again
+FULL_REBUILD_INTERVAL = 100
 X: ti.f32
 Y: ti.f32
 N: ti.i32
 R0: ti.f32
 R1: ti.f32
-LIMIT_PER_CELL: ti.i32  # limit of cats for each cell
+LIMIT_PER_CELL: ti.i32  # cells with more cats are dense and subdivided into subcells
 grid_cell_size: ti.i32  # the length and height of each grid cell (cells are squares)
 cell_count_x = ti.i32  # count of cells by X coordinate
 cell_count_y = ti.i32  # count of cells by Y coordinate
-INTERSECTION_NUM: ti.i32
+cell_count: ti.i32  # total count of cells
+subdivision: ti.i32  # count of subcells of a dense cell by each coordinate
+subcell_size: ti.f32  # the length and height of each subcell
+subcell_count: ti.i32  # count of subcells of a dense cell
+max_dense_cells: ti.i32  # upper bound of count of dense cells
+block_count: ti.i32  # count of blocks of the sparse grid
+table_size: ti.i32  # count of entries of tables of cells: cells of the dense grid or buckets of the hashed grid
 MODE: ti.i32  # program running mode (see common.py)
+STORAGE: ti.i32 = GRID_DENSE  # storage of grid cells (see common.py)
+# Whether cells have free slots and only circles that changed cells are moved
+INCREMENTAL = False
+# Size of circles_id: N, or N plus free slots of the incremental grid
+slot_count: ti.i32
+# Count of circles moved without a full rebuild of the incremental grid
+mover_capacity: ti.i32
+
+# Data for grid algo. Cells are linearized: the cell (x, y) has index x * cell_count_y + y
+circles_id = NotImplemented  # ids of circles sorted by cells
 
-# Data for grid algo
+# Cells of the dense grid. The hashed grid keeps its buckets in the same fields,
+# a bucket holds circles of all cells whose coordinates hash to it
 circles_per_cell = NotImplemented  # count of circles per cell of grid
-column_sum = NotImplemented  # prefix sums for each column of circles_per_cell
-prefix_sum = NotImplemented  # prefix sums for circles_per_cell
-list_head = NotImplemented
-list_cur = NotImplemented
-list_tail = NotImplemented
-circles_id = NotImplemented
+cell_start = NotImplemented  # ids of circles of cell c are circles_id[cell_start[c]:cell_start[c + 1]]
+block_sum = NotImplemented  # buffer for the prefix sum of circles_per_cell
+# Index of the subgrid of each cell or -1 if it is not dense
+dense_slot = NotImplemented
+
+# Cells of the sparse grid are allocated by blocks of SPARSE_BLOCK_SIZE consecutive cells.
+# Only blocks with circles are active, inactive cells read as zeros
+# Ids of circles of cell c are circles_id[cell_begin[c]:cell_end[c]]
+cell_begin = NotImplemented
+cell_end = NotImplemented
+# Index of the subgrid of each cell plus 1 or 0 if it is not dense
+cell_dense_slot = NotImplemented
+cell_blocks = NotImplemented  # pointer SNode of blocks of cells
+circles_per_block = NotImplemented  # count of circles per block of cells
+block_start = NotImplemented  # prefix sums of circles_per_block
+block_scan_sum = NotImplemented  # buffer for the prefix sum of circles_per_block
+
+# Data for subdivision of dense cells. Ids of circles of a dense cell are additionally sorted by its subcells
+dense_count = ti.field(ti.i32, shape=())
+circles_per_subcell = NotImplemented  # count of circles per subcell of each subgrid
+subcell_start = NotImplemented  # prefix sums of circles_per_subcell over all subgrids
+subcell_block_sum = NotImplemented  # buffer for the prefix sum of circles_per_subcell
+
+# Counters of collisions of the hashed grid, see `hash_collision_stats`
+collision_counts = ti.field(ti.i64, shape=5)
 
-# Data for updating logs
-logs_new_state = ti.field(ti.i32, shape=())
-logs_prev_state = ti.field(ti.i32, shape=())
-logs_who_changed_id = ti.field(ti.i32, shape=())
+# Data of the incremental grid. Circles of cell c are circles_id[cell_start[c]:cell_start[c] + circles_per_cell[c]],
+# the rest of slots up to cell_start[c + 1] is free and holds -1
+# Cell (or bucket) of each circle at the last update of the grid
+cell_of = NotImplemented
+slot_of = NotImplemented  # index of each circle in circles_id
+movers = NotImplemented  # circles that changed cells since the last update
+ordered_ids = NotImplemented  # circles_id without free slots, see `ids_in_cell_order`
+ordered_start = NotImplemented  # starts of cells in ordered_ids
+mover_count = ti.field(ti.i32, shape=())
+# Set when a mover does not fit into its new cell
+mover_overflow = ti.field(ti.i32, shape=())
+
+# Statistics of `update_grid`
+mover_share = 0.0  # share of circles that changed cells at the last update
+full_rebuilds = 0  # count of full rebuilds of the incremental grid
+_needs_full_rebuild = True  # cells of circles are not known
+_updates_since_rebuild = 0
+
+# Parameters read by kernels at runtime, so kernels compiled for reused fields stay valid
+params = ti.Struct.field(
+    {
+        "n": ti.i32,
+        "r0": ti.f32,
+        "r1": ti.f32,
+        "limit_per_cell": ti.i32,
+        "cell_size": ti.f32,
+        "cell_count_x": ti.i32,
+        "cell_count_y": ti.i32,
+        "subdivision": ti.i32,
+        "subcell_size": ti.f32,
+        "subcell_count": ti.i32,
+        "block_count": ti.i32,
+        "table_size": ti.i32,
+        # States of cats i with i % refresh_stride == refresh_phase are recomputed, see `set_state_refresh`
+        "refresh_stride": ti.i32,
+        "refresh_phase": ti.i32,
+        # Cats visited per cell by the symmetric kernel and neighbour lists, 0 - all, see `set_neighbor_cap`
+        "neighbor_cap": ti.i32,
+        "slot_count": ti.i32,
+        "empty_cell_slots": ti.i32,
+        "mover_capacity": ti.i32,
+    },
+    shape=(),
+)
+_state_refresh = (1, 0)  # (refresh_stride, refresh_phase) written to params
+_neighbor_cap = 0  # neighbor_cap written to params
+
+_fields = field_pool.FieldGroup("grid")
+_dense_fields = field_pool.FieldGroup("grid_cells")
+_sparse_fields = field_pool.FieldGroup(
+    "grid_cells_sparse", sparse_block=SPARSE_BLOCK_SIZE
+)
+_block_fields = field_pool.FieldGroup("grid_blocks")
+_incremental_fields = field_pool.FieldGroup("grid_incremental")
 
 
 def setup_grid_data(
@@ -53,42 +173,230 @@ def setup_grid_data(
     aR0: ti.f32,
     aR1: ti.f32,
     aLIMIT_PER_CELL: ti.i32,
-    aINTERSECTION_NUM: ti.i32,
     aMODE: ti.i32,
+    aSTORAGE: ti.i32 = GRID_DENSE,
+    incremental: bool = False,
 ):
     """
     Setup grid parameters and allocates space for grid-related data.
+    Fields are reused if they are large enough.
+
+    With GRID_SPARSE storage memory and per-frame work on cells scale with blocks of cells occupied by cats
+    rather than with the area of the field. Sparse storage needs the CPU or CUDA backend.
+    With GRID_HASHED storage coordinates of cells are hashed into a table sized by N,
+    so memory and per-frame work on cells do not depend on the area of the field at all.
+
+    With `incremental` the dense and hashed grids keep free slots in cells, and `update_grid` moves only
+    circles that changed cells instead of binning all circles again, see `update_grid`.
+    The sparse grid is always binned fully.
     """
-    global X, Y, N, R0, R1, LIMIT_PER_CELL, INTERSECTION_NUM, MODE
+    if aSTORAGE == GRID_SPARSE and not sparse_storage_supported():
+        raise ValueError("Sparse grid storage is supported only on CPU and CUDA")
+
+    global X, Y, N, R0, R1, LIMIT_PER_CELL, MODE, STORAGE, INCREMENTAL
+    previous_storage = STORAGE
+    previous_incremental = INCREMENTAL
     X = aX
     Y = aY
     N = aN
     R0 = aR0
     R1 = aR1
     LIMIT_PER_CELL = aLIMIT_PER_CELL
-    INTERSECTION_NUM = aINTERSECTION_NUM
     MODE = aMODE
+    STORAGE = aSTORAGE
+    INCREMENTAL = bool(incremental) and STORAGE != GRID_SPARSE
 
-    global grid_cell_size, cell_count_x, cell_count_y
+    global grid_cell_size, cell_count_x, cell_count_y, cell_count
     grid_cell_size = R1
     cell_count_x = int(X / grid_cell_size) + 1
     cell_count_y = int(Y / grid_cell_size) + 1
+    cell_count = cell_count_x * cell_count_y
+
+    # Subcells of side R0 / 2 hold only intersecting cats, finer subcells do not reduce the work
+    global subdivision, subcell_size, subcell_count, max_dense_cells
+    subdivision = MAX_SUBDIVISION
+    if R0 > 0:
+        subdivision = max(min(math.ceil(2 * R1 / R0), MAX_SUBDIVISION), 1)
+    subcell_size = grid_cell_size / subdivision
+    subcell_count = subdivision * subdivision
+    max_dense_cells = max(N // (LIMIT_PER_CELL + 1), 1)
+
+    global block_count, table_size
+    block_count = (cell_count + SPARSE_BLOCK_SIZE - 1) // SPARSE_BLOCK_SIZE
+    table_size = cell_count
+    if STORAGE == GRID_HASHED:
+        table_size = 1 << max(HASH_BUCKETS_PER_CAT * N - 1, 1).bit_length()
+
+    global slot_count, mover_capacity
+    slot_count = N
+    empty_cell_slots = 0
+    mover_capacity = 0
+    if INCREMENTAL:
+        empty_cell_slots = min(SLOT_MIN_FREE, EMPTY_SLOTS_PER_CIRCLE * N // table_size)
+        # At most min(table_size, N) cells are occupied
+        slot_count = (
+            N
+            + N // SLOT_SLACK
+            + SLOT_MIN_FREE * min(table_size, N)
+            + empty_cell_slots * table_size
+        )
+        mover_capacity = max(int(N * MAX_MOVER_SHARE), 1)
+
+    params[None] = dict(
+        n=N,
+        r0=R0,
+        r1=R1,
+        limit_per_cell=LIMIT_PER_CELL,
+        cell_size=grid_cell_size,
+        cell_count_x=cell_count_x,
+        cell_count_y=cell_count_y,
+        subdivision=subdivision,
+        subcell_size=subcell_size,
+        subcell_count=subcell_count,
+        block_count=block_count,
+        table_size=table_size,
+        refresh_stride=1,
+        refresh_phase=0,
+        neighbor_cap=0,
+        slot_count=slot_count,
+        empty_cell_slots=empty_cell_slots,
+        mover_capacity=mover_capacity,
+    )
+    global _state_refresh, _neighbor_cap
+    _state_refresh = (1, 0)
+    _neighbor_cap = 0
+
+    # Switching the incremental grid always allocates fields, so kernels are recompiled for it.
+    # Counts of circles of cells are kept by the incremental grid and must start from zeros otherwise
+    if INCREMENTAL != previous_incremental:
+        _fields.destroy()
+        _dense_fields.destroy()
+    _fields.allocate(
+        circles_id=(ti.i32, slot_count),
+        circles_per_subcell=(ti.i32, max_dense_cells * subcell_count),
+        subcell_start=(ti.i32, max_dense_cells * subcell_count + 1),
+        subcell_block_sum=(ti.i32, scan_block_count(max_dense_cells * subcell_count)),
+    )
+    global circles_id, circles_per_subcell, subcell_start, subcell_block_sum
+    circles_id = _fields["circles_id"]
+    circles_per_subcell = _fields["circles_per_subcell"]
+    subcell_start = _fields["subcell_start"]
+    subcell_block_sum = _fields["subcell_block_sum"]
+
+    # Fields of the other storage are freed. Switching storage always allocates fields,
+    # so kernels are recompiled for the new storage
+    if STORAGE == GRID_SPARSE:
+        _dense_fields.destroy()
+        _setup_sparse_cells()
+    else:
+        _sparse_fields.deactivate_all()
+        _block_fields.destroy()
+        if STORAGE != previous_storage:
+            _dense_fields.destroy()  # The dense and hashed grids share fields
+        _setup_dense_cells()
+    _setup_incremental()
+
+
+def _setup_incremental():
+    global cell_of, slot_of, movers, ordered_ids, ordered_start
+    global _needs_full_rebuild, _updates_since_rebuild, mover_share, full_rebuilds
+    _needs_full_rebuild = True
+    _updates_since_rebuild = 0
+    mover_share = 0.0
+    full_rebuilds = 0
+    if not INCREMENTAL:
+        _incremental_fields.destroy()
+        return
+    _incremental_fields.allocate(
+        cell_of=(ti.i32, N),
+        slot_of=(ti.i32, N),
+        movers=(ti.i32, mover_capacity),
+        ordered_ids=(ti.i32, N),
+        ordered_start=(ti.i32, table_size + 1),
+    )
+    cell_of = _incremental_fields["cell_of"]
+    slot_of = _incremental_fields["slot_of"]
+    movers = _incremental_fields["movers"]
+    ordered_ids = _incremental_fields["ordered_ids"]
+    ordered_start = _incremental_fields["ordered_start"]
+
+
+def set_state_refresh(stride: int, phase: int):
+    """
+    Limits the update of states to every `stride`-th cat starting from `phase`, other cats keep their states.
+    `compute_states` and neighbour lists obey it, `compute_states_symmetric` always updates all cats.
+    """
+    global _state_refresh
+    if _state_refresh != (stride, phase):
+        params[None].refresh_stride = stride
+        params[None].refresh_phase = phase
+        _state_refresh = (stride, phase)
+
+
+def set_neighbor_cap(cap: int) -> bool:
+    """
+    Limits the count of cats visited in each cell by `compute_states_symmetric` and neighbour lists,
+    0 visits all of them. Cats beyond the cap are dropped, which bounds the work and the lists
+    in dense clusters at the cost of missed neighbours. `compute_states` subdivides dense cells instead.
+
+    :return: Whether the cap changed, neighbour lists built with the other cap must be rebuilt.
+    """
+    global _neighbor_cap
+    cap = max(int(cap), 0)
+    if _neighbor_cap == cap:
+        return False
+    params[None].neighbor_cap = cap
+    _neighbor_cap = cap
+    return True
+
+
+def sparse_storage_supported() -> bool:
+    """
+    Returns whether the current backend supports sparse SNodes needed for GRID_SPARSE storage.
+    """
+    return ti.lang.impl.current_cfg().arch in (ti.x64, ti.arm64, ti.cuda)
+
+
+def _setup_dense_cells():
+    _dense_fields.allocate(
+        circles_per_cell=(ti.i32, table_size),
+        cell_start=(ti.i32, table_size + 1),
+        block_sum=(ti.i32, scan_block_count(table_size)),
+        dense_slot=(ti.i32, table_size),
+    )
+    global circles_per_cell, cell_start, block_sum, dense_slot
+    circles_per_cell = _dense_fields["circles_per_cell"]
+    cell_start = _dense_fields["cell_start"]
+    block_sum = _dense_fields["block_sum"]
+    dense_slot = _dense_fields["dense_slot"]
+
 
-    global \
-        circles_per_cell, \
-        column_sum, \
-        prefix_sum, \
-        list_head, \
-        list_cur, \
-        list_tail, \
-        circles_id
-    circles_per_cell = ti.field(dtype=ti.i32, shape=(cell_count_x, cell_count_y))
-    column_sum = ti.field(dtype=ti.i32, shape=cell_count_x)
-    prefix_sum = ti.field(dtype=ti.i32, shape=(cell_count_x, cell_count_y))
-    list_head = ti.field(dtype=ti.i32, shape=cell_count_x * cell_count_y)
-    list_cur = ti.field(dtype=ti.i32, shape=cell_count_x * cell_count_y)
-    list_tail = ti.field(dtype=ti.i32, shape=cell_count_x * cell_count_y)
-    circles_id = ti.field(dtype=ti.i32, shape=N)
+def _setup_sparse_cells():
+    capacity = max(cell_count, SPARSE_GRID_CELLS)
+    _sparse_fields.allocate(
+        cell_begin=(ti.i32, capacity),
+        cell_end=(ti.i32, capacity),
+        cell_dense_slot=(ti.i32, capacity),
+    )
+    _block_fields.allocate(
+        circles_per_block=(ti.i32, block_count),
+        block_start=(ti.i32, block_count + 1),
+        block_scan_sum=(ti.i32, scan_block_count(block_count)),
+    )
+    global cell_begin, cell_end, cell_dense_slot, cell_blocks
+    global circles_per_block, block_start, block_scan_sum
+    cell_begin = _sparse_fields["cell_begin"]
+    cell_end = _sparse_fields["cell_end"]
+    cell_dense_slot = _sparse_fields["cell_dense_slot"]
+    cell_blocks = _sparse_fields.blocks
+    circles_per_block = _block_fields["circles_per_block"]
+    block_start = _block_fields["block_start"]
+    block_scan_sum = _block_fields["block_scan_sum"]
+
+    # Reused fields may keep blocks of the previous grid
+    _sparse_fields.deactivate_all()
+    circles_per_block.fill(0)
+    block_start.fill(0)
 
 
 @ti.func
@@ -98,7 +406,8 @@ def _calc_dist(
     norm_func: ti.i32,
 ) -> ti.f32:
     """
-    Calculates the distance between two 2D points using the specified norm function.
+    Calculates the distance between two 2D points using the norm function chosen at runtime.
+    Kernels of the simulation use `_dist_measure` compiled for one norm function instead.
 
     :param pos_i: The position of the first point (x, y).
     :param pos_j: The position of the second point  (x, y).
@@ -115,151 +424,963 @@ def _calc_dist(
     return res
 
 
-@ti.kernel
-def compute_states(
+@ti.func
+def _dist_measure(
+    pos_i: ti.types.vector(2, dtype=float),
+    pos_j: ti.types.vector(2, dtype=float),
+    norm_func: ti.template(),
+) -> ti.f32:
+    """
+    Returns the distance between two 2D points by the norm function chosen at compile time.
+    The Euclidean distance is squared, so no square root is taken: compare it with `_radius_measure`.
+    """
+    delta = ti.abs(pos_i - pos_j)
+    res = 0.0
+    if ti.static(norm_func == EUCLIDEAN_NORM):
+        res = delta.dot(delta)
+    elif ti.static(norm_func == MANHATTAN_NORM):
+        res = delta.x + delta.y
+    else:
+        res = ti.max(delta.x, delta.y)
+    return res
+
+
+@ti.func
+def _radius_measure(radius: ti.f32, norm_func: ti.template()) -> ti.f32:
+    """
+    Returns `radius` in the units of `_dist_measure`.
+    """
+    res = radius
+    if ti.static(norm_func == EUCLIDEAN_NORM):
+        res = radius * radius
+    return res
+
+
+@ti.func
+def _interact_prob(dist: ti.f32) -> ti.f32:
+    """
+    Returns the probability that cats at the distance `dist` (R0 < dist <= R1) start to interact
+    in the standard mode. In the testing mode cats within R1 always interact.
+    """
+    temp = dist - params[None].r0 * 0.75 + EPS
+    return 1.0 / (temp * temp)
+
+
+@ti.func
+def _interacts(measure: ti.f32, norm_func: ti.template(), mode: ti.template()) -> bool:
+    """
+    Draws whether cats at the distance `measure` (see `_dist_measure`) within R1 start to interact.
+    The distance itself and the random number are computed only in the standard mode.
+    """
+    res = True
+    if ti.static(mode != TESTING_MODE):
+        dist = measure
+        if ti.static(norm_func == EUCLIDEAN_NORM):
+            dist = ti.sqrt(measure)
+        res = ti.random() <= _interact_prob(dist)
+    return res
+
+
+@ti.func
+def _cell_key(grid_idx: ti.types.vector(2, dtype=int)) -> ti.i32:
+    """
+    Returns the index of the cell `grid_idx` in tables of cells: the linear index of the cell
+    or, for the hashed grid, the index of its bucket.
+    """
+    grid = params[None]
+    res = 0
+    if ti.static(STORAGE == GRID_HASHED):
+        # Spatial hash of Teschner et al., the table size is a power of two
+        h = (ti.cast(grid_idx[0], ti.u32) * ti.u32(73856093)) ^ (
+            ti.cast(grid_idx[1], ti.u32) * ti.u32(19349663)
+        )
+        res = ti.cast(h & ti.cast(grid.table_size - 1, ti.u32), ti.i32)
+    else:
+        res = grid_idx[0] * grid.cell_count_y + grid_idx[1]
+    return res
+
+
+@ti.func
+def _capped_end(begin: ti.i32, end: ti.i32) -> ti.i32:
+    """
+    Returns the end of the range of circles [begin, end) of a cell visited under `set_neighbor_cap`.
+    """
+    cap = params[None].neighbor_cap
+    res = end
+    if cap > 0:
+        res = ti.min(end, begin + cap)
+    return res
+
+
+@ti.func
+def _cells_begin(first: ti.math.ivec2) -> ti.math.ivec2:
+    """
+    Returns the first cell of a range of cells starting at `first` that lies in the grid.
+    The hashed grid stores cells of any coordinates, so its ranges are not clamped to the field.
+    """
+    res = first
+    if ti.static(STORAGE != GRID_HASHED):
+        res = ti.Vector([max(first[0], 0), max(first[1], 0)])
+    return res
+
+
+@ti.func
+def _cells_end(last: ti.math.ivec2) -> ti.math.ivec2:
+    """
+    Returns the end (exclusive) of a range of cells ending at `last` (inclusive) that lies in the grid.
+    """
+    grid = params[None]
+    res = last + 1
+    if ti.static(STORAGE != GRID_HASHED):
+        res = ti.Vector(
+            [min(last[0] + 1, grid.cell_count_x), min(last[1] + 1, grid.cell_count_y)]
+        )
+    return res
+
+
+@ti.func
+def _cell_linear_idx(pos: ti.types.vector(2, dtype=float)) -> ti.i32:
+    """
+    Returns the index of the grid cell containing `pos` in tables of cells (see `_cell_key`).
+    """
+    grid = params[None]
+    return _cell_key(ti.floor(pos / grid.cell_size, int))
+
+
+@ti.func
+def _in_cell(pos: ti.types.vector(2, dtype=float), cell_x: ti.i32, cell_y: ti.i32):
+    """
+    Returns whether `pos` lies in the cell (cell_x, cell_y). Buckets of the hashed grid may hold circles
+    of other cells, which must be skipped, so that no pair is visited twice. Always true for other storages.
+    """
+    res = True
+    if ti.static(STORAGE == GRID_HASHED):
+        grid_idx = ti.floor(pos / params[None].cell_size, int)
+        res = grid_idx[0] == cell_x and grid_idx[1] == cell_y
+    return res
+
+
+@ti.func
+def _cell_range(linear_idx: ti.i32) -> ti.math.ivec2:
+    """
+    Returns the range of ids of circles of the cell `linear_idx` in `circles_id`.
+    """
+    res = ti.math.ivec2(0, 0)
+    if ti.static(STORAGE == GRID_SPARSE):
+        res = ti.math.ivec2(cell_begin[linear_idx], cell_end[linear_idx])
+    elif ti.static(INCREMENTAL):
+        begin = cell_start[linear_idx]
+        res = ti.math.ivec2(begin, begin + circles_per_cell[linear_idx])
+    else:
+        res = ti.math.ivec2(cell_start[linear_idx], cell_start[linear_idx + 1])
+    return res
+
+
+@ti.func
+def _dense_slot(linear_idx: ti.i32) -> ti.i32:
+    """
+    Returns the index of the subgrid of the cell `linear_idx` or -1 if it is not dense.
+    """
+    res = -1
+    if ti.static(STORAGE == GRID_SPARSE):
+        res = cell_dense_slot[linear_idx] - 1
+    else:
+        res = dense_slot[linear_idx]
+    return res
+
+
+@ti.func
+def _bin_circles_dense(positions: ti.template()):
+    """
+    Sorts ids of circles by cells of the dense grid or buckets of the hashed grid (counting sort)
+    into `circles_id` and assigns subgrids to dense cells.
+    """
+    grid = params[None]
+    # Compute count of circles per cell. Counts are zero here: filling of the grid below decrements them back
+    for i in range(grid.n):
+        ti.atomic_add(circles_per_cell[_cell_linear_idx(positions[i])], 1)
+
+    exclusive_scan(circles_per_cell, cell_start, block_sum, grid.table_size)
+
+    # Place the id of the circles in the right places of circles_id
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        cell_location = (
+            cell_start[linear_idx] + ti.atomic_sub(circles_per_cell[linear_idx], 1) - 1
+        )
+        circles_id[cell_location] = i
+
+    for c in range(grid.table_size):
+        dense_slot[c] = -1
+        if cell_start[c + 1] - cell_start[c] > grid.limit_per_cell:
+            dense_slot[c] = ti.atomic_add(dense_count[None], 1)
+
+
+@ti.func
+def _bin_circles_slotted(positions: ti.template()):
+    """
+    Same as `_bin_circles_dense`, but leaves free slots after circles of each cell for the incremental grid
+    and records cells and slots of circles. Counts of circles of cells are kept in circles_per_cell.
+    """
+    grid = params[None]
+    for c in range(grid.table_size):
+        circles_per_cell[c] = 0
+    for p in range(grid.slot_count):
+        circles_id[p] = -1
+    for i in range(grid.n):
+        ti.atomic_add(circles_per_cell[_cell_linear_idx(positions[i])], 1)
+
+    # Capacities of cells are scanned, then circles_per_cell counts circles placed into each cell
+    for c in range(grid.table_size):
+        count = circles_per_cell[c]
+        if count > 0:
+            circles_per_cell[c] = count + count // SLOT_SLACK + SLOT_MIN_FREE
+        else:
+            circles_per_cell[c] = grid.empty_cell_slots
+    exclusive_scan(circles_per_cell, cell_start, block_sum, grid.table_size)
+    for c in range(grid.table_size):
+        circles_per_cell[c] = 0
+
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        slot = cell_start[linear_idx] + ti.atomic_add(circles_per_cell[linear_idx], 1)
+        circles_id[slot] = i
+        cell_of[i] = linear_idx
+        slot_of[i] = slot
+
+    for c in range(grid.table_size):
+        dense_slot[c] = -1
+        if circles_per_cell[c] > grid.limit_per_cell:
+            dense_slot[c] = ti.atomic_add(dense_count[None], 1)
+
+
+@ti.func
+def _bin_circles_sparse(positions: ti.template()):
+    """
+    Sorts ids of circles by cells of the sparse grid into `circles_id` and assigns subgrids to dense cells.
+    Only sums of blocks are scanned over the whole grid, cells are visited only in blocks with circles.
+    """
+    grid = params[None]
+    # Cells of blocks occupied by the previous build are cleared, new blocks are activated by the first write
+    for b in range(grid.block_count):
+        if block_start[b + 1] > block_start[b]:
+            for k in range(SPARSE_BLOCK_SIZE):
+                cell_end[b * SPARSE_BLOCK_SIZE + k] = 0
+                cell_dense_slot[b * SPARSE_BLOCK_SIZE + k] = 0
+
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        ti.atomic_add(cell_end[linear_idx], 1)
+        ti.atomic_add(circles_per_block[linear_idx // SPARSE_BLOCK_SIZE], 1)
+
+    # Blocks left by all circles are freed
+    for b in range(grid.block_count):
+        if block_start[b + 1] > block_start[b] and circles_per_block[b] == 0:
+            ti.deactivate(cell_blocks, [ti.cast(b, ti.i32)])
+
+    exclusive_scan(circles_per_block, block_start, block_scan_sum, grid.block_count)
+
+    # Counts of circles per cell are turned into starts of cells within their blocks
+    for b in range(grid.block_count):
+        if circles_per_block[b] > 0:
+            cur_start = block_start[b]
+            for k in range(SPARSE_BLOCK_SIZE):
+                c = b * SPARSE_BLOCK_SIZE + k
+                count = cell_end[c]
+                cell_begin[c] = cur_start
+                cell_end[c] = cur_start
+                cur_start += count
+            circles_per_block[b] = 0
+
+    # Cell ends move back to their places while the cell is filled
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        circles_id[ti.atomic_add(cell_end[linear_idx], 1)] = i
+
+    # Struct-for visits only cells of active blocks
+    for c in cell_end:
+        if cell_end[c] - cell_begin[c] > grid.limit_per_cell:
+            cell_dense_slot[c] = ti.atomic_add(dense_count[None], 1) + 1
+
+
+@ti.func
+def _build_grid(positions: ti.template()):
+    """
+    Sorts ids of circles by cells of the grid (counting sort) into `circles_id`.
+    Ids of circles of dense cells (more than LIMIT_PER_CELL circles) are then sorted by subcells.
+    """
+    grid = params[None]
+    dense_count[None] = 0
+    if ti.static(STORAGE == GRID_SPARSE):
+        _bin_circles_sparse(positions)
+    elif ti.static(INCREMENTAL):
+        _bin_circles_slotted(positions)
+    else:
+        _bin_circles_dense(positions)
+
+    # Sort ids of circles of dense cells by subcells the same way, in place of their cells
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        slot = _dense_slot(linear_idx)
+        if slot >= 0:
+            ti.atomic_add(circles_per_subcell[_subcell_idx(positions[i], slot)], 1)
+
+    exclusive_scan(
+        circles_per_subcell,
+        subcell_start,
+        subcell_block_sum,
+        dense_count[None] * grid.subcell_count,
+    )
+
+    for i in range(grid.n):
+        linear_idx = _cell_linear_idx(positions[i])
+        slot = _dense_slot(linear_idx)
+        if slot >= 0:
+            sub_idx = _subcell_idx(positions[i], slot)
+            subgrid_start = subcell_start[slot * grid.subcell_count]
+            cell_location = (
+                _cell_range(linear_idx)[0]
+                + subcell_start[sub_idx]
+                - subgrid_start
+                + ti.atomic_sub(circles_per_subcell[sub_idx], 1)
+                - 1
+            )
+            circles_id[cell_location] = i
+
+
+@ti.func
+def _subcell_idx(pos: ti.types.vector(2, dtype=float), slot: ti.i32) -> ti.i32:
+    """
+    Returns the index of the subcell containing `pos` in the subgrid `slot`.
+    """
+    grid = params[None]
+    grid_idx = ti.floor(pos / grid.cell_size, int)
+    sub_idx = ti.floor(pos / grid.subcell_size, int) - grid_idx * grid.subdivision
+    # Rounding errors on borders of cells
+    sub_idx = ti.math.clamp(sub_idx, 0, grid.subdivision - 1)
+    return slot * grid.subcell_count + sub_idx[0] * grid.subdivision + sub_idx[1]
+
+
+@ti.func
+def _is_refreshed(i: ti.i32) -> bool:
+    """
+    Whether the state of the cat i is updated in this step, see `set_state_refresh`.
+    """
+    grid = params[None]
+    return i % grid.refresh_stride == grid.refresh_phase
+
+
+@ti.func
+def _near_dense_cell(grid_idx: ti.types.vector(2, dtype=int)) -> bool:
+    """
+    Returns whether any cell of the 3x3 neighbourhood of the cell `grid_idx` is dense.
+    """
+    res = False
+    begin = _cells_begin(grid_idx - 1)
+    end = _cells_end(grid_idx + 1)
+    for neigh_x in range(begin[0], end[0]):
+        for neigh_y in range(begin[1], end[1]):
+            if _dense_slot(_cell_key(ti.Vector([neigh_x, neigh_y]))) >= 0:
+                res = True
+    return res
+
+
+@ti.func
+def _compute_state_dense(
     positions: ti.template(),
-    states: ti.template(),
-    intersections: ti.template(),
-    update_intersections: ti.i8,
+    norm_func: ti.template(),
+    mode: ti.template(),
+    i: ti.i32,
+) -> ti.math.ivec2:
+    """
+    Computes the state of the cat `i` near dense cells without dropping neighbours.
+    Returns the state and the cat that caused it, -1 if none.
+
+    The search goes from near to far, so a cat inside a cluster stops at the first intersection:
+    the own subcell of the cat, then the rest of subcells within R0 and, only if there are no intersections,
+    subcells within R1 until the first interaction. Subcells farther than the search radius are skipped.
+    A cell that is not dense is treated as a single subcell.
+    """
+    grid = params[None]
+    grid_idx = ti.floor(positions[i] / grid.cell_size, int)
+    own_sub = ti.math.clamp(
+        ti.floor(positions[i] / grid.subcell_size, int) - grid_idx * grid.subdivision,
+        0,
+        grid.subdivision - 1,
+    )
+
+    r0 = _radius_measure(grid.r0, norm_func)
+    r1 = _radius_measure(grid.r1, norm_func)
+    state = STATE_IDLE
+    cause = -1
+    finished = False
+    for phase in ti.static(range(3)):
+        reach = 0.0
+        if ti.static(phase == 1):
+            reach = grid.r0
+        if ti.static(phase == 2):
+            reach = grid.r1
+        # Intersections are searched in the first two phases, interactions only for cats without them
+        if (ti.static(phase < 2) and not finished) or state == STATE_IDLE:
+            cells_begin = _cells_begin(
+                ti.floor((positions[i] - reach) / grid.cell_size, int)
+            )
+            cells_end = _cells_end(
+                ti.floor((positions[i] + reach) / grid.cell_size, int)
+            )
+            for neigh_x in range(cells_begin[0], cells_end[0]):
+                for neigh_y in range(cells_begin[1], cells_end[1]):
+                    neigh_linear_idx = _cell_key(ti.Vector([neigh_x, neigh_y]))
+                    slot = _dense_slot(neigh_linear_idx)
+                    cell_range = _cell_range(neigh_linear_idx)
+                    sub_begin = ti.Vector([0, 0])
+                    sub_end = ti.Vector([1, 1])
+                    if slot >= 0:
+                        cell_origin = ti.Vector([neigh_x, neigh_y]) * grid.subdivision
+                        sub_begin = ti.math.clamp(
+                            ti.floor((positions[i] - reach) / grid.subcell_size, int)
+                            - cell_origin,
+                            0,
+                            grid.subdivision - 1,
+                        )
+                        sub_end = ti.math.clamp(
+                            ti.floor((positions[i] + reach) / grid.subcell_size, int)
+                            - cell_origin
+                            + 1,
+                            1,
+                            grid.subdivision,
+                        )
+                    for sub_x in range(sub_begin[0], sub_end[0]):
+                        for sub_y in range(sub_begin[1], sub_end[1]):
+                            sub = ti.Vector([sub_x, sub_y])
+                            is_own = (
+                                neigh_x == grid_idx[0] and neigh_y == grid_idx[1]
+                            ) and (slot < 0 or all(sub == own_sub))
+                            begin = cell_range[0]
+                            end = cell_range[1]
+                            if ti.static(phase == 1) and is_own:
+                                end = begin  # Already visited in the first phase
+                            elif slot >= 0:
+                                sub_lo = (
+                                    ti.Vector([neigh_x, neigh_y]) * grid.subdivision
+                                    + sub
+                                ) * grid.subcell_size
+                                nearest = ti.math.clamp(
+                                    positions[i], sub_lo, sub_lo + grid.subcell_size
+                                )
+                                if ti.static(phase > 0) and (
+                                    _dist_measure(positions[i], nearest, norm_func)
+                                    > _radius_measure(reach, norm_func)
+                                ):
+                                    end = begin
+                                else:
+                                    sub_idx = (
+                                        slot * grid.subcell_count
+                                        + sub_x * grid.subdivision
+                                        + sub_y
+                                    )
+                                    subgrid_start = subcell_start[
+                                        slot * grid.subcell_count
+                                    ]
+                                    begin += subcell_start[sub_idx] - subgrid_start
+                                    end = (
+                                        begin
+                                        + subcell_start[sub_idx + 1]
+                                        - subcell_start[sub_idx]
+                                    )
+                            for p in range(begin, end):
+                                j = circles_id[p]
+                                if i != j and _in_cell(positions[j], neigh_x, neigh_y):
+                                    dist = _dist_measure(
+                                        positions[i], positions[j], norm_func
+                                    )
+                                    if ti.static(phase < 2):
+                                        if dist <= r0:
+                                            state = STATE_INTERSECTION
+                                            cause = j
+                                            finished = True
+                                            break
+                                    elif dist <= r1:
+                                        if _interacts(dist, norm_func, mode):
+                                            state = STATE_INTERACT
+                                            cause = j
+                                            finished = True
+                                            break
+                            if finished:
+                                break
+                        if finished:
+                            break
+                    if finished:
+                        break
+                if finished:
+                    break
+    return ti.math.ivec2(state, cause)
+
+
+def compute_states(
+    positions,
+    states,
     norm_func: ti.i32,
-    logged_id: ti.i32,
+    watch: int = WATCH_NONE,
+    rebuild_grid: bool = True,
 ):
     """
     Compute the states of cats based on their positions and interactions within a grid.
+    A kernel is compiled for each combination of the norm function, the running mode and the watch mode,
+    so the loop over pairs does not branch on them.
 
     :param positions: 2D-vector positions of cats.
     :param states: vector to storing states of each cat.
-    :param intersections: vector for recording cat intersections.
-    :param update_intersections: Whether to update the intersections vector (0 or 1).
     :param norm_func: norm function for distance calculation.
-    :param logged_id: ID of the cat to log state changes.
+    :param watch: Which cats have their state transitions recorded, see `transitions`.
+    :param rebuild_grid: Whether to bin cats into the grid first. The grid brought up to date
+        by `update_grid` is used otherwise.
     """
+    _compute_states(
+        positions,
+        states,
+        int(norm_func),
+        MODE,
+        int(watch),
+        bool(rebuild_grid),
+        field_pool.generation(),
+    )
 
-    # Compute count of circles per cell
-    circles_per_cell.fill(0)
-    for i in range(N):
-        cell_idx = ti.floor(positions[i] / grid_cell_size, int)
-        ti.atomic_add(circles_per_cell[cell_idx], 1)
-
-    # Compute prefix sum for each column
-    for i in range(cell_count_x):
-        cur_sum = 0
-        for j in range(cell_count_y):
-            cur_sum += circles_per_cell[i, j]
-        column_sum[i] = cur_sum
-
-    # Compute prefix sum for all grid
-    prefix_sum[0, 0] = 0
-    ti.loop_config(serialize=True)
-    for i in range(1, cell_count_x):
-        prefix_sum[i, 0] = prefix_sum[i - 1, 0] + column_sum[i - 1]
-    for i in range(cell_count_x):
-        for j in range(cell_count_y):
-            if j == 0:
-                prefix_sum[i, j] += circles_per_cell[i, j]
-            else:
-                prefix_sum[i, j] = prefix_sum[i, j - 1] + circles_per_cell[i, j]
 
-            linear_idx = i * cell_count_y + j
-            list_head[linear_idx] = prefix_sum[i, j] - circles_per_cell[i, j]
-            list_cur[linear_idx] = list_head[linear_idx]
-            list_tail[linear_idx] = prefix_sum[i, j]
+@ti.kernel
+def _compute_states(
+    positions: ti.template(),
+    states: ti.template(),
+    norm_func: ti.template(),
+    mode: ti.template(),
+    watch: ti.template(),
+    rebuild_grid: ti.template(),
+    generation: ti.template(),
+):
+    grid = params[None]
+    r0 = _radius_measure(grid.r0, norm_func)
+    r1 = _radius_measure(grid.r1, norm_func)
 
-    # Place the id of the circles in the right places of circles_id
-    for i in range(N):
-        grid_idx = ti.floor(positions[i] / grid_cell_size, int)
-        linear_idx = grid_idx[0] * cell_count_y + grid_idx[1]
-        cell_location = ti.atomic_add(list_cur[linear_idx], 1)
-        circles_id[cell_location] = i
+    if ti.static(rebuild_grid):
+        _build_grid(positions)
 
     # Compute state of each circle after filling grid
-    for i in range(N):
-        grid_idx = ti.floor(positions[i] / grid_cell_size, int)
-        x_begin = max(grid_idx[0] - 1, 0)
-        x_end = min(grid_idx[0] + 2, cell_count_x)
-        y_begin = max(grid_idx[1] - 1, 0)
-        y_end = min(grid_idx[1] + 2, cell_count_y)
+    for i in range(grid.n):
+        if not _is_refreshed(i):
+            continue
+        grid_idx = ti.floor(positions[i] / grid.cell_size, int)
+        cells_begin = _cells_begin(grid_idx - 1)
+        cells_end = _cells_end(grid_idx + 1)
+        x_begin, x_end = cells_begin[0], cells_end[0]
+        y_begin, y_end = cells_begin[1], cells_end[1]
 
         state = STATE_IDLE
-        intersect_len = 0
+        cause = -1  # Initially, no one changed state of idx
 
-        if logged_id == i:
-            logs_who_changed_id[None] = -1  # Initially, no one changed state of idx
+        # Near dense cells all neighbours are visited by subcells nearest first, otherwise cells are small
+        near_dense_cell = False
+        if dense_count[None] > 0:
+            near_dense_cell = _near_dense_cell(grid_idx)
+        if near_dense_cell:
+            found = _compute_state_dense(positions, norm_func, mode, i)
+            state = found[0]
+            cause = found[1]
+        else:
+            for neigh_x in range(x_begin, x_end):
+                for neigh_y in range(y_begin, y_end):
+                    cell_range = _cell_range(_cell_key(ti.Vector([neigh_x, neigh_y])))
+                    for p in range(cell_range[0], cell_range[1]):
+                        j = circles_id[p]
+                        if i != j and _in_cell(positions[j], neigh_x, neigh_y):
+                            dist = _dist_measure(positions[i], positions[j], norm_func)
+                            if dist <= r0:
+                                state = STATE_INTERSECTION
+                                cause = j
+                                break  # Exit early for performance
+                            elif dist <= r1:
+                                if _interacts(dist, norm_func, mode):
+                                    state = STATE_INTERACT
+                                    cause = j
 
-        for neigh_x in range(x_begin, x_end):
-            for neigh_y in range(y_begin, y_end):
-                neigh_linear_idx = neigh_x * cell_count_y + neigh_y
-                processed_neigh_num = 0
-                for p in range(
-                    list_head[neigh_linear_idx], list_tail[neigh_linear_idx]
-                ):
-                    if processed_neigh_num > LIMIT_PER_CELL:
+                    if state == STATE_INTERSECTION:
                         break
-                    processed_neigh_num += 1
-                    j = circles_id[p]
-                    if i != j:
-                        dist = _calc_dist(positions[i], positions[j], norm_func)
-                        if dist <= R0:
-                            state = STATE_INTERSECTION
-                            if logged_id == i:
-                                logs_who_changed_id[None] = j
-
-                            if not update_intersections:
-                                break
-                            else:
-                                intersections[i, intersect_len + 1] = j
-                                intersect_len += 1
-
-                                if intersect_len == INTERSECTION_NUM:
-                                    break  # Exit early for performance
-                        elif dist <= R1 and state != STATE_INTERSECTION:
-                            temp = dist - R0 * 0.75 + EPS
-                            prob = 1 if MODE == TESTING_MODE else 1.0 / (temp * temp)
-                            if ti.random() <= prob:
-                                state = STATE_INTERACT
-                                if logged_id == i:
-                                    logs_who_changed_id[None] = j
-
-                if state == STATE_INTERSECTION and (
-                    not update_intersections or intersect_len == INTERSECTION_NUM
-                ):
+
+                if state == STATE_INTERSECTION:
                     break
 
-            if state == STATE_INTERSECTION and (
-                not update_intersections or intersect_len == INTERSECTION_NUM
-            ):
-                break
+        transitions.capture(i, ti.cast(states[i], ti.i32), state, cause, watch)
+        states[i] = ti.cast(state, states.dtype)
+
+
+@ti.func
+def _interact_pair(
+    positions: ti.template(),
+    states: ti.template(),
+    norm_func: ti.template(),
+    mode: ti.template(),
+    watch: ti.template(),
+    i: ti.i32,
+    j: ti.i32,
+):
+    """
+    Evaluates the pair of cats (i, j) once and raises states of both cats.
+    """
+    grid = params[None]
+    dist = _dist_measure(positions[i], positions[j], norm_func)
+    state = STATE_IDLE
+    if dist <= _radius_measure(grid.r0, norm_func):
+        state = STATE_INTERSECTION
+    elif dist <= _radius_measure(grid.r1, norm_func):
+        if _interacts(dist, norm_func, mode):
+            state = STATE_INTERACT
 
-        if logged_id == i:
-            logs_prev_state[None] = states[i]
-            logs_new_state[None] = state
-        states[i] = state
-        intersections[i, 0] = intersect_len
+    if state != STATE_IDLE:
+        ti.atomic_max(states[i], ti.cast(state, states.dtype))
+        ti.atomic_max(states[j], ti.cast(state, states.dtype))
+        transitions.raise_cause(i, state, j, watch)
+        transitions.raise_cause(j, state, i, watch)
 
 
-def update_logs(logged_id, logs):
+def compute_states_symmetric(
+    positions,
+    states,
+    norm_func: ti.i32,
+    watch: int = WATCH_NONE,
+    rebuild_grid: bool = True,
+):
     """
-    Update logs with state change details for a specific cat.
+    Same as `compute_states`, but evaluates each pair of cats once and writes the result for both cats.
+    Each cat is paired with the cats after it in its own cell and with the cats of the forward half
+    of the 3x3 stencil: (x + 1, y - 1), (x + 1, y), (x + 1, y + 1), (x, y + 1).
 
-    :param logged_id: ID of the cat whose state changes are being logged.
-    :param logs: List to append log messages.
+    In the standard mode the random draw for interaction is made once per pair,
+    so both cats of a pair start to interact together.
     """
-    if logs_new_state[None] == logs_prev_state[None]:
-        return
-    if logs_who_changed_id[None] == -1:
-        logs.append(
-            "State of {} id changed: {} -> {}".format(
-                logged_id,
-                state_to_str[logs_prev_state[None]],
-                state_to_str[logs_new_state[None]],
-            )
-        )
-        return
-    logs.append(
-        "State of {} id changed: {} -> {} by {} id".format(
-            logged_id,
-            state_to_str[logs_prev_state[None]],
-            state_to_str[logs_new_state[None]],
-            logs_who_changed_id[None],
-        )
+    _compute_states_symmetric(
+        positions,
+        states,
+        int(norm_func),
+        MODE,
+        int(watch),
+        bool(rebuild_grid),
+        field_pool.generation(),
     )
+
+
+@ti.kernel
+def _compute_states_symmetric(
+    positions: ti.template(),
+    states: ti.template(),
+    norm_func: ti.template(),
+    mode: ti.template(),
+    watch: ti.template(),
+    rebuild_grid: ti.template(),
+    generation: ti.template(),
+):
+    grid = params[None]
+    if ti.static(rebuild_grid):
+        _build_grid(positions)
+
+    for i in range(grid.n):
+        transitions.save_state(i, ti.cast(states[i], ti.i32), watch)
+        states[i] = STATE_IDLE
+
+    # Iterate over cats in the order of cells, so cats of the same cell are processed together.
+    # Free slots of the incremental grid hold -1
+    for p in range(grid.slot_count):
+        i = circles_id[p]
+        if i < 0:
+            continue
+        grid_idx = ti.floor(positions[i] / grid.cell_size, int)
+        linear_idx = _cell_key(grid_idx)
+
+        # Cats after the cat i in its own cell
+        for q in range(p + 1, _capped_end(p + 1, _cell_range(linear_idx)[1])):
+            if _in_cell(positions[circles_id[q]], grid_idx[0], grid_idx[1]):
+                _interact_pair(
+                    positions,
+                    states,
+                    norm_func,
+                    mode,
+                    watch,
+                    i,
+                    circles_id[q],
+                )
+
+        # Forward half of the neighbour cells
+        for k in ti.static(range(4)):
+            offset = ti.static([(1, -1), (1, 0), (1, 1), (0, 1)][k])
+            neigh_x = grid_idx[0] + offset[0]
+            neigh_y = grid_idx[1] + offset[1]
+            neigh = ti.Vector([neigh_x, neigh_y])
+            if (_cells_begin(neigh) < _cells_end(neigh)).all():
+                cell_range = _cell_range(_cell_key(neigh))
+                for q in range(
+                    cell_range[0], _capped_end(cell_range[0], cell_range[1])
+                ):
+                    if _in_cell(positions[circles_id[q]], neigh_x, neigh_y):
+                        _interact_pair(
+                            positions,
+                            states,
+                            norm_func,
+                            mode,
+                            watch,
+                            i,
+                            circles_id[q],
+                        )
+
+    if ti.static(watch != WATCH_NONE):
+        for i in range(grid.n):
+            transitions.capture_raised(i, ti.cast(states[i], ti.i32), watch)
+
+
+def update_grid(positions) -> bool:
+    """
+    Brings the incremental grid up to date with `positions` before `compute_states(..., rebuild_grid=False)`.
+    Circles whose cell changed since the last update are found in one pass, and if they are few
+    they are moved to free slots of their new cells one by one, so counting, scanning and scattering
+    of all circles are skipped. The grid is binned fully when it is not known yet, when more than
+    MAX_MOVER_SHARE of circles moved, when a moved circle does not fit into its new cell,
+    when there are dense cells (their circles are sorted by subcells) and every FULL_REBUILD_INTERVAL updates.
+
+    :param positions: 2D-vector positions of cats.
+    :return: Whether the grid was binned fully. The share of moved circles is kept in `mover_share`.
+    """
+    global mover_share, full_rebuilds, _needs_full_rebuild, _updates_since_rebuild
+    rebuild = _needs_full_rebuild or _updates_since_rebuild >= FULL_REBUILD_INTERVAL
+    if _needs_full_rebuild:
+        mover_share = 1.0
+    else:
+        _detect_movers(positions, field_pool.generation())
+        count = int(mover_count[None])
+        mover_share = count / max(N, 1)
+        rebuild = rebuild or count > mover_capacity or dense_count[None] > 0
+        if not rebuild and count > 0:
+            _move_circles(positions, count, field_pool.generation())
+            rebuild = mover_overflow[None] != 0
+    if rebuild:
+        _rebuild_grid(positions, field_pool.generation())
+        full_rebuilds += 1
+        _needs_full_rebuild = False
+        _updates_since_rebuild = 0
+    else:
+        _updates_since_rebuild += 1
+    return rebuild
+
+
+def request_full_rebuild():
+    """
+    Makes the next `update_grid` bin all circles, e.g. after cats were permuted or placed anew.
+    """
+    global _needs_full_rebuild
+    _needs_full_rebuild = True
+
+
+def set_circle_count(n: int):
+    """
+    Changes the count of circles to `n` without reallocating data, `n` must not exceed N of `setup_grid_data`.
+    The incremental grid removes circles of dropped slots from their cells and takes circles of added slots
+    for movers of the next `update_grid`, so a few added or dropped circles do not make a full rebuild.
+    """
+    global N
+    if INCREMENTAL and not _needs_full_rebuild:
+        if n < N:
+            _remove_circles(n, N, field_pool.generation())
+        elif n > N:
+            _forget_circles(N, n, field_pool.generation())
+    N = n
+    params[None].n = N
+
+
+def warmup_update_grid(positions) -> int:
+    """
+    Compiles kernels of `update_grid` and returns their count.
+    """
+    _rebuild_grid(positions, field_pool.generation())
+    _detect_movers(positions, field_pool.generation())
+    _move_circles(positions, 0, field_pool.generation())
+    _compact_ids(field_pool.generation())
+    request_full_rebuild()
+    return 4
+
+
+def ids_in_cell_order():
+    """
+    Returns the field of ids of circles sorted by cells by the last build or update of the grid,
+    its first N values are used. Free slots of the incremental grid are skipped.
+    """
+    if not INCREMENTAL:
+        return circles_id
+    _compact_ids(field_pool.generation())
+    return ordered_ids
+
+
+@ti.kernel
+def _rebuild_grid(positions: ti.template(), generation: ti.template()):
+    _build_grid(positions)
+
+
+@ti.kernel
+def _detect_movers(positions: ti.template(), generation: ti.template()):
+    grid = params[None]
+    mover_count[None] = 0
+    for i in range(grid.n):
+        if _cell_linear_idx(positions[i]) != cell_of[i]:
+            k = ti.atomic_add(mover_count[None], 1)
+            if k < grid.mover_capacity:
+                movers[k] = i
+
+
+@ti.func
+def _take_out(i: ti.i32, cell: ti.i32):
+    """
+    Removes the circle `i` from the slots of its cell of the incremental grid.
+    """
+    # The last circle of the cell takes the slot of the removed one
+    last = cell_start[cell] + circles_per_cell[cell] - 1
+    j = circles_id[last]
+    circles_id[slot_of[i]] = j
+    slot_of[j] = slot_of[i]
+    circles_id[last] = -1
+    circles_per_cell[cell] -= 1
+
+
+@ti.kernel
+def _remove_circles(begin: ti.i32, end: ti.i32, generation: ti.template()):
+    # Circles of one cell must not take the last slot at the same time
+    ti.loop_config(serialize=True)
+    for i in range(begin, end):
+        if cell_of[i] >= 0:
+            _take_out(i, cell_of[i])
+            cell_of[i] = -1
+
+
+@ti.kernel
+def _forget_circles(begin: ti.i32, end: ti.i32, generation: ti.template()):
+    for i in range(begin, end):
+        cell_of[i] = -1
+
+
+@ti.kernel
+def _move_circles(positions: ti.template(), count: ti.i32, generation: ti.template()):
+    grid = params[None]
+    mover_overflow[None] = 0
+    # Movers are few, and moving them one by one keeps cells without holes without atomics
+    ti.loop_config(serialize=True)
+    for k in range(count):
+        if mover_overflow[None] == 0:
+            i = movers[k]
+            old = cell_of[i]
+            new = _cell_linear_idx(positions[i])
+            # Circles added by `set_circle_count` are not in any cell yet
+            if old >= 0:
+                _take_out(i, old)
+
+            fill = circles_per_cell[new]
+            # A full cell or a cell becoming dense needs a full rebuild
+            if (
+                fill == cell_start[new + 1] - cell_start[new]
+                or fill >= grid.limit_per_cell
+            ):
+                mover_overflow[None] = 1
+            else:
+                slot = cell_start[new] + fill
+                circles_id[slot] = i
+                slot_of[i] = slot
+                cell_of[i] = new
+                circles_per_cell[new] = fill + 1
+
+
+@ti.kernel
+def _compact_ids(generation: ti.template()):
+    grid = params[None]
+    exclusive_scan(circles_per_cell, ordered_start, block_sum, grid.table_size)
+    for c in range(grid.table_size):
+        begin = cell_start[c]
+        for k in range(circles_per_cell[c]):
+            ordered_ids[ordered_start[c] + k] = circles_id[begin + k]
+
+
+def hash_collision_stats(positions) -> dict:
+    """
+    Measures collisions of the hashed grid built by the last call of `compute_states`.
+
+    :param positions: 2D-vector positions of cats the grid was built for.
+    :return: {"table_size", "occupied_buckets", "occupied_cells", "colliding_buckets", "foreign_share"},
+        where colliding buckets hold circles of more than one cell and `foreign_share` is the share
+        of circles visited in buckets of neighbour cells that belong to other cells and are skipped.
+    """
+    if STORAGE != GRID_HASHED:
+        raise ValueError("Collisions are measured only for the hashed grid")
+    _collision_stats(positions, field_pool.generation())
+    stats = collision_counts.to_numpy()
+    visited = int(stats[3])
+    return {
+        "table_size": table_size,
+        "occupied_buckets": int(stats[0]),
+        "occupied_cells": int(stats[1]),
+        "colliding_buckets": int(stats[2]),
+        "foreign_share": int(stats[4]) / visited if visited > 0 else 0.0,
+    }
+
+
+@ti.func
+def _count_in_cell(
+    positions: ti.template(), begin: ti.i32, end: ti.i32, cell_x: ti.i32, cell_y: ti.i32
+) -> ti.i32:
+    """
+    Returns the count of circles of the cell (cell_x, cell_y) among circles_id[begin:end].
+    """
+    count = 0
+    for p in range(begin, end):
+        if _in_cell(positions[circles_id[p]], cell_x, cell_y):
+            count += 1
+    return count
+
+
+@ti.kernel
+def _collision_stats(positions: ti.template(), generation: ti.template()):
+    grid = params[None]
+    for k in ti.static(range(5)):
+        collision_counts[k] = 0
+
+    for b in range(grid.table_size):
+        bucket_range = _cell_range(b)
+        begin = bucket_range[0]
+        end = bucket_range[1]
+        if end > begin:
+            cells = 0
+            for p in range(begin, end):
+                cell = ti.floor(positions[circles_id[p]] / grid.cell_size, int)
+                # Each cell of the bucket is counted at its first circle
+                first = True
+                for q in range(begin, p):
+                    if _in_cell(positions[circles_id[q]], cell[0], cell[1]):
+                        first = False
+                        break
+                if first:
+                    cells += 1
+                    # Circles of the cell visit buckets of the 3x3 neighbourhood, circles of other cells
+                    # there are skipped as foreign
+                    own = _count_in_cell(positions, begin, end, cell[0], cell[1])
+                    neigh_begin = _cells_begin(cell - 1)
+                    neigh_end = _cells_end(cell + 1)
+                    for neigh_x in range(neigh_begin[0], neigh_end[0]):
+                        for neigh_y in range(neigh_begin[1], neigh_end[1]):
+                            neigh_range = _cell_range(
+                                _cell_key(ti.Vector([neigh_x, neigh_y]))
+                            )
+                            size = ti.cast(neigh_range[1] - neigh_range[0], ti.i64)
+                            foreign = size - _count_in_cell(
+                                positions,
+                                neigh_range[0],
+                                neigh_range[1],
+                                neigh_x,
+                                neigh_y,
+                            )
+                            ti.atomic_add(collision_counts[3], own * size)
+                            ti.atomic_add(collision_counts[4], own * foreign)
+            ti.atomic_add(collision_counts[0], 1)
+            ti.atomic_add(collision_counts[1], cells)
+            if cells > 1:
+                ti.atomic_add(collision_counts[2], 1)
@@ -0,0 +1,262 @@
+# Verlet neighbour lists: candidates of each cat within R1 + skin are cached in a CSR buffer
+# and re-evaluated every frame. The lists are rebuilt only when some cat has moved by more than skin / 2
+# since the last build, so no pair within R1 can be missed between rebuilds.
+import taichi as ti
+
+from catradar import field_pool, grid_manager, transitions
+from catradar.common import (
+    STATE_IDLE,
+    STATE_INTERACT,
+    STATE_INTERSECTION,
+    WATCH_NONE,
+)
+from catradar.grid_manager import (
+    _build_grid,
+    _capped_end,
+    _cell_key,
+    _cell_range,
+    _cells_begin,
+    _cells_end,
+    _dist_measure,
+    _in_cell,
+    _is_refreshed,
+    _interacts,
+    _radius_measure,
+)
+from catradar.scan import exclusive_scan, scan_block_count
+
+__all__ = [
+    "setup_neighbor_list_data",
+    "compute_states_with_neighbor_list",
+    "request_rebuild",
+    "set_skin",
+]
+
+N: ti.i32
+skin: ti.f32 = 0.0  # extra distance added to R1 when collecting candidates
+
+# Data for neighbour lists in CSR format
+neighbor_count = NotImplemented  # count of candidates of each cat
+neighbor_start = NotImplemented  # candidates of cat i are neighbor_ids[neighbor_start[i]:neighbor_start[i + 1]]
+neighbor_ids = NotImplemented
+block_sum = NotImplemented  # buffer for the prefix sum of neighbor_count
+build_positions = NotImplemented  # positions of cats at the last build
+
+# Maximum displacement of cats since the last build
+max_displacement = ti.field(ti.f32, shape=())
+# Total count of candidates counted by the last build, kept in i64 to detect lists not fitting i32 offsets
+candidate_total = ti.field(ti.i64, shape=())
+MAX_CANDIDATES = 2**31 - 1
+
+needs_rebuild = True
+rebuilds = 0  # count of builds since setup
+steps_since_rebuild = 0
+
+_fields = field_pool.FieldGroup("neighbor_list")
+# Candidates are kept in a separate tree, which grows with more headroom,
+# so small fluctuations of density do not cause reallocations
+_ids_fields = field_pool.FieldGroup("neighbor_ids", headroom=1.5, read_as_globals=False)
+
+
+def setup_neighbor_list_data(aN: ti.i32):
+    """
+    Setup neighbour list parameters and allocates space for neighbour list data.
+    Must be called after `setup_grid_data`. Fields are reused if they are large enough.
+    """
+    global N
+    N = aN
+
+    global neighbor_count, neighbor_start, block_sum, build_positions
+    _fields.allocate(
+        neighbor_count=(ti.i32, N),
+        neighbor_start=(ti.i32, N + 1),
+        block_sum=(ti.i32, scan_block_count(N)),
+        build_positions=(ti.f32, N, 2),
+    )
+    neighbor_count = _fields["neighbor_count"]
+    neighbor_start = _fields["neighbor_start"]
+    block_sum = _fields["block_sum"]
+    build_positions = _fields["build_positions"]
+    _allocate_ids(N)
+
+    global rebuilds
+    rebuilds = 0
+    request_rebuild()
+
+
+def set_skin(value: ti.f32):
+    """
+    Sets the skin of neighbour lists. Lists are rebuilt if it changed.
+    """
+    global skin
+    if value != skin:
+        skin = value
+        request_rebuild()
+
+
+def _allocate_ids(count: int):
+    global neighbor_ids
+    _ids_fields.allocate(neighbor_ids=(ti.i32, max(count, 1)))
+    neighbor_ids = _ids_fields["neighbor_ids"]
+
+
+def request_rebuild():
+    """
+    Forces rebuilding of neighbour lists on the next call, e.g. after cats were moved or reordered.
+    """
+    global needs_rebuild
+    needs_rebuild = True
+
+
+@ti.func
+def _for_each_candidate(
+    positions: ti.template(),
+    i: ti.i32,
+    cur_skin: ti.f32,
+    ids: ti.template(),
+    fill: ti.template(),
+) -> ti.i32:
+    """
+    Visits cats within R1 + skin by the max norm from the cat `i` and returns their count.
+    The max norm never exceeds the other norms, so the candidates are valid for every norm function.
+    If `fill` is true, ids of candidates are written to the list of the cat `i` in `ids`.
+    """
+    grid = grid_manager.params[None]
+    reach = grid.r1 + cur_skin
+    # Only cells intersecting the square of side 2 * reach around the cat are visited
+    cells_begin = _cells_begin(ti.floor((positions[i] - reach) / grid.cell_size, int))
+    cells_end = _cells_end(ti.floor((positions[i] + reach) / grid.cell_size, int))
+    x_begin, x_end = cells_begin[0], cells_end[0]
+    y_begin, y_end = cells_begin[1], cells_end[1]
+
+    count = 0
+    for neigh_x in range(x_begin, x_end):
+        for neigh_y in range(y_begin, y_end):
+            cell_range = _cell_range(_cell_key(ti.Vector([neigh_x, neigh_y])))
+            for p in range(cell_range[0], _capped_end(cell_range[0], cell_range[1])):
+                j = grid_manager.circles_id[p]
+                if i != j and _in_cell(positions[j], neigh_x, neigh_y):
+                    delta = ti.abs(positions[i] - positions[j])
+                    if ti.max(delta.x, delta.y) <= reach:
+                        if ti.static(fill):
+                            ids[neighbor_start[i] + count] = j
+                        count += 1
+    return count
+
+
+@ti.kernel
+def _count_candidates(
+    positions: ti.template(), cur_skin: ti.f32, generation: ti.template()
+):
+    _build_grid(positions)
+    n = grid_manager.params[None].n
+    candidate_total[None] = 0
+    for i in range(n):
+        neighbor_count[i] = _for_each_candidate(
+            positions, i, cur_skin, neighbor_count, False
+        )
+        candidate_total[None] += ti.cast(neighbor_count[i], ti.i64)
+    exclusive_scan(neighbor_count, neighbor_start, block_sum, n)
+
+
+@ti.kernel
+def _fill_candidates(
+    positions: ti.template(),
+    cur_skin: ti.f32,
+    ids: ti.template(),
+    generation: ti.template(),
+):
+    for i in range(grid_manager.params[None].n):
+        _for_each_candidate(positions, i, cur_skin, ids, True)
+    for i in range(grid_manager.params[None].n):
+        build_positions[i] = positions[i]
+    max_displacement[None] = 0
+
+
+@ti.kernel
+def _update_max_displacement(positions: ti.template(), generation: ti.template()):
+    max_displacement[None] = 0
+    for i in range(grid_manager.params[None].n):
+        ti.atomic_max(
+            max_displacement[None], (positions[i] - build_positions[i]).norm()
+        )
+
+
+def _rebuild(positions):
+    global needs_rebuild, rebuilds, steps_since_rebuild
+    _count_candidates(positions, skin, field_pool.generation())
+    if candidate_total[None] > MAX_CANDIDATES:
+        raise ValueError(
+            "Neighbour lists of {} candidates do not fit, "
+            "dense clusters need a smaller skin or a neighbour cap".format(
+                candidate_total[None]
+            )
+        )
+    _allocate_ids(neighbor_start[N])
+    _fill_candidates(positions, skin, neighbor_ids, field_pool.generation())
+    needs_rebuild = False
+    rebuilds += 1
+    steps_since_rebuild = 0
+
+
+@ti.kernel
+def _compute_states_from_list(
+    positions: ti.template(),
+    states: ti.template(),
+    ids: ti.template(),
+    norm_func: ti.template(),
+    mode: ti.template(),
+    watch: ti.template(),
+    generation: ti.template(),
+):
+    grid = grid_manager.params[None]
+    r0 = _radius_measure(grid.r0, norm_func)
+    r1 = _radius_measure(grid.r1, norm_func)
+    for i in range(grid.n):
+        if not _is_refreshed(i):
+            continue
+        state = STATE_IDLE
+        cause = -1
+
+        for p in range(neighbor_start[i], neighbor_start[i + 1]):
+            j = ids[p]
+            dist = _dist_measure(positions[i], positions[j], norm_func)
+            if dist <= r0:
+                state = STATE_INTERSECTION
+                cause = j
+                break
+            elif dist <= r1:
+                if _interacts(dist, norm_func, mode):
+                    state = STATE_INTERACT
+                    cause = j
+
+        transitions.capture(i, ti.cast(states[i], ti.i32), state, cause, watch)
+        states[i] = ti.cast(state, states.dtype)
+
+
+def compute_states_with_neighbor_list(
+    positions,
+    states,
+    norm_func: ti.i32,
+    watch: int = WATCH_NONE,
+):
+    """
+    Same as `grid_manager.compute_states`, but evaluates only the cached candidates of each cat.
+    Neighbour lists are rebuilt when the maximum displacement of cats since the last build exceeds skin / 2.
+    """
+    global steps_since_rebuild
+    if not needs_rebuild:
+        _update_max_displacement(positions, field_pool.generation())
+    if needs_rebuild or max_displacement[None] > skin / 2:
+        _rebuild(positions)
+    else:
+        steps_since_rebuild += 1
+    _compute_states_from_list(
+        positions,
+        states,
+        neighbor_ids,
+        int(norm_func),
+        grid_manager.MODE,
+        int(watch),
+        field_pool.generation(),
+    )
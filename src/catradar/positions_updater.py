@@ -1,13 +1,25 @@
+import numpy as np
 import taichi as ti
 from math import pi
 
+from catradar import contacts, field_pool
 from catradar.common import (
+    LAYOUT_COMPACT_SOA,
+    LAYOUT_STANDARD,
     MOVE_PATTERN_CAROUSEL,
     MOVE_PATTERN_COLLIDING,
     MOVE_PATTERN_FREE,
 )
 
-__all__ = ["setup_positions_data", "initialize_positions", "update_positions"]
+__all__ = [
+    "setup_positions_data",
+    "initialize_positions",
+    "update_positions",
+    "load_cats",
+    "write_cats",
+    "cats_numpy",
+    "set_cat_count",
+]
 
 # Data for movement pattern "CAROUSEL"
 p1_speeds = NotImplemented
@@ -23,20 +35,49 @@ X: ti.f32
 Y: ti.f32
 N: ti.i32
 
+# Parameters read by kernels at runtime, so kernels compiled for reused fields stay valid
+params = ti.Struct.field({"n": ti.i32, "x": ti.f32, "y": ti.f32}, shape=())
 
-def setup_positions_data(aX, aY, aN):
+_fields = field_pool.FieldGroup("positions")
+
+
+def setup_positions_data(aX, aY, aN, aLAYOUT=LAYOUT_STANDARD):
     """
     Setup grid parameters and allocates space for positions-related data.
+    Fields are reused if they are large enough.
+    With LAYOUT_COMPACT_SOA components of velocities are stored in separate arrays.
     """
     global X, Y, N
     X = aX
     Y = aY
     N = aN
+    params[None].n = N
+    params[None].x = X
+    params[None].y = Y
 
     global velocities, p1_angles, p1_speeds
-    velocities = ti.Vector.field(2, dtype=ti.f32, shape=N)
-    p1_angles = ti.field(dtype=ti.f32, shape=N)
-    p1_speeds = ti.field(dtype=ti.f32, shape=N)
+    _fields.allocate(
+        velocities=(
+            ti.f32,
+            N,
+            2,
+            ti.Layout.SOA if aLAYOUT == LAYOUT_COMPACT_SOA else ti.Layout.AOS,
+        ),
+        p1_angles=(ti.f32, N),
+        p1_speeds=(ti.f32, N),
+    )
+    velocities = _fields["velocities"]
+    p1_angles = _fields["p1_angles"]
+    p1_speeds = _fields["p1_speeds"]
+
+
+def set_cat_count(n: int):
+    """
+    Changes the count of cats to `n` without reallocating data, `n` must not exceed N of `setup_positions_data`.
+    """
+    global N
+    N = n
+    params[None].n = N
 
 
 @ti.func
@@ -44,23 +85,31 @@ def initialize_data_for_pos_updaters():
     """
     Initializes speed and angle for each cat with random values.
     """
-    for i in range(N):
+    for i in range(params[None].n):
         p1_speeds[i] = ti.random() * 2 + 2
         p1_angles[i] = ti.random() * 2 * pi
 
 
-@ti.kernel
-def initialize_positions(positions: ti.template(), opt: ti.i32):
+def initialize_positions(positions, opt: ti.i32):
     """
     Randomly sets initial positions and velocities based on the chosen preset.
 
     :param positions: Taichi vector field for cats positions
     :param opt: Preset option (0 or 1). 0 - randomly evenly throughout the field, 1 - All the cats are in the left corner.
     """
+    _initialize_positions(positions, opt, field_pool.generation())
+
+
+@ti.kernel
+def _initialize_positions(
+    positions: ti.template(), opt: ti.i32, generation: ti.template()
+):
     initialize_data_for_pos_updaters()
-    for i in range(N):
+    for i in range(params[None].n):
         if opt == 0:
-            positions[i] = ti.Vector([ti.random() * X, ti.random() * Y])
+            positions[i] = ti.Vector(
+                [ti.random() * params[None].x, ti.random() * params[None].y]
+            )
             velocities[i] = (
                 ti.Vector([ti.random() * 100 - 50, ti.random() * 100 - 50]) * 0.01
             )
@@ -69,92 +118,202 @@ def initialize_positions(positions: ti.template(), opt: ti.i32):
             velocities[i] = ti.Vector([10 + ti.random(), 10 + ti.random()]) * 0.5
 
 
-@ti.kernel
-def movement_patter_free():
+def load_cats(positions, cats: dict):
     """
-    Does not apply any pattern, moving in a straight line without handling collisions.
+    Writes positions, velocities and data of the carousel pattern of the first N cats.
+
+    :param positions: Taichi vector field for cats positions
+    :param cats: Numpy arrays "positions" and "velocities" of shape (N, 2), "angles" and "speeds" of shape (N,)
     """
-    pass
+    _load_cats(
+        positions,
+        np.ascontiguousarray(cats["positions"], dtype=np.float32),
+        np.ascontiguousarray(cats["velocities"], dtype=np.float32),
+        np.ascontiguousarray(cats["angles"], dtype=np.float32),
+        np.ascontiguousarray(cats["speeds"], dtype=np.float32),
+        field_pool.generation(),
+    )
 
 
 @ti.kernel
-def movement_pattern_carousel():
+def _load_cats(
+    positions: ti.template(),
+    cat_positions: ti.types.ndarray(),
+    cat_velocities: ti.types.ndarray(),
+    angles: ti.types.ndarray(),
+    speeds: ti.types.ndarray(),
+    generation: ti.template(),
+):
+    for i in range(params[None].n):
+        positions[i] = ti.Vector([cat_positions[i, 0], cat_positions[i, 1]])
+        velocities[i] = ti.Vector([cat_velocities[i, 0], cat_velocities[i, 1]])
+        p1_angles[i] = angles[i]
+        p1_speeds[i] = speeds[i]
+
+
+def write_cats(positions, slots, cats: dict):
     """
-    Applies a carousel-like movement pattern by incrementing angles and setting each cat's velocity.
-    Collisions are not handled.
+    Writes data of cats into `slots`, data of other cats is kept.
+
+    :param positions: Taichi vector field for cats positions
+    :param slots: Indices of cats to write, an array of the length of `cats`
+    :param cats: Numpy arrays in the format of `load_cats`
     """
-    for i in range(N):
-        p1_angles[i] += 0.05
-        if p1_angles[i] >= 2 * pi:
-            p1_angles[i] -= 2 * pi
-        velocities[i][0] = ti.cos(p1_angles[i]) * p1_speeds[i]
-        velocities[i][1] = ti.sin(p1_angles[i]) * p1_speeds[i]
+    _write_cats(
+        positions,
+        np.ascontiguousarray(slots, dtype=np.int32),
+        np.ascontiguousarray(cats["positions"], dtype=np.float32),
+        np.ascontiguousarray(cats["velocities"], dtype=np.float32),
+        np.ascontiguousarray(cats["angles"], dtype=np.float32),
+        np.ascontiguousarray(cats["speeds"], dtype=np.float32),
+        field_pool.generation(),
+    )
 
 
 @ti.kernel
-def movement_pattern_colliding(positions: ti.template(), intersections: ti.template()):
+def _write_cats(
+    positions: ti.template(),
+    slots: ti.types.ndarray(),
+    cat_positions: ti.types.ndarray(),
+    cat_velocities: ti.types.ndarray(),
+    angles: ti.types.ndarray(),
+    speeds: ti.types.ndarray(),
+    generation: ti.template(),
+):
+    for k in range(slots.shape[0]):
+        i = slots[k]
+        positions[i] = ti.Vector([cat_positions[k, 0], cat_positions[k, 1]])
+        velocities[i] = ti.Vector([cat_velocities[k, 0], cat_velocities[k, 1]])
+        p1_angles[i] = angles[k]
+        p1_speeds[i] = speeds[k]
+
+
+def cats_numpy(positions) -> dict:
     """
-    Updates velocities by applying a resistance if speed is high and a repelling
-    force from each intersecting neighbor.
+    Returns data of the first N cats in the format accepted by `load_cats`.
     """
-    for i in range(N):
-        self_pos = positions[i]
-        force = ti.math.vec2(0.0, 0.0)
-        if velocities[i].norm() > 1:
-            force = -(velocities[i] * p2_resistance)
+    return {
+        "positions": positions.to_numpy()[:N],
+        "velocities": velocities.to_numpy()[:N],
+        "angles": p1_angles.to_numpy()[:N],
+        "speeds": p1_speeds.to_numpy()[:N],
+    }
 
-        intersect_len = intersections[i, 0]
-        for j in range(1, intersect_len + 1):
-            interact_pos = positions[intersections[i, j]]
-            vec_interact_to_self = self_pos - interact_pos
-            dist = ti.max(vec_interact_to_self.norm(), 1)
-            force += (vec_interact_to_self / ti.pow(dist, 3)) * 10
 
-        velocities[i] += force
+@ti.func
+def _carousel_velocity(i: ti.i32) -> ti.math.vec2:
+    """
+    Applies a carousel-like movement pattern by incrementing the angle of the cat `i`
+    and returns its new velocity. Collisions are not handled.
+    """
+    angle = p1_angles[i] + 0.05
+    if angle >= 2 * pi:
+        angle -= 2 * pi
+    p1_angles[i] = angle
+    return ti.Vector([ti.cos(angle), ti.sin(angle)]) * p1_speeds[i]
 
 
-@ti.kernel
-def cursor_push(positions: ti.template(), cursor_pos: ti.math.vec2):
+@ti.func
+def _colliding_force(
+    positions: ti.template(), contact_ids: ti.template(), i: ti.i32
+) -> ti.math.vec2:
+    """
+    Returns a resistance if speed of the cat `i` is high plus a repelling force from each of its contacts.
+    """
+    self_pos = positions[i]
+    force = ti.math.vec2(0.0, 0.0)
+    if velocities[i].norm() > 1:
+        force = -(velocities[i] * p2_resistance)
+
+    for p in range(contacts.contact_start[i], contacts.contact_start[i + 1]):
+        interact_pos = positions[contact_ids[p]]
+        vec_interact_to_self = self_pos - interact_pos
+        dist = ti.max(vec_interact_to_self.norm(), 1)
+        force += (vec_interact_to_self / ti.pow(dist, 3)) * 10
+    return force
+
+
+@ti.func
+def _cursor_force(pos: ti.math.vec2, cursor_pos: ti.math.vec2) -> ti.math.vec2:
     """
-    Applies a repulsive force on cats within 100 of the cursor,
-    pushing them away based on inverse-square distance.
+    Returns a repulsive force on a cat within 100 of the cursor,
+    pushing it away based on inverse-square distance.
     """
-    for i in range(N):
-        vec_cursor_to_self = positions[i] - cursor_pos
-        cursor_dist = vec_cursor_to_self.norm()
-        if cursor_dist < 100:
-            velocities[i] += (vec_cursor_to_self / ti.pow(cursor_dist, 2)) * 100
+    force = ti.math.vec2(0.0, 0.0)
+    vec_cursor_to_self = pos - cursor_pos
+    cursor_dist = vec_cursor_to_self.norm()
+    if cursor_dist < 100:
+        force = (vec_cursor_to_self / ti.pow(cursor_dist, 2)) * 100
+    return force
 
 
 @ti.kernel
-def update_pos_on_velocity(
+def _move(
     positions: ti.template(),
+    contact_ids: ti.template(),
+    cursor_pos: ti.math.vec2,
     speed_mult: ti.f32,
     dt: ti.f32,
+    opt: ti.template(),
+    cursor_push_on: ti.template(),
+    generation: ti.template(),
 ):
     """
-    Updates cats positions based on their velocities and checks that the cats have not left the map.
+    Applies the movement pattern, the cursor force, integration and boundary reflection in one pass per cat.
+    The pattern and the cursor push are chosen at compile time, so disabled steps cost nothing.
     """
-    for i in range(N):
-        positions[i] += speed_mult * velocities[i] * dt * 60
+    if ti.static(opt == MOVE_PATTERN_COLLIDING):
+        # Forces depend on positions of neighbours, so they are applied before any cat moves
+        for i in range(params[None].n):
+            velocities[i] += _colliding_force(positions, contact_ids, i)
+
+    width = params[None].x
+    height = params[None].y
+    for i in range(params[None].n):
+        pos = positions[i]
+        vel = velocities[i]
+        if ti.static(opt == MOVE_PATTERN_CAROUSEL):
+            vel = _carousel_velocity(i)
+        if ti.static(cursor_push_on):
+            vel += _cursor_force(pos, cursor_pos)
+
+        pos += speed_mult * vel * dt * 60
         # Boundary conditions
-        if positions[i].x < 0:
-            positions[i].x = 0
-            velocities[i].x *= -1
-        if positions[i].x > X:
-            positions[i].x = X
-            velocities[i].x *= -1
-        if positions[i].y < 0:
-            positions[i].y = 0
-            velocities[i].y *= -1
-        if positions[i].y > Y:
-            positions[i].y = Y
-            velocities[i].y *= -1
+        if pos.x < 0:
+            pos.x = 0
+            vel.x *= -1
+        if pos.x > width:
+            pos.x = width
+            vel.x *= -1
+        if pos.y < 0:
+            pos.y = 0
+            vel.y *= -1
+        if pos.y > height:
+            pos.y = height
+            vel.y *= -1
+        positions[i] = pos
+        velocities[i] = vel
+
+
+def update_pos_on_velocity(positions, speed_mult: ti.f32, dt: ti.f32):
+    """
+    Updates cats positions based on their velocities and checks that the cats have not left the map.
+    """
+    _move(
+        positions,
+        positions,  # not read without the colliding pattern
+        ti.math.vec2(0, 0),
+        speed_mult,
+        dt,
+        MOVE_PATTERN_FREE,
+        False,
+        field_pool.generation(),
+    )
 
 
 def update_positions(
     positions,
-    intersections,
+    contact_ids,
     cursor_pos: ti.math.vec2,
     cursor_push_on: ti.i8,
     speed_mult: ti.f32,
@@ -163,23 +322,23 @@ def update_positions(
 ):
     """
     Updates particle positions based on movement patterns, cursor interaction, and velocities.
+    All of them are applied by one kernel compiled for each pair of the pattern and the cursor push flag.
 
     :param positions: positions of cats.
-    :param intersections: detected cats intersections (for colliding pattern).
+    :param contact_ids: ids of contacts built by `contacts.build_contacts` (for colliding pattern).
     :param cursor_pos: Position of the user click.
     :param cursor_push_on: Flag to enable or disable pushing cats by cursor.
     :param speed_mult: Multiplier for cats speeds.
     :param opt: Movement pattern option (free, carousel, colliding).
     :param dt: The time interval that has elapsed since the last start of the function, or 0 if it is the first start
     """
-    if opt == MOVE_PATTERN_FREE:
-        movement_patter_free()
-    if opt == MOVE_PATTERN_CAROUSEL:
-        movement_pattern_carousel()
-    if opt == MOVE_PATTERN_COLLIDING:
-        movement_pattern_colliding(positions, intersections)
-
-    if cursor_push_on:
-        cursor_push(positions, cursor_pos)
-
-    update_pos_on_velocity(positions, speed_mult, dt)
+    _move(
+        positions,
+        contact_ids,
+        cursor_pos,
+        speed_mult,
+        dt,
+        int(opt),
+        bool(cursor_push_on),
+        field_pool.generation(),
+    )
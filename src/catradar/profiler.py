@@ -0,0 +1,216 @@
+# Instrumentation of the hot path: named stages with timings kept in fixed-size ring buffers
+import json
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import taichi as ti
+
+__all__ = ["Profiler", "profiler"]
+
+# Returned by Profiler.stage when profiling is disabled, so a disabled stage costs one attribute check
+_DISABLED_STAGE = nullcontext()
+
+
+class _Stage:
+    """
+    Context manager measuring one execution of a named stage.
+    """
+
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler, name: str):
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        if self._profiler.sync:
+            ti.sync()  # Do not attribute previously launched kernels to this stage
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self._profiler.sync:
+            ti.sync()  # Kernels are asynchronous, wait for them to finish
+        end = time.perf_counter()
+        self._profiler.record(self._name, self._start, end - self._start)
+        return False
+
+
+class _RingBuffer:
+    """
+    Last `capacity` (start, duration) samples of one stage.
+    """
+
+    __slots__ = ("starts", "durations", "next", "count")
+
+    def __init__(self, capacity: int):
+        self.starts = np.zeros(capacity, dtype=np.float64)
+        self.durations = np.zeros(capacity, dtype=np.float64)
+        self.next = 0
+        self.count = 0
+
+    def push(self, start: float, duration: float):
+        self.starts[self.next] = start
+        self.durations[self.next] = duration
+        self.next = (self.next + 1) % len(self.starts)
+        self.count = min(self.count + 1, len(self.starts))
+
+    def samples(self):
+        """
+        Returns stored samples in chronological order.
+        """
+        if self.count < len(self.starts):
+            return self.starts[: self.count], self.durations[: self.count]
+        order = np.roll(np.arange(len(self.starts)), -self.next)
+        return self.starts[order], self.durations[order]
+
+
+class Profiler:
+    """
+    Collects timings of named stages of the hot path.
+
+    Usage:
+        with profiler.stage("compute_states"):
+            compute_states(...)
+
+    When disabled, `stage` returns a shared no-op context manager and nothing is recorded,
+    so instrumentation can stay in the code permanently.
+    """
+
+    def __init__(self, capacity: int = 600, enabled: bool = False, sync: bool = True):
+        """
+        :param capacity: Count of last samples kept for each stage.
+        :param enabled: Whether to collect samples.
+        :param sync: Whether to call `ti.sync()` around stages to measure asynchronous kernels correctly.
+        """
+        self.capacity = capacity
+        self.enabled = enabled
+        self.sync = sync
+        self._buffers = {}
+        self._epoch = time.perf_counter()
+
+    def stage(self, name: str):
+        """
+        Returns a context manager measuring the stage `name`.
+        """
+        if not self.enabled:
+            return _DISABLED_STAGE
+        return _Stage(self, name)
+
+    def trace(self, f, name: str):
+        """
+        Calls `f` measuring it as the stage `name` and returns its result.
+        """
+        if not self.enabled:
+            return f()
+        with _Stage(self, name):
+            return f()
+
+    def record(self, name: str, start: float, duration: float):
+        """
+        Stores one sample of the stage `name`. Times are in seconds from `time.perf_counter()`.
+        """
+        buffer = self._buffers.get(name)
+        if buffer is None:
+            buffer = self._buffers[name] = _RingBuffer(self.capacity)
+        buffer.push(start, duration)
+
+    def clear(self):
+        self._buffers = {}
+
+    def stages(self) -> list:
+        return list(self._buffers)
+
+    def totals_since(self, start: float) -> dict:
+        """
+        Returns total durations in seconds of samples of each stage started at `start` or later,
+        e.g. the time of each stage in the last frame: {name: seconds}.
+        """
+        res = {}
+        for name, buffer in self._buffers.items():
+            total = 0.0
+            capacity = len(buffer.starts)
+            # Walk back from the newest sample while samples are recent enough
+            for k in range(buffer.count):
+                idx = (buffer.next - 1 - k) % capacity
+                if buffer.starts[idx] < start:
+                    break
+                total += buffer.durations[idx]
+            if total > 0:
+                res[name] = total
+        return res
+
+    def stats(self) -> dict:
+        """
+        Returns statistics in milliseconds over the stored samples of each stage:
+        {name: {"count", "mean", "p50", "p95", "p99", "max"}}.
+        """
+        res = {}
+        for name, buffer in self._buffers.items():
+            _, durations = buffer.samples()
+            ms = durations * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            res[name] = {
+                "count": int(buffer.count),
+                "mean": float(ms.mean()),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(ms.max()),
+            }
+        return res
+
+    def report(self) -> str:
+        """
+        Returns statistics formatted as a table.
+        """
+        lines = [
+            "{:<20} {:>6} {:>9} {:>9} {:>9} {:>9}".format(
+                "stage, ms", "count", "p50", "p95", "p99", "max"
+            )
+        ]
+        for name, s in self.stats().items():
+            lines.append(
+                "{:<20} {:>6} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}".format(
+                    name, s["count"], s["p50"], s["p95"], s["p99"], s["max"]
+                )
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict:
+        """
+        Returns stored samples in Chrome trace event format (chrome://tracing, Perfetto).
+        """
+        events = []
+        for name, buffer in self._buffers.items():
+            starts, durations = buffer.samples()
+            for start, duration in zip(starts, durations):
+                events.append(
+                    {
+                        "name": name,
+                        "ph": "X",
+                        "ts": (start - self._epoch) * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": 0,
+                        "tid": 0,
+                    }
+                )
+        events.sort(key=lambda e: e["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def export_json(self, path: str):
+        """
+        Writes statistics of all stages as JSON.
+        """
+        with open(path, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+
+
+# Profiler used by all modules of catradar
+profiler = Profiler()
@@ -0,0 +1,193 @@
+# Initialization of the Taichi runtime. Modules declaring fields initialize it on their first import
+# with defaults from environment variables, unless `init` was called before, so importing the package
+# or constants does not start the runtime and tools can choose the backend first.
+import os
+import shutil
+import time
+
+import taichi as ti
+from taichi.lang import impl
+
+__all__ = [
+    "init",
+    "ensure_initialized",
+    "is_initialized",
+    "startup_report",
+    "cache_dir",
+    "cache_bytes",
+    "clear_cache",
+    "init_env",
+]
+
+ARCHES = {
+    "cpu": ti.cpu,
+    "gpu": ti.gpu,
+    "cuda": ti.cuda,
+    "vulkan": ti.vulkan,
+    "metal": ti.metal,
+    "opengl": ti.opengl,
+}
+
+# Arguments `ti.init` was called with, None before initialization by `init`
+init_args = None
+# Wall-clock time of `ti.init` in seconds
+init_seconds = None
+
+
+def is_initialized() -> bool:
+    """
+    Returns whether the Taichi runtime is initialized, by `init` or by `ti.init` directly.
+    """
+    return impl.get_runtime().prog is not None
+
+
+def cache_dir() -> str:
+    """
+    Returns the directory of the offline cache of compiled kernels: CATRADAR_CACHE_DIR
+    or catradar/kernels in the user cache directory.
+    """
+    if "CATRADAR_CACHE_DIR" in os.environ:
+        return os.environ["CATRADAR_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "catradar", "kernels")
+
+
+def cache_bytes() -> int:
+    """
+    Returns the size of files in the offline cache in bytes, 0 if the cache is empty.
+    """
+    total = 0
+    for root, _, files in os.walk(cache_dir()):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def clear_cache():
+    """
+    Removes kernels compiled by previous runs. Kernels of the current run are kept in memory.
+    """
+    shutil.rmtree(cache_dir(), ignore_errors=True)
+
+
+def _env_defaults() -> dict:
+    """
+    Returns default arguments of `init` from environment variables: CATRADAR_ARCH (one of ARCHES),
+    CATRADAR_THREADS, CATRADAR_DEVICE_MEMORY_GB, CATRADAR_OFFLINE_CACHE and CATRADAR_DEBUG (0 or 1).
+    Without CATRADAR_ARCH the GPU is used, or the CPU in debug mode on GitHub Actions.
+    The offline cache is enabled by default.
+    """
+    env = os.environ
+    defaults = {"arch": "gpu", "offline_cache": True}
+    if "CATRADAR_ARCH" in env:
+        defaults["arch"] = env["CATRADAR_ARCH"]
+    elif env.get("GITHUB_ACTIONS") == "true":
+        defaults.update(arch="cpu", debug=True)
+    if "CATRADAR_THREADS" in env:
+        defaults["cpu_max_num_threads"] = int(env["CATRADAR_THREADS"])
+    if "CATRADAR_DEVICE_MEMORY_GB" in env:
+        defaults["device_memory_GB"] = float(env["CATRADAR_DEVICE_MEMORY_GB"])
+    if "CATRADAR_OFFLINE_CACHE" in env:
+        defaults["offline_cache"] = env["CATRADAR_OFFLINE_CACHE"] == "1"
+    if "CATRADAR_DEBUG" in env:
+        defaults["debug"] = env["CATRADAR_DEBUG"] == "1"
+    return defaults
+
+
+def init_env(**args) -> dict:
+    """
+    Returns environment variables that make `init` without arguments use `args`,
+    e.g. for child processes that initialize the runtime on import.
+
+    :param args: Arguments of `init`.
+    """
+    names = {
+        "arch": "CATRADAR_ARCH",
+        "cpu_max_num_threads": "CATRADAR_THREADS",
+        "device_memory_GB": "CATRADAR_DEVICE_MEMORY_GB",
+        "offline_cache": "CATRADAR_OFFLINE_CACHE",
+        "debug": "CATRADAR_DEBUG",
+    }
+    env = {}
+    for key, value in args.items():
+        if isinstance(value, bool):
+            value = int(value)
+        env[names[key]] = str(value)
+    return env
+
+
+def init(
+    arch: str = None,
+    cpu_max_num_threads: int = None,
+    device_memory_GB: float = None,
+    offline_cache: bool = None,
+    debug: bool = None,
+):
+    """
+    Initializes the Taichi runtime for catradar. Must be called before importing modules that declare
+    fields (`catradar.simulation` and the modules it uses), otherwise they initialize the runtime
+    with the defaults. Arguments left as None take their defaults from environment variables
+    (see `_env_defaults`) or from Taichi.
+
+    :param arch: Backend: "cpu", "gpu", "cuda", "vulkan", "metal" or "opengl".
+    :param cpu_max_num_threads: Count of threads of the CPU backend.
+    :param device_memory_GB: Size of the memory pool preallocated on the GPU.
+    :param offline_cache: Whether compiled kernels are cached on disk between runs, in `cache_dir()`.
+    :param debug: Whether Taichi checks bounds of field accesses.
+    :raises RuntimeError: If the runtime is already initialized with other arguments.
+    """
+    global init_args, init_seconds
+    args = _env_defaults()
+    requested = dict(
+        arch=arch,
+        cpu_max_num_threads=cpu_max_num_threads,
+        device_memory_GB=device_memory_GB,
+        offline_cache=offline_cache,
+        debug=debug,
+    )
+    args.update({key: value for key, value in requested.items() if value is not None})
+    if args["arch"] not in ARCHES:
+        raise ValueError(
+            "Unknown arch {!r}, expected one of {}".format(args["arch"], list(ARCHES))
+        )
+
+    if is_initialized():
+        if args == init_args:
+            return
+        # Initializing again would destroy fields declared by already imported modules
+        raise RuntimeError(
+            "Taichi runtime is already initialized with {}, "
+            "catradar.init must be called before importing the simulation".format(
+                init_args
+            )
+        )
+
+    start = time.perf_counter()
+    ti_args = {**args, "arch": ARCHES[args["arch"]]}
+    if args["offline_cache"]:
+        ti_args["offline_cache_file_path"] = cache_dir()
+    ti.init(**ti_args)
+    init_seconds = time.perf_counter() - start
+    init_args = args
+
+
+def ensure_initialized():
+    """
+    Initializes the runtime with the defaults unless it is already initialized.
+    """
+    if not is_initialized():
+        init()
+
+
+def startup_report() -> dict:
+    """
+    Returns the backend chosen by Taichi, the arguments of `init`, the time of `ti.init` in seconds
+    and the directory of the offline cache.
+    """
+    return {
+        "arch": str(impl.current_cfg().arch) if is_initialized() else None,
+        "init_args": init_args,
+        "init_seconds": init_seconds,
+        "cache_dir": cache_dir(),
+    }
@@ -0,0 +1,48 @@
+# Parallel exclusive prefix sum shared by the grid and CSR-like buffers
+import taichi as ti
+
+__all__ = ["SCAN_BLOCK_SIZE", "scan_block_count", "exclusive_scan"]
+
+# Count of values scanned sequentially by one thread.
+# Blocks are scanned in parallel, only the sums of blocks are scanned sequentially
+SCAN_BLOCK_SIZE = 1024
+
+
+def scan_block_count(n: int) -> int:
+    """
+    Returns the size of the buffer for block sums needed to scan `n` values.
+    """
+    return max((n + SCAN_BLOCK_SIZE - 1) // SCAN_BLOCK_SIZE, 1)
+
+
+@ti.func
+def exclusive_scan(
+    values: ti.template(), starts: ti.template(), block_sum: ti.template(), n: ti.i32
+):
+    """
+    Computes exclusive prefix sums of the first `n` values of `values` into `starts` with a blocked scan:
+    blocks of values are scanned in parallel, then sums of blocks are scanned sequentially
+    and added to the values of the following blocks in parallel.
+
+    Must be called from the top level of a kernel.
+
+    :param values: 1D field of at least n values.
+    :param starts: 1D field of at least n + 1 values, starts[n] is the total sum.
+    :param block_sum: 1D field of at least `scan_block_count(n)` values.
+    :param n: Count of scanned values.
+    """
+    block_count = ti.max((n + SCAN_BLOCK_SIZE - 1) // SCAN_BLOCK_SIZE, 1)
+    for b in range(block_count):
+        cur_sum = 0
+        for k in range(b * SCAN_BLOCK_SIZE, ti.min((b + 1) * SCAN_BLOCK_SIZE, n)):
+            starts[k] = cur_sum
+            cur_sum += values[k]
+        block_sum[b] = cur_sum
+
+    ti.loop_config(serialize=True)
+    for b in range(1, block_count):
+        block_sum[b] += block_sum[b - 1]
+
+    for k in range(SCAN_BLOCK_SIZE, n):
+        starts[k] += block_sum[k // SCAN_BLOCK_SIZE - 1]
+    starts[n] = block_sum[block_count - 1]
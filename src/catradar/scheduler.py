@@ -0,0 +1,115 @@
+# Fixed timestep of the simulation decoupled from rendering. Elapsed wall-clock time is accumulated
+# and spent in steps of a constant dt: a slow frame makes several substeps instead of one long step,
+# and when frames are faster than steps some frames make no step. Cats move the same distance per step
+# whatever the frame rate is.
+import time
+from collections import deque
+
+__all__ = ["FixedStepScheduler", "STEP_RATE", "MAX_SUBSTEPS"]
+
+# Simulation steps per second by default
+STEP_RATE = 60
+# Limit of substeps per frame. Time over the limit is dropped, so a machine that can't keep up
+# slows the simulation down instead of making ever more substeps per frame
+MAX_SUBSTEPS = 4
+# Window of measurement of rates in seconds
+RATE_WINDOW = 1.0
+
+
+class FixedStepScheduler:
+    """
+    Accumulator of wall-clock time that advances the simulation by steps of a fixed dt.
+    Rates of simulation steps and of rendered frames are measured separately.
+    """
+
+    def __init__(
+        self,
+        step_rate: float = STEP_RATE,
+        max_substeps: int = MAX_SUBSTEPS,
+        clock=time.perf_counter,
+    ):
+        """
+        :param step_rate: Simulation steps per second of simulated time.
+        :param max_substeps: Limit of steps made by one `advance`.
+        :param clock: Function returning the current time in seconds.
+        """
+        self.step_rate = step_rate
+        self.max_substeps = max_substeps
+        self.clock = clock
+        self.accumulator = 0.0  # Time not yet spent in steps
+        self.dropped_seconds = 0.0  # Time dropped because of the limit of substeps
+        self._last = None
+        # Times of the last frames and steps within `RATE_WINDOW`
+        self._frame_times = deque()
+        self._step_times = deque()
+
+    @property
+    def dt(self) -> float:
+        return 1.0 / self.step_rate
+
+    @property
+    def alpha(self) -> float:
+        """
+        Share of the next step already elapsed, for interpolating between the last two steps.
+        """
+        return self.accumulator / self.dt
+
+    def advance(self, step) -> int:
+        """
+        Adds the time elapsed since the previous call and makes the steps it covers.
+        The first call only starts the clock.
+
+        :param step: Function `step(n, dt)` making `n` steps of `dt` seconds, e.g. `Simulation.step`.
+        :return: Count of made steps.
+        """
+        now = self.clock()
+        if self._last is not None:
+            self.accumulator += now - self._last
+        self._last = now
+
+        dt = self.dt
+        steps = int(self.accumulator / dt)
+        if steps > self.max_substeps:
+            self.dropped_seconds += (steps - self.max_substeps) * dt
+            self.accumulator -= (steps - self.max_substeps) * dt
+            steps = self.max_substeps
+        if steps > 0:
+            # Steps are dispatched at once, kernels run asynchronously while the frame is drawn
+            step(steps, dt)
+            self.accumulator -= steps * dt
+        self._count(self._frame_times, now, 1)
+        self._count(self._step_times, now, steps)
+        return steps
+
+    def reset(self):
+        """
+        Drops accumulated time, e.g. after a pause or a reset of the simulation.
+        """
+        self.accumulator = 0.0
+        self._last = None
+
+    @property
+    def steps_per_second(self) -> float:
+        """
+        Simulation steps per second of wall-clock time over the last `RATE_WINDOW`.
+        """
+        return self._rate(self._step_times)
+
+    @property
+    def frames_per_second(self) -> float:
+        """
+        Rendered frames per second over the last `RATE_WINDOW`.
+        """
+        return self._rate(self._frame_times)
+
+    def _count(self, times: deque, now: float, count: int):
+        times.append((now, count))
+        while times and times[0][0] < now - RATE_WINDOW:
+            times.popleft()
+
+    def _rate(self, times: deque) -> float:
+        if len(times) < 2:
+            return 0.0
+        span = times[-1][0] - times[0][0]
+        # Counts of the first entry were made before the measured span
+        return sum(count for _, count in list(times)[1:]) / max(span, 1e-9)
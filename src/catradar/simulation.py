@@ -0,0 +1,695 @@
+import functools
+import time
+
+import numpy as np
+import taichi as ti
+
+from catradar.common import (
+    DEFAULT_PARAMS,
+    EUCLIDEAN_NORM,
+    LAYOUT_COMPACT_SOA,
+    LAYOUT_STANDARD,
+    MANHATTAN_NORM,
+    MAX_NORM,
+    MOVE_PATTERN_CAROUSEL,
+    MOVE_PATTERN_COLLIDING,
+    MOVE_PATTERN_FREE,
+    STANDARD_MODE,
+    STATE_IDLE,
+    WATCH_ALL,
+    WATCH_NONE,
+    WATCH_SET,
+)
+from catradar.grid_manager import (
+    compute_states,
+    compute_states_symmetric,
+    hash_collision_stats,
+    request_full_rebuild,
+    set_circle_count,
+    set_neighbor_cap,
+    set_state_refresh,
+    setup_grid_data,
+    update_grid,
+    warmup_update_grid,
+)
+from catradar.positions_updater import (
+    cats_numpy,
+    initialize_positions,
+    load_cats,
+    set_cat_count,
+    setup_positions_data,
+    update_positions,
+    write_cats,
+)
+from catradar import (
+    cell_order,
+    contacts,
+    field_pool,
+    grid_manager,
+    neighbor_list,
+    transitions,
+)
+from catradar.event_log import EVENT_DTYPE, EventLog
+from catradar.profiler import profiler
+
+__all__ = ["Simulation", "DEFAULT_PARAMS", "LIMIT_PER_CELL"]
+
+# Limit of cats per cell for grid algorithm: only the threshold above which `compute_states` subdivides
+# a cell into subcells. The symmetric kernel and neighbour lists visit whole cells, `neighbor_cap` caps them.
+# User can't change it, this value was obtained by running tests several times with different limits
+LIMIT_PER_CELL: ti.i32 = 100
+
+_fields = field_pool.FieldGroup("simulation", read_as_globals=False)
+
+
+class Simulation:
+    """
+    Owns the data shared between modules (positions, states) and steps the simulation
+    without any dependency on the UI.
+
+    Grid and positions data live in module-level state of `grid_manager` and `positions_updater`,
+    and fields of cats are taken from a module-level pool, so only one simulation can be active at a time.
+    """
+
+    def __init__(self, params: dict = None, mode: ti.i32 = STANDARD_MODE):
+        self.params = dict(DEFAULT_PARAMS)
+        self.mode = mode
+
+        # "Soft" parameters. Changing them does not require rebuilding the grid
+        self.movement_pattern: ti.i32 = MOVE_PATTERN_FREE
+        self.norm_func: ti.i32 = EUCLIDEAN_NORM
+        self.speed_mult: ti.f32 = 1
+        self.cursor_push_on: ti.i8 = 0
+        self.cursor_pos = ti.math.vec2(-1000, -1000)
+        # Every `reorder_interval` steps data of cats is permuted in the order of grid cells. 0 disables it
+        self.reorder_interval: ti.i32 = 0
+        # Skin of Verlet neighbour lists. 0 disables them and the grid is searched every step
+        self.neighbor_skin: ti.f32 = 0
+        # Whether each pair of cats is evaluated once for both cats (ignored with neighbour lists)
+        self.symmetric_pairs = False
+        # Share of cats whose states are recomputed each step, in turns. Others keep their states until
+        # their turn. Symmetric pairs always recompute all cats
+        self.state_refresh: ti.f32 = 1.0
+        # Cats visited per cell by symmetric pairs and neighbour lists, 0 visits all of them.
+        # A cap bounds their work in dense clusters, but drops neighbours beyond it
+        self.neighbor_cap: ti.i32 = 0
+
+        # Logging. Negative logged_id disables it
+        self.logged_id: ti.i32 = -1
+        self.logs = EventLog()  # Last state changes of the logged cat
+
+        # Capture of state transitions, see `watch`. The logged cat is watched as well
+        # IDs of cats watched by `watch`, None if there are none
+        self._watched_ids = None
+        self._watch_all = False
+        # Capacity of the buffer of transitions, None for the default
+        self._watch_capacity = None
+        self._transition_chunks = []  # Drained transitions of watched cats not collected yet
+        # Count of transitions dropped because the buffer was full
+        self.dropped_transitions = 0
+
+        self.positions = NotImplemented  # Positions of cats
+        self.states = NotImplemented  # States of cats
+
+        self.steps_done = 0
+        # Count of cats data is allocated for, at least N. `resize` changes N up to it without reallocating
+        self._capacity = 0
+        # Whether data of cats is stored in slots different from their IDs
+        self.reordered = False
+        # Whether neighbour lists are allocated for the current data
+        self._neighbor_lists_ready = False
+        # Whether contacts are allocated for the current data and built for the current positions
+        self._contacts_ready = False
+        self._contacts_fresh = False
+        # Whether the buffer of transitions is allocated for the current data
+        self._transitions_ready = False
+        # The logged cat the watch mask was built for, None if the mask is stale
+        self._mask_logged_id = None
+        self.reset(params)
+
+    @property
+    def N(self) -> int:
+        return self.params["N"]
+
+    def reset(self, params: dict = None):
+        """
+        Applies new "hard" parameters (missing keys keep their current values),
+        re-allocates data that does not fit into the allocated fields and initializes positions.
+        """
+        if params is not None:
+            unknown = set(params) - set(DEFAULT_PARAMS)
+            if unknown:
+                raise ValueError("Unknown simulation parameters: {}".format(unknown))
+            self.params.update(params)
+        self._setup_data()
+        self.reordered = False
+        self._neighbor_lists_ready = False
+        # Contacts are allocated again only if the colliding pattern or an export needs them
+        contacts.release_contacts_data()
+        self._contacts_ready = False
+        transitions.release_transitions_data()
+        self._transitions_ready = False
+        self._mask_logged_id = None
+        self._transition_chunks = []
+        self.restart()
+
+    def _setup_data(self, capacity: int = 0):
+        """
+        Makes fields of cats, positions and the grid fit the current "hard" parameters.
+
+        :param capacity: Count of cats to allocate data for if it is larger than N.
+        """
+        p = self.params
+        self._capacity = max(p["N"], capacity)
+        # Fields may be larger than N, only the first N elements are used.
+        # Compact layouts keep states in one byte, they take only three values
+        vector_layout = (
+            ti.Layout.SOA if p["layout"] == LAYOUT_COMPACT_SOA else ti.Layout.AOS
+        )
+        _fields.allocate(
+            positions=(ti.f32, self._capacity, 2, vector_layout),
+            states=(
+                ti.i32 if p["layout"] == LAYOUT_STANDARD else ti.u8,
+                self._capacity,
+            ),
+        )
+        self.positions = _fields["positions"]
+        self.states = _fields["states"]
+
+        setup_positions_data(p["X"], p["Y"], self._capacity, p["layout"])
+        setup_grid_data(
+            p["X"],
+            p["Y"],
+            self._capacity,
+            p["R0"],
+            p["R1"],
+            LIMIT_PER_CELL,
+            self.mode,
+            p["grid_storage"],
+            p["incremental_grid"],
+        )
+        if p["N"] < self._capacity:
+            set_cat_count(p["N"])
+            set_circle_count(p["N"])
+
+    def restart(self):
+        """
+        Re-initializes positions of cats with the current parameters without reallocating data.
+        """
+        initialize_positions(self.positions, self.params["init_opt"])
+        # Reused fields keep states of the previous run, transitions are counted from idle cats
+        self.states.fill(STATE_IDLE)
+        neighbor_list.request_rebuild()
+        request_full_rebuild()
+        self._contacts_fresh = False
+        self.steps_done = 0
+
+    def move(self, dt: ti.f32 = 1 / 60):
+        """
+        Moves cats according to the current movement pattern.
+
+        :param dt: Time interval of the step in seconds.
+        """
+        contact_ids = self.positions  # not read without the colliding pattern
+        if self.movement_pattern == MOVE_PATTERN_COLLIDING:
+            if not self._contacts_fresh:
+                self._build_contacts(rebuild_grid=True)
+            contact_ids = contacts.contact_ids
+        with profiler.stage("update_positions"):
+            update_positions(
+                self.positions,
+                contact_ids,
+                self.cursor_pos,
+                self.cursor_push_on,
+                self.speed_mult,
+                self.movement_pattern,
+                dt,
+            )
+
+    def update_states(self, drain_logs: bool = True):
+        """
+        Recomputes states of cats and collects logs for the logged cat.
+
+        :param drain_logs: Whether transitions of the logged cat are read from the device now.
+            Reading them waits for the kernels, so `step` reads them once after the last substep
+            when only the logged cat is watched. A watch set is drained after every step as before,
+            so the buffer still holds transitions of one step.
+        """
+        watch = self._watch_mode()
+        if watch != WATCH_NONE:
+            self._prepare_watch(watch)
+        stride = max(round(1 / max(self.state_refresh, 1e-6)), 1)
+        set_state_refresh(stride, self.steps_done % stride)
+        if set_neighbor_cap(self.neighbor_cap):
+            neighbor_list.request_rebuild()
+        compute = compute_states_symmetric if self.symmetric_pairs else compute_states
+        if self.neighbor_skin > 0:
+            if not self._neighbor_lists_ready:
+                neighbor_list.setup_neighbor_list_data(self.N)
+                self._neighbor_lists_ready = True
+            neighbor_list.set_skin(self.neighbor_skin)
+            compute = neighbor_list.compute_states_with_neighbor_list
+        elif grid_manager.INCREMENTAL:
+            with profiler.stage("update_grid"):
+                update_grid(self.positions)
+            compute = functools.partial(compute, rebuild_grid=False)
+        with profiler.stage("compute_states"):
+            compute(self.positions, self.states, self.norm_func, watch)
+        self._contacts_fresh = False
+        if self.movement_pattern == MOVE_PATTERN_COLLIDING:
+            # Neighbour lists do not rebuild the grid every step
+            self._build_contacts(rebuild_grid=self.neighbor_skin > 0)
+        if self.logged_id >= 0 and drain_logs:
+            with profiler.stage("update_logs"):
+                self._drain_transitions()
+
+    def watch(self, cat_ids, capacity: int = None):
+        """
+        Starts capturing state transitions of cats with `cat_ids` on the device, replacing the previous
+        watch set. Transitions are collected by `transitions_numpy`.
+
+        :param cat_ids: IDs of cats to watch. An empty sequence stops capturing.
+        :param capacity: Count of transitions the device buffer holds between drains, one per watched cat
+            by default. Transitions over the capacity are dropped and counted in `dropped_transitions`.
+            Enlarging the buffer recompiles kernels, call `warmup` again to do it before the run.
+        """
+        ids = np.unique(np.asarray(cat_ids, dtype=np.int64))
+        if len(ids) > 0 and (ids[0] < 0 or ids[-1] >= self.N):
+            raise ValueError("IDs of watched cats must be in [0, {})".format(self.N))
+        self._drain_transitions()
+        self._watched_ids = ids if len(ids) > 0 else None
+        self._watch_all = False
+        self._set_watch_capacity(capacity)
+
+    def watch_all(self, capacity: int = None):
+        """
+        Starts capturing state transitions of all cats, see `watch`.
+        """
+        self._drain_transitions()
+        self._watched_ids = None
+        self._watch_all = True
+        self._set_watch_capacity(capacity)
+
+    def unwatch(self):
+        """
+        Stops capturing transitions of watched cats. Transitions captured so far are discarded.
+        """
+        self._watched_ids = None
+        self._watch_all = False
+        self._mask_logged_id = None
+        self._transition_chunks = []
+
+    def transitions_numpy(self) -> np.ndarray:
+        """
+        Returns transitions of watched cats captured since the last call as a structured array
+        of `EVENT_DTYPE` with IDs of cats, ordered by frames. The order of transitions within a frame
+        is not defined.
+        """
+        self._drain_transitions()
+        chunks = self._transition_chunks
+        self._transition_chunks = []
+        if not chunks:
+            return np.zeros(0, dtype=EVENT_DTYPE)
+        return np.concatenate(chunks)
+
+    def _watch_mode(self) -> int:
+        if self._watch_all:
+            return WATCH_ALL
+        if self._watched_ids is not None or self.logged_id >= 0:
+            return WATCH_SET
+        return WATCH_NONE
+
+    def _watch_count(self) -> int:
+        if self._watch_all:
+            return self.N
+        return (0 if self._watched_ids is None else len(self._watched_ids)) + 1
+
+    def _set_watch_capacity(self, capacity: int = None):
+        self._watch_capacity = capacity
+        self._mask_logged_id = None
+        # Set up again on the next update, fields are reallocated only if the buffer is too small
+        self._transitions_ready = False
+
+    def _prepare_watch(self, watch: int):
+        """
+        Allocates the buffer of transitions and rebuilds the watch mask if it is stale.
+        """
+        if not self._transitions_ready:
+            capacity = self._watch_capacity
+            if capacity is None:
+                capacity = max(self._watch_count(), 1024)
+            transitions.setup_transitions_data(self.N, capacity)
+            self._transitions_ready = True
+        if watch == WATCH_SET and self._mask_logged_id != self.logged_id:
+            ids = self._watched_ids if self._watched_ids is not None else []
+            if self.logged_id >= 0:
+                ids = np.append(ids, self.logged_id)
+            ids = np.asarray(ids, dtype=np.int64)
+            if self.reordered:
+                ids = cell_order.slot_of.to_numpy()[ids]
+            transitions.set_watched(ids)
+            self._mask_logged_id = self.logged_id
+        transitions.set_frame(self.steps_done)
+
+    def _drain_transitions(self):
+        """
+        Moves transitions from the device buffer to the log of the logged cat and to collected transitions.
+        """
+        if not self._transitions_ready:
+            return
+        records, dropped = transitions.drain()
+        self.dropped_transitions += dropped
+        if len(records) == 0:
+            return
+        cat_ids = cell_order.cat_ids.to_numpy()[: self.N] if self.reordered else None
+        # Frames are recorded one after another, so records are already ordered by frames
+        events = transitions.to_events(records, cat_ids)
+        if self.logged_id >= 0:
+            self.logs.extend(events[events["cat_id"] == self.logged_id])
+        if self._watch_all:
+            self._transition_chunks.append(events)
+        elif self._watched_ids is not None:
+            # Only the logged cat may be watched without being in the watch set
+            ids = self._watched_ids
+            k = np.searchsorted(ids, self.logged_id)
+            if self.logged_id >= 0 and (k == len(ids) or ids[k] != self.logged_id):
+                events = events[events["cat_id"] != self.logged_id]
+            self._transition_chunks.append(events)
+
+    def warmup(self) -> dict:
+        """
+        Compiles kernels for the current fields in every variant reachable by changing "soft" parameters
+        (movement pattern, cursor push, norm, watching transitions, symmetric pairs), so switching them
+        later does not stall a frame. Contacts and the buffer of transitions are allocated as well,
+        because allocating them later changes `field_pool.generation()` and recompiles all kernels. Kernels are compiled by running them,
+        so positions are re-initialized by `restart` afterwards.
+
+        Returns the count of warmed up variants and the time of the warm-up in seconds.
+        """
+        start = time.perf_counter()
+        soft = (
+            self.movement_pattern,
+            self.cursor_push_on,
+            self.norm_func,
+            self.logged_id,
+            self.symmetric_pairs,
+            self._watched_ids,
+            self._watch_all,
+        )
+        logs = self.logs
+        self._drain_transitions()
+        chunks = self._transition_chunks
+        dropped = self.dropped_transitions
+        profiler_enabled = profiler.enabled
+        profiler.enabled = False
+        variants = 0
+        try:
+            for pattern in [
+                MOVE_PATTERN_FREE,
+                MOVE_PATTERN_CAROUSEL,
+                MOVE_PATTERN_COLLIDING,
+            ]:
+                for cursor_push_on in [0, 1]:
+                    self.movement_pattern = pattern
+                    self.cursor_push_on = cursor_push_on
+                    self.move(0.0)
+                    variants += 1
+            self.movement_pattern = MOVE_PATTERN_FREE
+            self.logs = EventLog(logs.capacity)
+            # Neighbour lists ignore symmetric pairs
+            traversals = [False] if self.neighbor_skin > 0 else [False, True]
+            for norm in [EUCLIDEAN_NORM, MANHATTAN_NORM, MAX_NORM]:
+                self.norm_func = norm
+                for watch in [WATCH_NONE, WATCH_SET, WATCH_ALL]:
+                    # The logged cat alone makes the watch set
+                    self._watched_ids = None
+                    self._watch_all = watch == WATCH_ALL
+                    self.logged_id = 0 if watch == WATCH_SET else -1
+                    for symmetric in traversals:
+                        self.symmetric_pairs = symmetric
+                        self.update_states()
+                        variants += 1
+                for rebuild_grid in [False, True]:
+                    self._build_contacts(rebuild_grid)
+                    variants += 1
+            if grid_manager.INCREMENTAL and self.neighbor_skin == 0:
+                variants += warmup_update_grid(self.positions)
+            if self.reorder_interval > 0:
+                self.reorder()
+                variants += 1
+        finally:
+            (
+                self.movement_pattern,
+                self.cursor_push_on,
+                self.norm_func,
+                self.logged_id,
+                self.symmetric_pairs,
+                self._watched_ids,
+                self._watch_all,
+            ) = soft
+            # Transitions of the warm-up are discarded
+            if self._transitions_ready:
+                transitions.drain()
+            self._transition_chunks = chunks
+            self.dropped_transitions = dropped
+            self._mask_logged_id = None
+            self.logs = logs
+            profiler.enabled = profiler_enabled
+        self.restart()
+        ti.sync()
+        return {"variants": variants, "seconds": time.perf_counter() - start}
+
+    def reorder(self):
+        """
+        Permutes data of cats in the order of grid cells computed by the last state update.
+        IDs of cats stay stable, use `slot` to find where data of a cat is stored.
+        """
+        # Records of transitions refer to the old slots
+        self._drain_transitions()
+        self._mask_logged_id = None
+        if not self.reordered:
+            cell_order.setup_cell_order_data(self.N)
+            self.reordered = True
+        with profiler.stage("reorder"):
+            cell_order.reorder_by_cells(self.positions, self.states)
+        neighbor_list.request_rebuild()  # Lists refer to the old slots
+        request_full_rebuild()
+        self._contacts_fresh = False
+
+    def _build_contacts(self, rebuild_grid: bool):
+        if not self._contacts_ready:
+            contacts.setup_contacts_data(self.N)
+            self._contacts_ready = True
+        with profiler.stage("contacts"):
+            contacts.build_contacts(self.positions, self.norm_func, rebuild_grid)
+        self._contacts_fresh = True
+
+    def contact_list(self):
+        """
+        Returns contacts of cats (pairs within R0) for the current positions as numpy arrays (starts, ids)
+        indexed by IDs of cats: contacts of the cat k are ids[starts[k]:starts[k + 1]].
+        Contacts are allocated on the first use, afterwards they are kept until reset.
+        """
+        self._build_contacts(rebuild_grid=True)
+        starts, ids = contacts.contacts_numpy()
+        if not self.reordered:
+            return starts, ids
+        # Rows are permuted from slots to IDs, ids of contacts are translated from slots to IDs
+        slot_of = cell_order.slot_of.to_numpy()[: self.N]
+        counts = np.diff(starts)[slot_of]
+        id_starts = np.concatenate(([0], np.cumsum(counts)))
+        rows = np.repeat(np.arange(self.N), counts)
+        src = starts[slot_of][rows] + np.arange(len(ids)) - id_starts[rows]
+        cat_ids = cell_order.cat_ids.to_numpy()[: self.N]
+        return id_starts, cat_ids[ids[src]]
+
+    @property
+    def obeys_state_refresh(self) -> bool:
+        """
+        Whether `state_refresh` limits the update of states. Symmetric pairs without neighbour lists
+        always recompute all cats.
+        """
+        return not self.symmetric_pairs or self.neighbor_skin > 0
+
+    @property
+    def max_displacement(self) -> float:
+        """
+        Maximum displacement of cats since the last build of neighbour lists.
+        """
+        if not self._neighbor_lists_ready:
+            return 0.0
+        return neighbor_list.max_displacement[None]
+
+    @property
+    def mover_share(self) -> float:
+        """
+        Share of cats that changed grid cells at the last step of the incremental grid.
+        """
+        return grid_manager.mover_share
+
+    @property
+    def grid_rebuilds(self) -> int:
+        """
+        Count of full rebuilds of the incremental grid since it was set up.
+        """
+        return grid_manager.full_rebuilds
+
+    @property
+    def neighbor_list_rebuilds(self) -> int:
+        """
+        Count of builds of neighbour lists since they were set up.
+        """
+        if not self._neighbor_lists_ready:
+            return 0
+        return neighbor_list.rebuilds
+
+    def hash_collision_stats(self) -> dict:
+        """
+        Collisions of the hashed grid built by the last state update, see `grid_manager.hash_collision_stats`.
+        """
+        return hash_collision_stats(self.positions)
+
+    def slot(self, cat_id: int) -> int:
+        """
+        Returns index in `positions` and `states` where data of the cat with `cat_id` is stored.
+        """
+        if not self.reordered:
+            return cat_id
+        return cell_order.slot_of[cat_id]
+
+    def step(self, n: int = 1, dt: ti.f32 = 1 / 60):
+        """
+        Makes `n` simulation steps: moves cats and recomputes their states.
+
+        :param n: Count of steps.
+        :param dt: Time interval of each step in seconds.
+        """
+        for k in range(n):
+            self.move(dt)
+            if (
+                self.reorder_interval > 0
+                and self.steps_done > 0
+                and self.steps_done % self.reorder_interval == 0
+            ):
+                self.reorder()
+            self.update_states(drain_logs=k == n - 1 or self._watch_count() > 1)
+            self.steps_done += 1
+
+    def load_cats(self, cats: dict):
+        """
+        Replaces data of all cats, e.g. with data exported by `cats_numpy` of another simulation.
+        If the count of cats differs from N, data is resized like by `reset`, but positions are not
+        re-initialized and allocated contacts are kept, so kernels are not recompiled while fields fit.
+
+        :param cats: Numpy arrays indexed by IDs of cats: "positions" and "velocities" of shape (n, 2),
+            "angles" and "speeds" of the carousel pattern of shape (n,).
+        """
+        n = len(cats["positions"])
+        self._drain_transitions()
+        self._mask_logged_id = None
+        if n != self.N:
+            self.params["N"] = n
+            self._setup_data()
+            if self._contacts_ready:
+                contacts.setup_contacts_data(n)
+            self._neighbor_lists_ready = False
+            self._transitions_ready = False
+            if self._watched_ids is not None:
+                ids = self._watched_ids[self._watched_ids < n]
+                self._watched_ids = ids if len(ids) > 0 else None
+        load_cats(self.positions, cats)
+        self.reordered = False
+        neighbor_list.request_rebuild()
+        request_full_rebuild()
+        self._contacts_fresh = False
+
+    def resize(self, n: int):
+        """
+        Changes the count of cats to `n`, e.g. when cats come and leave a part of the field simulated
+        by a process. Cats in the first min(n, N) slots keep their data, added slots must be filled
+        by `write_cats` before the next step. Unlike `load_cats`, data grows with a margin, so most resizes
+        do not reallocate it, and the incremental grid moves only cats of changed slots instead of binning
+        all cats again.
+        """
+        if self.reordered:
+            raise ValueError("Reordered cats can not be resized")
+        if n == self.N:
+            return
+        self._drain_transitions()
+        self._mask_logged_id = None
+        if n > self._capacity:
+            self.reserve(max(n, 2 * self._capacity))
+        self.params["N"] = n
+        set_cat_count(n)
+        set_circle_count(n)
+        if self._contacts_ready:
+            contacts.setup_contacts_data(n)
+        self._neighbor_lists_ready = False
+        self._transitions_ready = False
+        if self._watched_ids is not None:
+            ids = self._watched_ids[self._watched_ids < n]
+            self._watched_ids = ids if len(ids) > 0 else None
+        neighbor_list.request_rebuild()
+        self._contacts_fresh = False
+
+    def reserve(self, capacity: int):
+        """
+        Allocates data for `capacity` cats keeping data of the current ones, so `resize` up to it
+        does not reallocate data. Reordered cats are put back into slots of their IDs.
+        """
+        if capacity <= self._capacity:
+            return
+        self._drain_transitions()
+        self._mask_logged_id = None
+        cats = self.cats_numpy()
+        states = self.states_numpy()
+        self._setup_data(capacity)
+        load_cats(self.positions, cats)
+        all_states = np.full(self.states.shape[0], STATE_IDLE, states.dtype)
+        all_states[: len(states)] = states
+        self.states.from_numpy(all_states)
+        self.reordered = False
+        neighbor_list.request_rebuild()
+        self._contacts_fresh = False
+
+    def write_cats(self, slots, cats: dict):
+        """
+        Replaces data of cats in `slots`, other cats keep their data. Cats of changed slots are moved
+        by the next update of the incremental grid. States of the slots are kept until the next state update.
+
+        :param slots: Slots of cats in [0, N), the same as IDs of cats, since reordered data can not be written.
+        :param cats: Numpy arrays in the format of `load_cats` with data of cats in `slots`.
+        """
+        if self.reordered:
+            raise ValueError("Slots of reordered cats can not be written")
+        write_cats(self.positions, slots, cats)
+        neighbor_list.request_rebuild()
+        self._contacts_fresh = False
+
+    def cats_numpy(self) -> dict:
+        """
+        Returns data of all cats accepted by `load_cats` as numpy arrays indexed by IDs of cats.
+        """
+        cats = cats_numpy(self.positions)
+        if not self.reordered:
+            return cats
+        slot_of = cell_order.slot_of.to_numpy()[: self.N]
+        return {key: array[slot_of] for key, array in cats.items()}
+
+    def states_numpy(self):
+        """
+        Returns states of all cats as a numpy array indexed by IDs of cats.
+        """
+        states = self.states.to_numpy()[: self.N]
+        if not self.reordered:
+            return states
+        return states[cell_order.slot_of.to_numpy()[: self.N]]
+
+    def positions_numpy(self):
+        """
+        Returns positions of all cats as a numpy array of shape (N, 2) indexed by IDs of cats.
+        """
+        positions = self.positions.to_numpy()[: self.N]
+        if not self.reordered:
+            return positions
+        return positions[cell_order.slot_of.to_numpy()[: self.N]]
@@ -0,0 +1,352 @@
+# Recording of runs into memory-mapped trajectory files and their replay without re-simulating.
+# A file is a fixed-size header followed by fixed-size frames, so any frame can be read without reading
+# the previous ones. The file grows by chunks of frames, frames are written through a memory map
+import os
+
+import numpy as np
+import taichi as ti
+
+from catradar import cell_order, field_pool
+from catradar.common import ENCODING_FLOAT32, ENCODING_QUANTIZED
+
+__all__ = ["TrajectoryRecorder", "TrajectoryReader"]
+
+MAGIC = b"CATTRAJ1"
+VERSION = 1
+HEADER_SIZE = 64  # frames start at this offset
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("n", "<u4"),
+        ("x", "<f4"),
+        ("y", "<f4"),
+        ("r0", "<f4"),
+        ("r1", "<f4"),
+        ("pattern", "<i4"),
+        ("norm", "<i4"),
+        ("interval", "<u4"),
+        ("encoding", "<u4"),
+        ("frame_count", "<u8"),
+    ]
+)
+CHUNK_BYTES = 256 * 2**20  # the file grows by this many bytes of frames
+QUANTIZATION_MAX = 65535  # quantized positions map [0, X] x [0, Y] to [0, 65535]^2
+
+# Fields the replayed frame is loaded into
+_fields = field_pool.FieldGroup("replay", read_as_globals=False)
+
+
+def _frame_dtype(n: int, encoding: int) -> np.dtype:
+    positions = "<f4" if encoding == ENCODING_FLOAT32 else "<u2"
+    return np.dtype(
+        [("step", "<i8"), ("positions", positions, (n, 2)), ("states", "u1", (n,))]
+    )
+
+
+@ti.kernel
+def _stage_frame(
+    positions: ti.template(),
+    states: ti.template(),
+    slot_of: ti.template(),
+    reordered: ti.template(),
+    quantized: ti.template(),
+    scale: ti.math.vec2,
+    n: ti.i32,
+    positions_out: ti.types.ndarray(),
+    states_out: ti.types.ndarray(),
+):
+    for i in range(n):
+        slot = i
+        if ti.static(reordered):
+            slot = slot_of[i]
+        pos = positions[slot]
+        for k in ti.static(range(2)):
+            if ti.static(quantized):
+                positions_out[i, k] = ti.cast(
+                    ti.math.clamp(pos[k] * scale[k] + 0.5, 0, QUANTIZATION_MAX), ti.u16
+                )
+            else:
+                positions_out[i, k] = pos[k]
+        states_out[i] = ti.cast(states[slot], ti.u8)
+
+
+@ti.kernel
+def _load_frame(
+    positions_in: ti.types.ndarray(),
+    states_in: ti.types.ndarray(),
+    quantized: ti.template(),
+    scale: ti.math.vec2,
+    n: ti.i32,
+    positions: ti.template(),
+    states: ti.template(),
+):
+    for i in range(n):
+        for k in ti.static(range(2)):
+            if ti.static(quantized):
+                positions[i][k] = ti.cast(positions_in[i, k], ti.f32) / scale[k]
+            else:
+                positions[i][k] = positions_in[i, k]
+        states[i] = ti.cast(states_in[i], ti.i32)
+
+
+def _quantization_scale(x: float, y: float) -> ti.math.vec2:
+    return ti.math.vec2(QUANTIZATION_MAX / x, QUANTIZATION_MAX / y)
+
+
+class TrajectoryRecorder:
+    """
+    Streams positions and states of a simulation into a trajectory file.
+
+    Usage:
+        with TrajectoryRecorder("run.cattraj", sim, interval=10) as recorder:
+            for _ in range(steps):
+                sim.step()
+                recorder.record(sim)
+
+    Steps made in batches are counted by `record(sim, steps)`, and `steps_to_next_frame` tells how many steps
+    to make before the next frame, so frames stay evenly spaced in simulation steps.
+
+    Frames are copied from Taichi fields into staging buffers allocated once, then into the memory map,
+    so recording allocates memory only when the file grows by a chunk. Frames are stored by IDs of cats,
+    so reordering of cats data does not affect the file. The header is updated with every frame,
+    so frames recorded before a crash can be replayed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sim,
+        interval: int = 1,
+        encoding: int = ENCODING_FLOAT32,
+        chunk_frames: int = None,
+    ):
+        """
+        :param path: Path of the file, an existing file is overwritten.
+        :param sim: Simulation to record, its parameters are written to the header.
+        :param interval: A frame is written every `interval` steps counted by `record`, starting with the first.
+        :param encoding: ENCODING_FLOAT32 or ENCODING_QUANTIZED (16-bit positions, half of the size,
+            precision of X / 65535 and Y / 65535).
+        :param chunk_frames: Count of frames the file grows by, by default frames of CHUNK_BYTES.
+        """
+        if encoding not in (ENCODING_FLOAT32, ENCODING_QUANTIZED):
+            raise ValueError("Unknown encoding of positions: {}".format(encoding))
+        self.path = path
+        self.n = sim.N
+        self.interval = max(interval, 1)
+        self.encoding = encoding
+        self.frame_count = 0
+        self._steps = 0
+        self._x = sim.params["X"]
+        self._y = sim.params["Y"]
+        # Values of the header, the file is valid only while they are kept
+        self._header_values = self._simulation_values(sim)
+        self._dtype = _frame_dtype(self.n, encoding)
+        self._chunk_frames = chunk_frames or max(CHUNK_BYTES // self._dtype.itemsize, 1)
+
+        self._staging_positions = np.zeros(
+            (self.n, 2), dtype=self._dtype["positions"].base
+        )
+        self._staging_states = np.zeros(self.n, dtype=np.uint8)
+
+        with open(path, "wb") as f:
+            f.truncate(HEADER_SIZE)
+        self._header = np.memmap(path, dtype=HEADER_DTYPE, mode="r+", shape=(1,))
+        self._header[0] = (
+            MAGIC,
+            VERSION,
+            self.n,
+            self._x,
+            self._y,
+            sim.params["R0"],
+            sim.params["R1"],
+            sim.movement_pattern,
+            sim.norm_func,
+            self.interval,
+            encoding,
+            0,
+        )
+        self._frames = None
+        self._capacity = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _grow(self):
+        if self._frames is not None:
+            self._frames.flush()
+            self._frames = None
+        self._capacity += self._chunk_frames
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + self._capacity * self._dtype.itemsize)
+        self._frames = np.memmap(
+            self.path,
+            dtype=self._dtype,
+            mode="r+",
+            offset=HEADER_SIZE,
+            shape=(self._capacity,),
+        )
+
+    @staticmethod
+    def _simulation_values(sim) -> tuple:
+        p = sim.params
+        return (
+            sim.N,
+            p["X"],
+            p["Y"],
+            p["R0"],
+            p["R1"],
+            sim.movement_pattern,
+            sim.norm_func,
+        )
+
+    def matches(self, sim) -> bool:
+        """
+        Returns whether parameters of `sim` written to the header are unchanged, so its frames may be
+        appended to the file. Quantized positions are scaled by X and Y of the header.
+        """
+        return self._simulation_values(sim) == self._header_values
+
+    def steps_to_next_frame(self) -> int:
+        """
+        Returns the count of steps after which `record` writes the next frame.
+        """
+        return 1 + (-self._steps) % self.interval
+
+    def record(self, sim, steps: int = 1) -> bool:
+        """
+        Counts `steps` made by `sim` since the previous call and writes its current positions and states
+        if the count reached a step of the next frame. Returns whether a frame was written.
+        """
+        due = steps >= self.steps_to_next_frame()
+        self._steps += steps
+        if not due:
+            return False
+        if sim.N != self.n:
+            raise ValueError("Count of cats changed during recording")
+
+        _stage_frame(
+            sim.positions,
+            sim.states,
+            cell_order.slot_of if sim.reordered else sim.states,
+            sim.reordered,
+            self.encoding == ENCODING_QUANTIZED,
+            _quantization_scale(self._x, self._y),
+            self.n,
+            self._staging_positions,
+            self._staging_states,
+        )
+        if self.frame_count == self._capacity:
+            self._grow()
+        k = self.frame_count
+        self._frames["step"][k] = sim.steps_done
+        self._frames["positions"][k] = self._staging_positions
+        self._frames["states"][k] = self._staging_states
+        self.frame_count += 1
+        self._header[0]["frame_count"] = self.frame_count
+        return True
+
+    def close(self):
+        """
+        Flushes frames and cuts the unused part of the last chunk.
+        """
+        if self._header is None:
+            return
+        if self._frames is not None:
+            self._frames.flush()
+            self._frames = None
+        self._header.flush()
+        self._header = None
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + self.frame_count * self._dtype.itemsize)
+
+
+class TrajectoryReader:
+    """
+    Reads frames of a trajectory file in any order.
+
+    Usage:
+        reader = TrajectoryReader("run.cattraj")
+        reader.load(len(reader) - 1)  # fills reader.positions and reader.states
+        draw_circles(scene, reader.positions, reader.states, ...)
+
+    `positions` and `states` are taken from a module-level pool, so only one reader can load frames at a time.
+    """
+
+    def __init__(self, path: str):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header[0]["magic"] != MAGIC:
+            raise ValueError("{} is not a trajectory file".format(path))
+        if header[0]["version"] != VERSION:
+            raise ValueError(
+                "Unsupported version of trajectory file: {}".format(
+                    header[0]["version"]
+                )
+            )
+        header = header[0]
+        self.path = path
+        self.n = int(header["n"])
+        self.encoding = int(header["encoding"])
+        # Parameters of the recorded simulation
+        self.params = {
+            "X": float(header["x"]),
+            "Y": float(header["y"]),
+            "N": self.n,
+            "R0": float(header["r0"]),
+            "R1": float(header["r1"]),
+        }
+        self.movement_pattern = int(header["pattern"])
+        self.norm_func = int(header["norm"])
+        self.interval = int(header["interval"])
+
+        dtype = _frame_dtype(self.n, self.encoding)
+        # A file of an interrupted recording may have fewer complete frames than written to the header
+        available = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+        count = min(int(header["frame_count"]), available)
+        self._frames = np.memmap(
+            path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,)
+        )
+
+        _fields.allocate(
+            positions=(ti.f32, self.n, 2),
+            states=(ti.i32, self.n),
+        )
+        self.positions = _fields["positions"]
+        self.states = _fields["states"]
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def step(self, k: int) -> int:
+        """
+        Returns the simulation step at which the frame `k` was recorded.
+        """
+        return int(self._frames[k]["step"])
+
+    def frame(self, k: int):
+        """
+        Returns positions of shape (N, 2) and states of cats in the frame `k` as numpy arrays.
+        """
+        positions = self._frames["positions"][k].astype(np.float32)
+        if self.encoding == ENCODING_QUANTIZED:
+            scale = _quantization_scale(self.params["X"], self.params["Y"])
+            positions /= np.array([scale[0], scale[1]], dtype=np.float32)
+        return positions, self._frames["states"][k].astype(np.int32)
+
+    def load(self, k: int):
+        """
+        Loads the frame `k` into `positions` and `states`.
+        """
+        _load_frame(
+            self._frames["positions"][k],
+            self._frames["states"][k],
+            self.encoding == ENCODING_QUANTIZED,
+            _quantization_scale(self.params["X"], self.params["Y"]),
+            self.n,
+            self.positions,
+            self.states,
+        )
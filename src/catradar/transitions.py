@@ -0,0 +1,209 @@
+# Capture of state transitions on the device. Watched cats are marked in a bitmask, kernels computing
+# states compare the old and the new state of watched cats and append records of changes to a buffer
+# through an atomic counter, and the host drains the buffer in one transfer. Watching all cats costs
+# one comparison per cat in the same pass, there is no Python call per cat.
+import numpy as np
+import taichi as ti
+
+from catradar import field_pool
+from catradar.common import WATCH_ALL, WATCH_NONE, WATCH_SET
+from catradar.event_log import EVENT_DTYPE
+
+__all__ = [
+    "setup_transitions_data",
+    "release_transitions_data",
+    "set_watched",
+    "set_frame",
+    "drain",
+    "to_events",
+    "is_watched",
+    "capture",
+    "save_state",
+    "raise_cause",
+    "capture_raised",
+]
+
+N: ti.i32
+
+# Components of a record in `events`
+EVENT_FRAME = 0
+EVENT_CAT = 1  # slot of the cat
+EVENT_PREV = 2
+EVENT_NEW = 3
+EVENT_CAUSE = 4  # slot of the cat that changed the state, -1 if none
+
+# Bit i % 32 of the word i // 32 is set for the watched slot i
+watch_mask = NotImplemented
+events = NotImplemented  # records of transitions
+# States before the update and causes of changes, for kernels that raise states of both cats of a pair.
+# A cause is packed with the state it raised to, so the cause of the final state wins by `atomic_max`
+prev_states = NotImplemented
+causes = NotImplemented
+
+# Count of appended records, may exceed the capacity
+event_count = ti.field(ti.i32, shape=())
+# Capacity read by kernels at runtime, reused fields may be larger
+event_capacity = ti.field(ti.i32, shape=())
+_capacity = 0  # copy of event_capacity for the host
+frame = ti.field(ti.i32, shape=())  # step written to records
+
+_fields = field_pool.FieldGroup("transitions")
+
+
+def setup_transitions_data(aN: ti.i32, capacity: int):
+    """
+    Allocates the watch mask for N cats and a buffer of `capacity` records.
+    Fields are reused if they are large enough. The buffer is emptied.
+    """
+    global N, _capacity
+    N = aN
+    _capacity = max(capacity, 1)
+
+    global watch_mask, events, prev_states, causes
+    _fields.allocate(
+        watch_mask=(ti.u32, (N + 31) // 32),
+        events=(ti.i32, max(capacity, 1), 5),
+        prev_states=(ti.i32, N),
+        causes=(ti.i64, N),
+    )
+    watch_mask = _fields["watch_mask"]
+    events = _fields["events"]
+    prev_states = _fields["prev_states"]
+    causes = _fields["causes"]
+    event_count[None] = 0
+    event_capacity[None] = _capacity
+
+
+def release_transitions_data():
+    """
+    Frees memory of the mask and the buffer.
+    """
+    _fields.destroy()
+
+
+def set_watched(slots: np.ndarray):
+    """
+    Marks cats in `slots` as watched and all other cats as not watched.
+    """
+    bits = np.zeros(watch_mask.shape[0] * 32, dtype=bool)
+    bits[np.asarray(slots, dtype=np.int64)] = True
+    watch_mask.from_numpy(np.packbits(bits, bitorder="little").view("<u4"))
+
+
+def set_frame(value: int):
+    frame[None] = value
+
+
+def drain():
+    """
+    Returns records appended since the last drain as an int32 array of shape (count, 5)
+    with components `EVENT_*`, and the count of records dropped because the buffer was full.
+    """
+    count = int(event_count[None])
+    kept = min(count, _capacity)
+    records = np.empty((kept, 5), dtype=np.int32)
+    if kept > 0:
+        _copy_events(records, kept, field_pool.generation())
+    if count > 0:
+        event_count[None] = 0
+    return records, count - kept
+
+
+def to_events(records: np.ndarray, cat_ids: np.ndarray = None) -> np.ndarray:
+    """
+    Converts drained records to a structured array of `EVENT_DTYPE`.
+
+    :param records: Records returned by `drain`.
+    :param cat_ids: Optional map from slots of cats to their IDs (when data of cats is reordered).
+    """
+    events = np.empty(len(records), dtype=EVENT_DTYPE)
+    cats = records[:, EVENT_CAT]
+    causes = records[:, EVENT_CAUSE]
+    if cat_ids is not None:
+        cats = cat_ids[cats]
+        causes = np.where(causes >= 0, cat_ids[np.maximum(causes, 0)], -1)
+    events["frame"] = records[:, EVENT_FRAME]
+    events["cat_id"] = cats
+    events["prev"] = records[:, EVENT_PREV]
+    events["new"] = records[:, EVENT_NEW]
+    events["cause_id"] = causes
+    return events
+
+
+@ti.kernel
+def _copy_events(out: ti.types.ndarray(), count: ti.i32, generation: ti.template()):
+    for k in range(count):
+        for c in ti.static(range(5)):
+            out[k, c] = events[k][c]
+
+
+@ti.func
+def is_watched(i: ti.i32, watch: ti.template()) -> bool:
+    """
+    Returns whether transitions of the cat in the slot `i` are captured.
+    Without watching no cat is checked.
+    """
+    res = False
+    if ti.static(watch == WATCH_ALL):
+        res = True
+    elif ti.static(watch == WATCH_SET):
+        res = (watch_mask[i >> 5] >> ti.cast(i & 31, ti.u32)) & 1 == 1
+    return res
+
+
+@ti.func
+def capture(i: ti.i32, prev: ti.i32, new: ti.i32, cause: ti.i32, watch: ti.template()):
+    """
+    Records the change of the state of the cat in the slot `i` if the cat is watched.
+    Without watching nothing is compiled, so fields of this module may be not allocated.
+    """
+    if ti.static(watch != WATCH_NONE):
+        if is_watched(i, watch) and prev != new:
+            _record(i, prev, new, cause)
+
+
+@ti.func
+def save_state(i: ti.i32, state: ti.i32, watch: ti.template()):
+    """
+    Saves the state of the watched cat in the slot `i` before its state is raised by pairs.
+    """
+    if ti.static(watch != WATCH_NONE):
+        if is_watched(i, watch):
+            prev_states[i] = state
+            causes[i] = -1
+
+
+@ti.func
+def raise_cause(i: ti.i32, state: ti.i32, cause: ti.i32, watch: ti.template()):
+    """
+    Notes that the cat `cause` raised the state of the watched cat in the slot `i` to `state`.
+    Of concurrent causes the one with the highest state is kept.
+    """
+    if ti.static(watch != WATCH_NONE):
+        if is_watched(i, watch):
+            ti.atomic_max(
+                causes[i], (ti.cast(state, ti.i64) << 32) | ti.cast(cause, ti.i64)
+            )
+
+
+@ti.func
+def capture_raised(i: ti.i32, new: ti.i32, watch: ti.template()):
+    """
+    Records the change of the state saved by `save_state` with the cause noted by `raise_cause`.
+    """
+    if ti.static(watch != WATCH_NONE):
+        if is_watched(i, watch) and prev_states[i] != new:
+            cause = -1
+            if causes[i] >= 0:
+                cause = ti.cast(causes[i] & ti.i64(0xFFFFFFFF), ti.i32)
+            _record(i, prev_states[i], new, cause)
+
+
+@ti.func
+def _record(i: ti.i32, prev: ti.i32, new: ti.i32, cause: ti.i32):
+    """
+    Appends a record of the transition of the cat in the slot `i`. Records over the capacity are dropped.
+    """
+    k = ti.atomic_add(event_count[None], 1)
+    if k < event_capacity[None]:
+        events[k] = ti.Vector([frame[None], i, prev, new, cause])
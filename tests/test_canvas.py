@@ -0,0 +1,111 @@
+import numpy as np
+import taichi as ti
+
+from catradar import canvas, field_pool
+from catradar.common import STATE_IDLE, STATE_INTERACT, STATE_INTERSECTION
+
+N, X, Y, R0 = 2000, 1000, 500, 4
+NORM_RATIO = 1000
+
+
+def make_cats(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    points = (rng.random((N, 2)) * [X, Y]).astype(np.float32)
+    states_np = rng.integers(0, 3, N).astype(np.int32)
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states = ti.field(dtype=ti.i32, shape=N)
+    positions.from_numpy(points)
+    states.from_numpy(states_np)
+    canvas.setup_data_for_scene(X, Y, N, R0, NORM_RATIO)
+    return points, states_np, positions, states
+
+
+def test_visible_rect():
+    # At the distance CAMERA_ZOOM the view is one unit of the scene high
+    lo, hi = canvas.visible_rect((0.5, 0.25, canvas.CAMERA_ZOOM), (1600, 800), 1000)
+    np.testing.assert_allclose(lo.to_numpy(), [-500, -250])
+    np.testing.assert_allclose(hi.to_numpy(), [1500, 750])
+
+
+def test_update_colors_culls_invisible_cats():
+    points, states_np, positions, states = make_cats()
+    lo, hi = np.array([100, 50]), np.array([400, 300])
+    canvas.update_colors(
+        positions,
+        states,
+        -1,
+        N,
+        ti.math.vec2(lo),
+        ti.math.vec2(hi),
+        100,
+        NORM_RATIO,
+        field_pool.generation(),
+    )
+    visible = np.flatnonzero(((points >= lo) & (points <= hi)).all(axis=1))
+    count = canvas.draw_count[None]
+    assert count == len(visible)
+
+    drawn = canvas.positions_to_draw.to_numpy()[:count]
+    order = np.lexsort((drawn[:, 1], drawn[:, 0]))
+    expected = points[visible] / NORM_RATIO
+    expected_order = np.lexsort((expected[:, 1], expected[:, 0]))
+    np.testing.assert_allclose(drawn[order, :2], expected[expected_order], rtol=1e-6)
+    assert (drawn[:, 2] == 0).all()
+
+    # Colors follow states of the drawn cats
+    colors = canvas.colors_to_draw.to_numpy()[:count][order]
+    state_colors = {
+        STATE_IDLE: [0, 0, 0.5],
+        STATE_INTERACT: [0, 0.5, 0],
+        STATE_INTERSECTION: [0.5, 0, 0],
+    }
+    expected_colors = [state_colors[s] for s in states_np[visible][expected_order]]
+    np.testing.assert_allclose(colors, expected_colors)
+
+
+def test_render_rate_samples_visible_cats():
+    points, _, positions, states = make_cats()
+    logged_id = 7
+    canvas.update_colors(
+        positions,
+        states,
+        logged_id,
+        N,
+        ti.math.vec2(0, 0),
+        ti.math.vec2(X, Y),
+        25,
+        NORM_RATIO,
+        field_pool.generation(),
+    )
+    count = canvas.draw_count[None]
+    assert 0.2 * N < count < 0.3 * N
+    # The logged cat is drawn regardless of the rate
+    drawn = canvas.positions_to_draw.to_numpy()[:count, :2]
+    assert np.isclose(drawn, points[logged_id] / NORM_RATIO).all(axis=1).any()
+
+
+def test_heatmap_counts_visible_cats():
+    points, states_np, positions, states = make_cats()
+    lo, hi = np.array([0, 0]), np.array([X / 2, Y])
+    canvas.update_heatmap(
+        positions,
+        states,
+        N,
+        ti.math.vec2(lo),
+        ti.math.vec2(hi),
+        field_pool.generation(),
+    )
+    counts = canvas.heatmap_counts.to_numpy()
+    visible = ((points >= lo) & (points < hi)).all(axis=1)
+    assert counts.sum() == visible.sum()
+    np.testing.assert_array_equal(
+        counts.sum(axis=(0, 1)), np.bincount(states_np[visible], minlength=3)
+    )
+
+    image = canvas.heatmap_image.to_numpy()
+    empty = counts.sum(axis=2) == 0
+    assert (image[empty] == 0).all()
+    assert (image[~empty].max(axis=1) > 0).all()
+    # Pixels with cats of one state have the color of the state
+    only_idle = ~empty & (counts.sum(axis=2) == counts[..., STATE_IDLE])
+    assert (image[only_idle][:, :2] == 0).all()
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from catradar import contacts, field_pool
+from catradar.common import MOVE_PATTERN_COLLIDING, TESTING_MODE
+from catradar.grid_manager import compute_states, setup_grid_data
+from catradar.positions_updater import initialize_positions, setup_positions_data
+from catradar.simulation import Simulation
+from test_grid_manager import LIM, STORAGES
+
+
+def naive_contacts(points: np.ndarray, R0: float, norm_func: int) -> list[set]:
+    delta = np.abs(points[:, None, :] - points[None, :, :]).astype(np.float64)
+    if norm_func == 0:
+        dist = np.sqrt((delta**2).sum(axis=2))
+    elif norm_func == 1:
+        dist = delta.sum(axis=2)
+    else:
+        dist = delta.max(axis=2)
+    close = dist <= R0
+    np.fill_diagonal(close, False)
+    return [set(np.flatnonzero(row)) for row in close]
+
+
+def csr_contacts(starts: np.ndarray, ids: np.ndarray) -> list[set]:
+    return [set(ids[starts[i] : starts[i + 1]]) for i in range(len(starts) - 1)]
+
+
+def mismatches(actual: list[set], expected: list[set]) -> int:
+    # Pairs at distance almost equal to R0 may differ due to rounding
+    return sum(a != e for a, e in zip(actual, expected))
+
+
+@STORAGES
+@pytest.mark.parametrize("init_opt", [0, 1], ids=["uniform", "clustered"])
+@pytest.mark.parametrize("norm_func", [0, 1, 2])
+def test_build_contacts(init_opt: int, norm_func: ti.i32, storage: ti.i32):
+    N, X, Y, R0, R1 = 2000, 300, 300, 3, 10
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, storage)
+    contacts.release_contacts_data()  # Buffers of previous tests may be larger
+    contacts.setup_contacts_data(N)
+    initialize_positions(positions, init_opt)
+    points = positions.to_numpy()[:N]
+    expected = naive_contacts(points, R0, norm_func)
+
+    # The grid of `compute_states` is reused or built again, the result is the same
+    compute_states(positions, states, norm_func)
+    for rebuild_grid in [False, True]:
+        total = contacts.build_contacts(positions, norm_func, rebuild_grid)
+        starts, ids = contacts.contacts_numpy()
+        assert total == starts[N] == len(ids)
+        assert mismatches(csr_contacts(starts, ids), expected) <= N // 100
+
+    # Contacts are not capped, memory follows their count
+    assert total == sum(len(c) for c in expected)
+    assert field_pool.memory_report()["contact_ids"]["allocated_mb"] <= (
+        1.5 * max(total, N) * 4 / 2**20 + 1e-6
+    )
+
+
+def test_contacts_allocated_only_when_needed():
+    sim = Simulation({"N": 1000, "X": 200, "Y": 200})
+    sim.step(2)
+    assert field_pool.memory_report()["contacts"]["allocated_mb"] == 0
+
+    sim.movement_pattern = MOVE_PATTERN_COLLIDING
+    sim.step(2)
+    assert field_pool.memory_report()["contacts"]["allocated_mb"] > 0
+
+    sim.reset()
+    assert field_pool.memory_report()["contacts"]["allocated_mb"] == 0
+    assert field_pool.memory_report()["contact_ids"]["allocated_mb"] == 0
+
+
+@pytest.mark.parametrize("reorder_interval", [0, 2])
+def test_contact_list_by_ids(reorder_interval: int):
+    sim = Simulation({"N": 1500, "X": 150, "Y": 150})
+    sim.movement_pattern = MOVE_PATTERN_COLLIDING
+    sim.reorder_interval = reorder_interval
+    sim.step(5)
+    assert sim.reordered == (reorder_interval > 0)
+
+    starts, ids = sim.contact_list()
+    expected = naive_contacts(sim.positions_numpy(), sim.params["R0"], sim.norm_func)
+    assert mismatches(csr_contacts(starts, ids), expected) <= sim.N // 100
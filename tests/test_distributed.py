@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from catradar.common import (
+    GRID_HASHED,
+    MOVE_PATTERN_CAROUSEL,
+    MOVE_PATTERN_COLLIDING,
+    MOVE_PATTERN_FREE,
+    STATE_IDLE,
+    STATE_INTERACT,
+    STATE_INTERSECTION,
+    TESTING_MODE,
+)
+from catradar.distributed import DistributedSimulation, strip_edges
+from catradar.simulation import Simulation
+
+PARAMS = {"X": 300, "Y": 150, "N": 2000, "R0": 5, "R1": 10}
+
+
+def test_strip_edges():
+    edges = strip_edges(300, 3)
+    assert edges[1:-1] == [100, 200]
+    assert edges[0] == -np.inf and edges[-1] == np.inf
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_matches_single_process(workers):
+    # Moving cats does not depend on other cats and states in the testing mode depend only
+    # on distances, so the decomposed simulation gives exactly the same result
+    single = Simulation({**PARAMS, "grid_storage": GRID_HASHED}, mode=TESTING_MODE)
+    with DistributedSimulation(
+        {**PARAMS, "grid_storage": GRID_HASHED},
+        workers=workers,
+        mode=TESTING_MODE,
+        cats=single.cats_numpy(),
+    ) as dist:
+        for pattern in [MOVE_PATTERN_FREE, MOVE_PATTERN_CAROUSEL]:
+            single.movement_pattern = dist.movement_pattern = pattern
+            single.step(4)
+            dist.step(4)
+            assert np.array_equal(dist.positions_numpy(), single.positions_numpy())
+            assert np.array_equal(dist.states_numpy(), single.states_numpy())
+        assert sum(dist.owned_counts) == PARAMS["N"]
+
+
+def test_colliding_migrates_cats():
+    # All cats start in the corner of the first strip and spread into the other one
+    with DistributedSimulation(
+        {**PARAMS, "X": 100, "init_opt": 1}, workers=2, mode=TESTING_MODE, seed=1
+    ) as dist:
+        dist.movement_pattern = MOVE_PATTERN_COLLIDING
+        dist.step(20)
+        assert sum(dist.owned_counts) == PARAMS["N"]
+        assert dist.owned_counts[1] > 0
+
+        states = dist.states_numpy()
+        assert ((states >= STATE_IDLE) & (states <= STATE_INTERSECTION)).all()
+        positions = dist.positions_numpy()
+        assert (positions[:, 0] >= 0).all() and (positions[:, 0] <= 100).all()
+
+
+def test_workers_update_grids_incrementally():
+    with DistributedSimulation(PARAMS, workers=3, mode=TESTING_MODE, seed=2) as dist:
+        dist.speed_mult = 0.2
+        dist.step(10)
+        # Only the first step bins all cats of a worker, later steps move cats that changed cells,
+        # came into the strip or its halo and left them
+        assert max(dist.grid_rebuilds) < 5
+
+        # Cats that left strips by moves without state updates are not lost
+        dist.move()
+        dist.move()
+        dist.update_states()
+        assert sum(dist.owned_counts) == PARAMS["N"]
+        positions = dist.positions_numpy()
+        dist_matrix = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+        np.fill_diagonal(dist_matrix, np.inf)
+        expected = np.where(
+            (dist_matrix <= PARAMS["R0"]).any(axis=1),
+            STATE_INTERSECTION,
+            np.where(
+                (dist_matrix <= PARAMS["R1"]).any(axis=1), STATE_INTERACT, STATE_IDLE
+            ),
+        )
+        np.testing.assert_array_equal(dist.states_numpy(), expected)
+
+
+def test_strips_must_be_wider_than_halo():
+    with pytest.raises(ValueError):
+        DistributedSimulation({**PARAMS, "X": 30}, workers=3)
@@ -0,0 +1,56 @@
+import numpy as np
+
+from catradar.common import STATE_IDLE, STATE_INTERACT, STATE_INTERSECTION
+from catradar.event_log import EventLog
+
+
+def test_ring_buffer_keeps_last_events():
+    log = EventLog(capacity=4)
+    for frame in range(10):
+        log.append(frame, 7, STATE_IDLE, STATE_INTERACT, frame % 3 - 1)
+
+    assert len(log) == 4
+    assert log.total == 10
+    np.testing.assert_array_equal(log.events()["frame"], [6, 7, 8, 9])
+    assert log.events()["cat_id"].tolist() == [7] * 4
+
+
+def test_extend_matches_appends():
+    appended = EventLog(capacity=5)
+    extended = EventLog(capacity=5)
+    for frame in range(7):
+        appended.append(frame, frame, STATE_IDLE, STATE_INTERACT, -1)
+    extended.extend(appended.events()[:2])
+    extended.extend(np.zeros(0, dtype=extended.records.dtype))
+    extended.extend(appended.events()[2:])
+    assert extended.total == 5 and len(extended) == 5
+    np.testing.assert_array_equal(extended.events(), appended.events())
+
+    # Of more records than the capacity only the newest ones are kept
+    extended.extend(np.concatenate([appended.events()] * 3))
+    assert extended.total == 20
+    np.testing.assert_array_equal(extended.events(), appended.events())
+
+
+def test_pages_start_from_newest():
+    log = EventLog(capacity=8)
+    for frame in range(11):
+        log.append(frame, 0, STATE_INTERACT, STATE_INTERSECTION, -1)
+
+    assert log.page_count(3) == 3
+    np.testing.assert_array_equal(log.page(0, 3)["frame"], [10, 9, 8])
+    np.testing.assert_array_equal(log.page(2, 3)["frame"], [4, 3])
+    assert len(log.page(3, 3)) == 0
+
+
+def test_page_text_is_cached_until_log_changes():
+    log = EventLog()
+    log.append(1, 5, STATE_IDLE, STATE_INTERACT, 3)
+    text = log.format_page(0, 10)
+    assert text == "Frame 1: state of 5 id changed: IDLE -> INTERACT by 3 id"
+    assert log.format_page(0, 10) is text
+
+    log.clear()
+    assert log.format_page(0, 10) == ""
+    log.append(2, 5, STATE_INTERACT, STATE_IDLE)
+    assert log.format_page(0, 10) == "Frame 2: state of 5 id changed: INTERACT -> IDLE"
@@ -0,0 +1,62 @@
+import taichi as ti
+
+from catradar import field_pool
+
+
+def test_field_group_reuses_fields():
+    group = field_pool.FieldGroup("test", headroom=1.5)
+    generation = field_pool.generation()
+
+    assert group.allocate(a=(ti.i32, 100), b=(ti.f32, (10, 3), 2))
+    assert field_pool.generation() == generation + 1
+    assert group["a"].shape == (150,)
+    assert group["b"].shape == (15, 3)
+    assert group.allocated_bytes() == 150 * 4 + 15 * 3 * 2 * 4
+    assert group.used_bytes() == 100 * 4 + 10 * 3 * 2 * 4
+
+    # Smaller and up to the headroom sizes reuse fields and keep their values
+    group["a"][5] = 42
+    assert not group.allocate(a=(ti.i32, 150), b=(ti.f32, (1, 3), 2))
+    assert group["a"][5] == 42
+    assert field_pool.generation() == generation + 1
+    assert group.used_bytes() == 150 * 4 + 1 * 3 * 2 * 4
+
+    # Larger sizes or other inner axes reallocate the tree
+    assert group.allocate(a=(ti.i32, 151), b=(ti.f32, (1, 3), 2))
+    assert group.allocate(a=(ti.i32, 151), b=(ti.f32, (1, 4), 2))
+    assert field_pool.generation() == generation + 3
+    assert (group.allocations, group.reuses) == (3, 1)
+
+    report = field_pool.memory_report()["test"]
+    assert report["allocations"] == 3
+    assert "test" in field_pool.format_memory_report()
+
+    group.destroy()
+    assert group.allocated_bytes() == 0
+
+
+def test_field_group_read_as_templates():
+    group = field_pool.FieldGroup("test_templates", read_as_globals=False)
+    generation = field_pool.generation()
+    assert group.allocate(a=(ti.i32, 10))
+    assert field_pool.generation() == generation
+    group.destroy()
+
+
+def test_field_group_soa_layout():
+    group = field_pool.FieldGroup("test_soa")
+    assert group.allocate(v=(ti.f32, 100, 2, ti.Layout.SOA))
+    group["v"][3] = [1.5, -2.5]
+    assert group["v"].to_numpy()[3].tolist() == [1.5, -2.5]
+    assert group.allocated_bytes() == 125 * 2 * 4
+
+    # The same layout is reused, another one is reallocated
+    assert not group.allocate(v=(ti.f32, 100, 2, ti.Layout.SOA))
+    assert group.allocate(v=(ti.f32, 100, 2))
+
+    # Columns of a matrix are stored in separate arrays
+    assert group.allocate(m=(ti.i32, (100, 3), None, ti.Layout.SOA))
+    group["m"][7, 2] = 5
+    assert group["m"].to_numpy()[7].tolist() == [0, 0, 5]
+    assert group.allocated_bytes() == 125 * 3 * 4
+    group.destroy()
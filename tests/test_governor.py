@@ -0,0 +1,102 @@
+from catradar.governor import COOLDOWN_FRAMES, FrameGovernor
+from catradar.profiler import Profiler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_governor(profiler=None):
+    clock = FakeClock()
+    profiler = profiler or Profiler(enabled=False)
+    governor = FrameGovernor(target_fps=50, clock=clock, profiler=profiler)
+    governor.max_substeps = 4
+    governor.reset()
+    governor.update()
+    return governor, clock, profiler
+
+
+def run_frames(governor, clock, count, seconds, stages=None):
+    for _ in range(count):
+        start = clock.now
+        for name, duration in (stages or {}).items():
+            governor.profiler.record(name, start, duration)
+        clock.now += seconds
+        governor.update()
+
+
+def test_slow_frames_lower_rendering_first():
+    governor, clock, _ = make_governor()
+    run_frames(governor, clock, COOLDOWN_FRAMES + 1, 0.04)
+    assert governor.render_rate == 75
+    assert governor.substeps == 4 and governor.state_refresh == 1.0
+
+    # Knobs stop at the bounds set by the user
+    run_frames(governor, clock, 200, 0.04)
+    assert governor.render_rate == governor.min_render_rate
+    assert governor.state_refresh == governor.min_state_refresh
+    assert governor.substeps == 1
+
+    # Fast frames raise the simulation knobs back first
+    run_frames(governor, clock, 40, 0.005)
+    assert governor.substeps == 4
+    assert governor.render_rate < 100
+    run_frames(governor, clock, 200, 0.005)
+    assert (governor.render_rate, governor.substeps, governor.state_refresh) == (
+        100,
+        4,
+        1.0,
+    )
+
+
+def test_stage_timings_choose_the_knob():
+    governor, clock, _ = make_governor(Profiler(enabled=True, sync=False))
+    stages = {"compute_states": 0.03, "update_colors": 0.005, "window.show": 0.002}
+    run_frames(governor, clock, COOLDOWN_FRAMES + 1, 0.04, stages)
+    assert governor.state_refresh == 0.5
+    assert governor.render_rate == 100
+
+    # Updates of the incremental grid and draining of transitions are simulation work
+    governor.reset()
+    governor.update()
+    stages = {"update_grid": 0.02, "transitions": 0.01, "update_colors": 0.005}
+    run_frames(governor, clock, COOLDOWN_FRAMES + 1, 0.04, stages)
+    assert governor.state_refresh == 0.5 and governor.render_rate == 100
+
+    # Waiting in window.show is not counted as work
+    governor.reset()
+    governor.update()
+    run_frames(governor, clock, 100, 0.04, {"window.show": 0.03})
+    assert governor.render_rate == 100 and governor.state_refresh == 1.0
+
+
+def test_user_bounds_are_kept():
+    governor, clock, _ = make_governor()
+    governor.max_render_rate = 40
+    governor.max_substeps = 2
+    run_frames(governor, clock, 1, 0.02)
+    assert governor.render_rate == 40 and governor.substeps == 2
+
+
+def test_host_time_of_steps_chooses_the_knob():
+    # Without the profiler, the host time of the steps tells that simulation takes the frame
+    governor, clock, profiler = make_governor()
+    for _ in range(COOLDOWN_FRAMES + 1):
+        clock.now += 0.04
+        governor.update(simulation_seconds=0.03)
+    assert not profiler.enabled
+    assert governor.state_refresh == 0.5 and governor.render_rate == 100
+
+
+def test_unavailable_state_refresh_is_skipped():
+    # Symmetric pairs update all cats, so substeps are lowered at once when simulation takes the frame
+    governor, clock, _ = make_governor()
+    governor.state_refresh_available = False
+    for _ in range(COOLDOWN_FRAMES + 1):
+        clock.now += 0.04
+        governor.update(simulation_seconds=0.03)
+    assert governor.substeps == 3 and governor.state_refresh == 1.0
@@ -1,8 +1,27 @@
+import numpy as np
 import pytest
 import taichi as ti
 
-from catradar.common import STATE_INTERSECTION, STATE_IDLE, TESTING_MODE, STATE_INTERACT
-from catradar.grid_manager import _calc_dist, setup_grid_data, compute_states
+from catradar import grid_manager, transitions
+from catradar.common import (
+    GRID_DENSE,
+    GRID_HASHED,
+    GRID_SPARSE,
+    STATE_INTERSECTION,
+    STATE_IDLE,
+    TESTING_MODE,
+    STATE_INTERACT,
+    WATCH_ALL,
+    WATCH_NONE,
+    WATCH_SET,
+)
+from catradar.grid_manager import (
+    _calc_dist,
+    compute_states,
+    compute_states_symmetric,
+    hash_collision_stats,
+    setup_grid_data,
+)
 from catradar.positions_updater import setup_positions_data, initialize_positions
 
 
@@ -32,40 +51,61 @@ def naive_algo(
 
 
 LIM = 100
-INTR = 10
 THRESHOLD = 0.01
 
+STORAGES = pytest.mark.parametrize(
+    "storage",
+    [GRID_DENSE, GRID_SPARSE, GRID_HASHED],
+    ids=["dense", "sparse", "hashed"],
+)
+
+
+@ti.kernel
+def copy_field(src: ti.template(), dst: ti.template()):
+    for i in dst:
+        dst[i] = src[i]
+
+
+def sparse_to_numpy(field, n: int) -> np.ndarray:
+    # `to_numpy` of fields under pointer SNodes may return wrong values, so they are copied by a kernel
+    dense = ti.field(ti.i32, shape=n)
+    copy_field(field, dense)
+    return dense.to_numpy()
+
+
+def hash_cells(cells: np.ndarray, table_size: int) -> np.ndarray:
+    # Same hash as `grid_manager._cell_key`
+    x = cells[:, 0].astype(np.uint32) * np.uint32(73856093)
+    y = cells[:, 1].astype(np.uint32) * np.uint32(19349663)
+    return ((x ^ y) & np.uint32(table_size - 1)).astype(np.int64)
+
+
+SLOW = pytest.mark.slow
+
+
+def count_wrong(expected, actual, N: int) -> int:
+    return int(np.count_nonzero(expected.to_numpy()[:N] != actual.to_numpy()[:N]))
+
 
 @pytest.mark.parametrize(
-    "N,X,Y,R0,R1,LIMIT_PER_CELL,INTERSECTION_NUM,update_intersections",
+    "N,X,Y,R0,R1,LIMIT_PER_CELL",
     [
-        pytest.param(20, 100, 100, 1, 10, LIM, INTR, True),  # small grid, few cats
-        pytest.param(20, 100, 100, 5, 15, LIM, INTR, True),  # small grid, few cats
-        pytest.param(500, 100, 100, 5, 20, LIM, INTR, True),  # small grid, many cats
-        pytest.param(500, 1000, 1000, 1, 10, LIM, INTR, True),  # small grid, many cats
-        pytest.param(500, 1000, 1000, 5, 20, LIM, INTR, True),  # small grid, many cats
-        pytest.param(500, 1000, 1000, 10, 50, LIM, INTR, True),  # normal grid
-        pytest.param(
-            10000, 1000, 1000, 5, 20, LIM, INTR, True
-        ),  # normal grid, many cats
-        pytest.param(
-            10000, 10000, 10000, 25, 50, LIM, INTR, True
-        ),  # big grid, many cats
-        pytest.param(
-            10000, 4000, 7000, 5, 20, LIM, INTR, False
-        ),  # regular grid with false as update_intersections, different X and Y
-        pytest.param(
-            10000, 6000, 3000, 5, 20, LIM, INTR, False
-        ),  # regular grid with false as update_intersections, different X and Y
-        pytest.param(
-            100000, 1000, 1000, 5, 20, LIM, INTR, True
-        ),  # A lot of cats, small grid
-        pytest.param(
-            100000, 10000, 10000, 1, 10, LIM, INTR, True
-        ),  # A lot of cats, big grid
-        pytest.param(
-            100000, 10000, 10000, 10, 50, LIM, INTR, True
-        ),  # A lot of cats, big grid
+        pytest.param(20, 100, 100, 1, 10, LIM),  # small grid, few cats
+        pytest.param(20, 100, 100, 5, 15, LIM),  # small grid, few cats
+        pytest.param(500, 100, 100, 5, 20, LIM),  # small grid, many cats
+        pytest.param(500, 1000, 1000, 1, 10, LIM),  # small grid, many cats
+        pytest.param(500, 1000, 1000, 5, 20, LIM),  # small grid, many cats
+        pytest.param(500, 1000, 1000, 10, 50, LIM),  # normal grid
+        pytest.param(10000, 1000, 1000, 5, 20, LIM),  # normal grid, many cats
+        pytest.param(10000, 10000, 10000, 25, 50, LIM),  # big grid, many cats
+        pytest.param(10000, 4000, 7000, 5, 20, LIM),  # regular grid, different X and Y
+        pytest.param(10000, 6000, 3000, 5, 20, LIM),  # regular grid, different X and Y
+        # A lot of cats, small grid
+        pytest.param(100000, 1000, 1000, 5, 20, LIM, marks=SLOW),
+        # A lot of cats, big grid
+        pytest.param(100000, 10000, 10000, 1, 10, LIM, marks=SLOW),
+        # A lot of cats, big grid
+        pytest.param(100000, 10000, 10000, 10, 50, LIM, marks=SLOW),
     ],
 )
 def test_compute_states(
@@ -75,8 +115,6 @@ def test_compute_states(
     R0: ti.f32,
     R1: ti.f32,
     LIMIT_PER_CELL: ti.i32,
-    INTERSECTION_NUM: ti.i32,
-    update_intersections: bool,
 ):
     assert R0 <= R1
     positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
@@ -84,31 +122,368 @@ def test_compute_states(
     states_actual = ti.field(dtype=ti.i32, shape=N)
 
     setup_positions_data(X, Y, N)
-    setup_grid_data(X, Y, N, R0, R1, LIMIT_PER_CELL, INTERSECTION_NUM, TESTING_MODE)
-
-    intersections_mock = ti.field(
-        dtype=ti.i32,
-        shape=(N, INTERSECTION_NUM + 1),
-    )
-    logged_id_mock = 0
+    setup_grid_data(X, Y, N, R0, R1, LIMIT_PER_CELL, TESTING_MODE)
 
     wrong_count = 0
     for init_opt in range(2):
         initialize_positions(positions, init_opt)
         for norm_func in range(3):
             naive_algo(N, R0, R1, positions, states_expected, norm_func)
+            compute_states(positions, states_actual, norm_func)
 
-            compute_states(
-                positions,
-                states_actual,
-                intersections_mock,
-                update_intersections,
-                norm_func,
-                logged_id_mock,
-            )
+            wrong_count += count_wrong(states_expected, states_actual, N)
+            assert wrong_count <= int(THRESHOLD * N)
 
-            for i in range(N):
-                if states_expected[i] != states_actual[i]:
-                    wrong_count += 1
 
-            assert wrong_count <= int(THRESHOLD * N)
+@STORAGES
+@pytest.mark.parametrize(
+    "compute",
+    [compute_states, compute_states_symmetric],
+    ids=["grid", "symmetric"],
+)
+@pytest.mark.parametrize(
+    "N,X,Y,R0,R1",
+    [
+        pytest.param(500, 100, 100, 5, 20),  # small grid, many cats
+        pytest.param(10000, 4000, 7000, 5, 20),  # regular grid, different X and Y
+    ],
+)
+def test_compute_states_storages(
+    N: ti.i32,
+    X: ti.f32,
+    Y: ti.f32,
+    R0: ti.f32,
+    R1: ti.f32,
+    compute,
+    storage: ti.i32,
+):
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, storage)
+
+    for init_opt in range(2):
+        initialize_positions(positions, init_opt)
+        for norm_func in range(3):
+            naive_algo(N, R0, R1, positions, states_expected, norm_func)
+            compute(positions, states_actual, norm_func)
+
+            assert count_wrong(states_expected, states_actual, N) <= int(THRESHOLD * N)
+
+
+@STORAGES
+@pytest.mark.parametrize(
+    "N,X,Y,R1",
+    [
+        pytest.param(500, 100, 100, 10),  # single scan block
+        pytest.param(5000, 5000, 3000, 10),  # many scan blocks
+    ],
+)
+def test_grid_cells(N: ti.i32, X: ti.f32, Y: ti.f32, R1: ti.f32, storage: ti.i32):
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states = ti.field(dtype=ti.i32, shape=N)
+
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, 1, R1, LIM, TESTING_MODE, storage)
+    initialize_positions(positions, 0)
+    compute_states(positions, states, 0)
+
+    cells = np.floor(positions.to_numpy()[:N] / R1).astype(np.int32)
+    linear = cells[:, 0] * grid_manager.cell_count_y + cells[:, 1]
+    if storage == GRID_HASHED:
+        linear = hash_cells(cells, grid_manager.table_size)
+    counts = np.bincount(linear, minlength=grid_manager.table_size)
+    expected_start = np.concatenate(([0], np.cumsum(counts)))
+
+    # Fields of the grid are pooled and may be larger than needed
+    if storage != GRID_SPARSE:
+        cell_start = grid_manager.cell_start.to_numpy()[: grid_manager.table_size + 1]
+        np.testing.assert_array_equal(cell_start, expected_start)
+    else:
+        occupied = counts > 0
+        begin = sparse_to_numpy(grid_manager.cell_begin, grid_manager.cell_count)
+        end = sparse_to_numpy(grid_manager.cell_end, grid_manager.cell_count)
+        np.testing.assert_array_equal(begin[occupied], expected_start[:-1][occupied])
+        np.testing.assert_array_equal(end[occupied], expected_start[1:][occupied])
+    ids = grid_manager.circles_id.to_numpy()[:N]
+    assert sorted(ids) == list(range(N))
+    np.testing.assert_array_equal(linear[ids], np.sort(linear))
+
+
+@STORAGES
+@pytest.mark.parametrize("norm_func", [0, 1, 2])
+def test_compute_states_dense_cells(norm_func: ti.i32, storage: ti.i32):
+    # Each cell holds a dense cluster in one corner and pairs of intersecting cats in another,
+    # so cats of pairs are found only if no neighbours are dropped in dense cells
+    X, Y, R0, R1 = 50, 50, 1, 10
+    cells, cluster_size, pairs = 5, 500, 10
+    rng = np.random.default_rng(0)
+    points = []
+    for cx in range(cells):
+        for cy in range(cells):
+            origin = np.array([cx, cy]) * R1
+            points.append(origin + 0.5 + rng.random((cluster_size, 2)) * 0.4)
+            first = origin + 5 + rng.random((pairs, 2)) * 4.5
+            points.append(first)
+            points.append(first + [0.5, 0])
+    points = rng.permutation(np.concatenate(points)).astype(np.float32)
+    N = len(points)
+
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, storage)
+    positions.from_numpy(points)
+
+    naive_algo(N, R0, R1, positions, states_expected, norm_func)
+    compute_states(positions, states_actual, norm_func)
+
+    np.testing.assert_array_equal(states_actual.to_numpy(), states_expected.to_numpy())
+
+
+def test_sparse_grid_frees_blocks():
+    # A small cluster crosses a large field, only blocks under the cluster must stay allocated
+    N, X, Y, R0, R1 = 200, 20000, 20000, 5, 10
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, GRID_SPARSE)
+
+    rng = np.random.default_rng(0)
+    sparse_fields = grid_manager._sparse_fields
+    for center in [(100, 100), (10000, 5000), (19900, 19900)]:
+        points = np.array(center) + rng.random((N, 2)) * 50
+        positions.from_numpy(points.astype(np.float32))
+        compute_states(positions, states, 0)
+
+        linear = (points[:, 0] // R1).astype(int) * grid_manager.cell_count_y + (
+            points[:, 1] // R1
+        ).astype(int)
+        blocks = np.unique(linear // grid_manager.SPARSE_BLOCK_SIZE)
+        assert sparse_fields.active_blocks() == len(blocks)
+
+    dense_bytes = 3 * 4 * grid_manager.cell_count
+    assert sparse_fields.allocated_bytes() < dense_bytes / 10
+
+
+def test_hashed_grid_size_and_collisions():
+    # The table of the hashed grid depends only on N, so a huge field takes as much memory as a small one
+    N, R0, R1 = 2000, 1, 10
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+
+    sizes = []
+    for side in [1000, 25000, 1_000_000]:
+        setup_positions_data(side, side, N)
+        setup_grid_data(side, side, N, R0, R1, LIM, TESTING_MODE, GRID_HASHED)
+        sizes.append(grid_manager.table_size)
+        initialize_positions(positions, 0)
+        compute_states(positions, states_actual, 0)
+        naive_algo(N, R0, R1, positions, states_expected, 0)
+        np.testing.assert_array_equal(
+            states_actual.to_numpy(), states_expected.to_numpy()
+        )
+
+        stats = hash_collision_stats(positions)
+        cells = np.floor(positions.to_numpy()[:N] / R1).astype(np.int32)
+        unique_cells = np.unique(cells, axis=0)
+        assert stats["occupied_cells"] == len(unique_cells)
+        assert stats["occupied_buckets"] == len(
+            np.unique(hash_cells(unique_cells, stats["table_size"]))
+        )
+        assert 0 <= stats["foreign_share"] < 1
+
+    assert sizes[0] == sizes[1] == sizes[2] >= 2 * N
+
+
+@pytest.mark.parametrize(
+    "compute",
+    [compute_states, compute_states_symmetric],
+    ids=["grid", "symmetric"],
+)
+def test_hashed_grid_outside_field(compute):
+    # Cells of the hashed grid are not limited to the field, cats outside [0, X] x [0, Y] are found as well
+    N, X, Y, R0, R1 = 1000, 100, 100, 5, 20
+    rng = np.random.default_rng(2)
+    points = (rng.random((N, 2)) * 1000 - 500).astype(np.float32)
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, GRID_HASHED)
+    positions.from_numpy(points)
+    compute(positions, states_actual, 0)
+    naive_algo(N, R0, R1, positions, states_expected, 0)
+    np.testing.assert_array_equal(states_actual.to_numpy(), states_expected.to_numpy())
+    assert (states_expected.to_numpy() != STATE_IDLE).any()
+    assert hash_collision_stats(positions)["occupied_cells"] == len(
+        np.unique(np.floor(points / R1), axis=0)
+    )
+
+
+@pytest.mark.parametrize(
+    "compute",
+    [compute_states, compute_states_symmetric],
+    ids=["grid", "symmetric"],
+)
+def test_watch_variants(compute):
+    # Variants with and without watching compute the same states, only the first ones record transitions
+    N, X, Y, R0, R1 = 500, 100, 100, 5, 20
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_plain = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE)
+    transitions.setup_transitions_data(N, N)
+    initialize_positions(positions, 0)
+
+    compute(positions, states_plain, 0, WATCH_NONE)
+    assert len(transitions.drain()[0]) == 0
+    expected = states_plain.to_numpy()
+    changed = np.flatnonzero(expected != STATE_IDLE)
+
+    watched = np.concatenate((changed[::3], [0, N - 1]))
+    transitions.set_watched(watched)
+    for watch, cats in [
+        (WATCH_SET, np.intersect1d(watched, changed)),
+        (WATCH_ALL, changed),
+    ]:
+        states = ti.field(dtype=ti.i32, shape=N)
+        compute(positions, states, 0, watch)
+        np.testing.assert_array_equal(states.to_numpy(), expected)
+
+        records, dropped = transitions.drain()
+        assert dropped == 0
+        records = records[np.argsort(records[:, transitions.EVENT_CAT])]
+        np.testing.assert_array_equal(records[:, transitions.EVENT_CAT], cats)
+        assert (records[:, transitions.EVENT_PREV] == STATE_IDLE).all()
+        np.testing.assert_array_equal(records[:, transitions.EVENT_NEW], expected[cats])
+        assert (records[:, transitions.EVENT_CAUSE] >= 0).all()
+
+
+def check_slotted_grid(points: np.ndarray, R1: float, storage: ti.i32):
+    # Each circle is once among the circles of its cell, free slots of cells hold -1
+    cells = np.floor(points / R1).astype(np.int32)
+    table_size = grid_manager.table_size
+    linear = cells[:, 0] * grid_manager.cell_count_y + cells[:, 1]
+    if storage == GRID_HASHED:
+        linear = hash_cells(cells, table_size)
+    start = grid_manager.cell_start.to_numpy()[: table_size + 1]
+    fill = grid_manager.circles_per_cell.to_numpy()[:table_size]
+    np.testing.assert_array_equal(fill, np.bincount(linear, minlength=table_size))
+    assert start[-1] <= grid_manager.slot_count
+
+    ids = grid_manager.circles_id.to_numpy()[: start[-1]]
+    owner = np.repeat(np.arange(table_size), np.diff(start))
+    used = np.arange(start[-1]) - start[owner] < fill[owner]
+    np.testing.assert_array_equal(np.sort(ids[used]), np.arange(len(points)))
+    np.testing.assert_array_equal(linear[ids[used]], owner[used])
+    assert (ids[~used] == -1).all()
+
+
+@pytest.mark.parametrize("storage", [GRID_DENSE, GRID_HASHED], ids=["dense", "hashed"])
+@pytest.mark.parametrize(
+    "compute",
+    [compute_states, compute_states_symmetric],
+    ids=["grid", "symmetric"],
+)
+def test_incremental_grid(compute, storage: ti.i32):
+    N, X, Y, R0, R1 = 3000, 200, 200, 2, 10
+    rng = np.random.default_rng(0)
+    points = (rng.random((N, 2)) * [X, Y]).astype(np.float32)
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, storage, incremental=True)
+    positions.from_numpy(points)
+    assert grid_manager.update_grid(positions)  # Cells of circles are not known yet
+
+    for _ in range(5):
+        # Small steps move a few circles to neighbour cells
+        points = np.clip(points + rng.normal(0, 0.02, points.shape), 0, X - 0.01)
+        points = points.astype(np.float32)
+        positions.from_numpy(points)
+        assert not grid_manager.update_grid(positions)
+        assert 0 < grid_manager.mover_share < grid_manager.MAX_MOVER_SHARE
+        check_slotted_grid(points, R1, storage)
+
+        compute(positions, states_actual, 0, rebuild_grid=False)
+        naive_algo(N, R0, R1, positions, states_expected, 0)
+        np.testing.assert_array_equal(
+            states_actual.to_numpy(), states_expected.to_numpy()
+        )
+
+    # Circles gathering in one cell do not fit into its free slots
+    points[:20] = [55, 55]
+    positions.from_numpy(points)
+    assert grid_manager.update_grid(positions)
+    check_slotted_grid(points, R1, storage)
+
+    # Most circles moving to other cells rebuild the grid
+    points = rng.permutation(points)
+    positions.from_numpy(points)
+    assert grid_manager.update_grid(positions)
+    assert grid_manager.mover_share > grid_manager.MAX_MOVER_SHARE
+    check_slotted_grid(points, R1, storage)
+
+
+def test_incremental_grid_sparse_field():
+    # Free slots of a large field with few circles take memory for circles, not for cells
+    N, X, Y, R0, R1 = 500, 25000, 25000, 2, 10
+    rng = np.random.default_rng(1)
+    points = (rng.random((N, 2)) * [X, Y]).astype(np.float32)
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, GRID_DENSE, incremental=True)
+    assert grid_manager.table_size > 1000 * N
+    assert grid_manager.slot_count <= 10 * N
+    positions.from_numpy(points)
+    assert grid_manager.update_grid(positions)
+    check_slotted_grid(points, R1, GRID_DENSE)
+
+    # A circle coming into an occupied cell takes a free slot, into an empty cell it rebuilds the grid
+    cell = np.floor(points[0] / R1)
+    points[1] = (cell + 0.5) * R1
+    positions.from_numpy(points)
+    assert not grid_manager.update_grid(positions)
+    check_slotted_grid(points, R1, GRID_DENSE)
+    points[1] = [X - 1, Y - 1]
+    positions.from_numpy(points)
+    assert grid_manager.update_grid(positions)
+    check_slotted_grid(points, R1, GRID_DENSE)
+
+
+def clustered_points(N: int, cluster: int, X: float, R1: float) -> np.ndarray:
+    # `cluster` cats in the cell (1, 1), more than LIM, the rest spread over the field
+    rng = np.random.default_rng(3)
+    points = rng.random((N, 2)) * X
+    points[:cluster] = R1 + rng.random((cluster, 2)) * R1
+    return points.astype(np.float32)
+
+
+def test_symmetric_dense_cell():
+    # Symmetric pairs visit all cats of a cell holding more than LIMIT_PER_CELL cats unless capped
+    N, X, Y, R0, R1 = 600, 100, 100, 1, 10
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE, GRID_DENSE)
+    positions.from_numpy(clustered_points(N, 4 * LIM, X, R1))
+    for norm_func in range(3):
+        naive_algo(N, R0, R1, positions, states_expected, norm_func)
+        compute_states_symmetric(positions, states_actual, norm_func)
+        np.testing.assert_array_equal(
+            states_actual.to_numpy(), states_expected.to_numpy()
+        )
+
+    # A cap drops cats of the cell beyond it
+    assert grid_manager.set_neighbor_cap(1)
+    compute_states_symmetric(positions, states_actual, 0)
+    naive_algo(N, R0, R1, positions, states_expected, 0)
+    assert (states_actual.to_numpy() != states_expected.to_numpy()).any()
+    assert grid_manager.set_neighbor_cap(0)
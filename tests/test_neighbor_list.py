@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from catradar import neighbor_list
+from catradar.common import TESTING_MODE
+from catradar.grid_manager import setup_grid_data
+from catradar.positions_updater import (
+    initialize_positions,
+    setup_positions_data,
+    update_pos_on_velocity,
+)
+from test_grid_manager import LIM, THRESHOLD, clustered_points, naive_algo
+
+
+@pytest.mark.parametrize(
+    "N,X,Y,R0,R1,skin",
+    [
+        pytest.param(500, 100, 100, 5, 20, 2),  # small grid, many cats
+        pytest.param(2000, 1000, 1000, 5, 20, 4),  # normal grid
+        pytest.param(5000, 3000, 1000, 1, 10, 25),  # skin larger than a cell
+    ],
+)
+def test_neighbor_list(
+    N: ti.i32, X: ti.f32, Y: ti.f32, R0: ti.f32, R1: ti.f32, skin: ti.f32
+):
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE)
+    neighbor_list.setup_neighbor_list_data(N)
+    neighbor_list.set_skin(skin)
+    initialize_positions(positions, 0)
+
+    for norm_func in range(3):
+        for _ in range(5):
+            update_pos_on_velocity(positions, 1, 1 / 60)
+            naive_algo(N, R0, R1, positions, states_expected, norm_func)
+            neighbor_list.compute_states_with_neighbor_list(
+                positions, states_actual, norm_func
+            )
+
+            wrong_count = (states_expected.to_numpy() != states_actual.to_numpy()).sum()
+            assert wrong_count <= int(THRESHOLD * N)
+            assert neighbor_list.max_displacement[None] <= skin / 2
+
+    # Lists are reused between steps, but rebuilt when cats move far enough
+    assert 1 <= neighbor_list.rebuilds < 15
+
+
+def test_neighbor_list_dense_cell():
+    # Candidates are collected from all cats of a cell holding more than LIMIT_PER_CELL cats
+    N, X, Y, R0, R1 = 600, 100, 100, 1, 10
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    states_expected = ti.field(dtype=ti.i32, shape=N)
+    states_actual = ti.field(dtype=ti.i32, shape=N)
+    setup_positions_data(X, Y, N)
+    setup_grid_data(X, Y, N, R0, R1, LIM, TESTING_MODE)
+    neighbor_list.setup_neighbor_list_data(N)
+    neighbor_list.set_skin(2)
+    positions.from_numpy(clustered_points(N, 4 * LIM, X, R1))
+    for norm_func in range(3):
+        naive_algo(N, R0, R1, positions, states_expected, norm_func)
+        neighbor_list.compute_states_with_neighbor_list(
+            positions, states_actual, norm_func
+        )
+        np.testing.assert_array_equal(
+            states_actual.to_numpy(), states_expected.to_numpy()
+        )
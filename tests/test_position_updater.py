@@ -1,7 +1,9 @@
+import numpy as np
 import pytest
 import taichi as ti
 
 from catradar import positions_updater
+from catradar.common import MOVE_PATTERN_CAROUSEL, MOVE_PATTERN_FREE
 
 X = 100
 Y = 100
@@ -52,3 +54,37 @@ def test_positions_updater(
     for i in range(N):
         res = ti.abs(positions[i] - expected_pos[i]) < EPS
         assert res[0] and res[1]
+
+
+@pytest.mark.parametrize("cursor_push_on", [0, 1])
+@pytest.mark.parametrize("opt", [MOVE_PATTERN_FREE, MOVE_PATTERN_CAROUSEL])
+def test_update_positions(opt: ti.i32, cursor_push_on: ti.i8):
+    N = 50
+    positions_updater.setup_positions_data(X, Y, N)
+    positions = ti.Vector.field(2, dtype=ti.f32, shape=N)
+    contact_ids_mock = ti.field(dtype=ti.i32, shape=N)
+    positions_updater.initialize_positions(positions, 0)
+    cursor_pos = ti.math.vec2(50, 50)
+
+    pos = positions.to_numpy()[:N].astype(np.float64)
+    vel = positions_updater.velocities.to_numpy()[:N].astype(np.float64)
+    if opt == MOVE_PATTERN_CAROUSEL:
+        angles = positions_updater.p1_angles.to_numpy()[:N] + 0.05
+        angles = np.where(angles >= 2 * np.pi, angles - 2 * np.pi, angles)
+        speeds = positions_updater.p1_speeds.to_numpy()[:N]
+        vel = np.stack([np.cos(angles), np.sin(angles)], axis=1) * speeds[:, None]
+    if cursor_push_on:
+        to_self = pos - np.array([50, 50])
+        dist = np.linalg.norm(to_self, axis=1, keepdims=True)
+        vel += np.where(dist < 100, to_self / dist**2 * 100, 0)
+    pos += 2 * vel * mock_dt * 60
+    vel = np.where((pos < 0) | (pos > [X, Y]), -vel, vel)
+    pos = np.clip(pos, 0, [X, Y])
+
+    positions_updater.update_positions(
+        positions, contact_ids_mock, cursor_pos, cursor_push_on, 2, opt, mock_dt
+    )
+    np.testing.assert_allclose(positions.to_numpy()[:N], pos, atol=1e-3)
+    np.testing.assert_allclose(
+        positions_updater.velocities.to_numpy()[:N], vel, atol=1e-3
+    )
@@ -0,0 +1,60 @@
+import pytest
+
+from catradar.profiler import Profiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    with profiler.stage("compute_states"):
+        pass
+    assert profiler.trace(lambda: 42, "update_positions") == 42
+    assert profiler.stats() == {}
+
+
+def test_ring_buffer_keeps_last_samples():
+    profiler = Profiler(capacity=4, enabled=True, sync=False)
+    for i in range(10):
+        profiler.record("compute_states", float(i), (i + 1) / 1000)
+
+    stats = profiler.stats()["compute_states"]
+    assert stats["count"] == 4
+    assert stats["max"] == pytest.approx(10)
+    assert stats["p50"] == pytest.approx(8.5)
+
+    events = profiler.chrome_trace()["traceEvents"]
+    assert [e["dur"] for e in events] == pytest.approx([7000, 8000, 9000, 10000])
+
+
+@pytest.mark.parametrize("sync", [False, True])
+def test_stages(sync):
+    profiler = Profiler(enabled=True, sync=sync)
+    for _ in range(100):
+        with profiler.stage("update_positions"):
+            pass
+        profiler.trace(lambda: None, "compute_states")
+
+    stats = profiler.stats()
+    assert profiler.stages() == ["update_positions", "compute_states"]
+    for name in ("update_positions", "compute_states"):
+        s = stats[name]
+        assert s["count"] == 100
+        assert 0 <= s["p50"] <= s["p95"] <= s["p99"] <= s["max"]
+
+    report = profiler.report()
+    assert "update_positions" in report and "compute_states" in report
+
+    profiler.clear()
+    assert profiler.stats() == {}
+
+
+def test_totals_since():
+    profiler = Profiler(capacity=4, enabled=True, sync=False)
+    for i in range(6):
+        profiler.record("compute_states", float(i), 0.001)
+        profiler.record("update_colors", float(i), 0.002 * i)
+    totals = profiler.totals_since(3.0)
+    assert totals["compute_states"] == pytest.approx(0.003)
+    assert totals["update_colors"] == pytest.approx(0.002 * (3 + 4 + 5))
+    # Samples older than the ring buffer are not counted
+    assert profiler.totals_since(0.0)["compute_states"] == pytest.approx(0.004)
+    assert profiler.totals_since(6.0) == {}
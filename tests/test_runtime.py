@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def run_python(code: str) -> str:
+    # The runtime of the test process is already initialized, so each case starts a fresh interpreter.
+    # Cases check what `init` and import do, not the chosen backend, so they don't need a GPU
+    env = {**os.environ, "CATRADAR_ARCH": "cpu"}
+    return subprocess.check_output(
+        [sys.executable, "-c", code], text=True, env=env, stderr=subprocess.DEVNULL
+    ).strip()
+
+
+def test_import_does_not_initialize_runtime():
+    output = run_python(
+        "import sys\n"
+        "import catradar, catradar.common\n"
+        "from catradar import runtime\n"
+        "print(runtime.is_initialized(), 'catradar.simulation' in sys.modules)"
+    )
+    assert output.splitlines()[-1] == "False False"
+
+
+def test_init_before_simulation():
+    output = run_python(
+        "import catradar\n"
+        "catradar.init(arch='cpu', cpu_max_num_threads=2)\n"
+        "catradar.init(arch='cpu', cpu_max_num_threads=2)\n"
+        "from catradar.simulation import Simulation\n"
+        "from taichi.lang import impl\n"
+        "Simulation({'N': 100}).step(1)\n"
+        "print(impl.current_cfg().cpu_max_num_threads)"
+    )
+    assert output.splitlines()[-1] == "2"
+
+
+def test_init_after_import_with_other_args_fails():
+    output = run_python(
+        "import catradar\n"
+        "import catradar.simulation\n"
+        "try:\n"
+        "    catradar.init(arch='cpu', cpu_max_num_threads=3)\n"
+        "except RuntimeError:\n"
+        "    print('raised')"
+    )
+    assert output.splitlines()[-1] == "raised"
+
+
+def test_unknown_arch():
+    from catradar import runtime
+
+    with pytest.raises(ValueError):
+        runtime.init(arch="tpu")
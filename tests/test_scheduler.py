@@ -0,0 +1,60 @@
+import pytest
+
+from catradar.scheduler import FixedStepScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_scheduler(step_rate=50, max_substeps=4):
+    clock = FakeClock()
+    steps = []
+    scheduler = FixedStepScheduler(step_rate, max_substeps, clock=clock)
+    scheduler.advance(lambda n, dt: steps.append((n, dt)))
+    return scheduler, clock, steps
+
+
+def test_steps_have_fixed_dt():
+    scheduler, clock, steps = make_scheduler()
+    assert steps == []
+
+    # A slow frame makes several substeps of the same dt
+    clock.now += 0.065
+    assert scheduler.advance(lambda n, dt: steps.append((n, dt))) == 3
+    assert steps == [(3, pytest.approx(0.02))]
+    assert scheduler.alpha == pytest.approx(0.25)
+
+    # Fast frames make no step until a whole step is accumulated
+    for _ in range(2):
+        clock.now += 0.007
+        assert scheduler.advance(lambda n, dt: steps.append((n, dt))) == 0
+    clock.now += 0.007
+    assert scheduler.advance(lambda n, dt: steps.append((n, dt))) == 1
+    assert len(steps) == 2
+
+
+def test_substeps_are_limited():
+    scheduler, clock, steps = make_scheduler(max_substeps=2)
+    clock.now += 1.0
+    assert scheduler.advance(lambda n, dt: steps.append(n)) == 2
+    assert scheduler.dropped_seconds == pytest.approx(0.96)
+    assert scheduler.accumulator < scheduler.dt
+
+    scheduler.reset()
+    clock.now += 5.0
+    assert scheduler.advance(lambda n, dt: steps.append(n)) == 0
+
+
+def test_rates_are_measured_separately():
+    scheduler, clock, _ = make_scheduler(step_rate=30)
+    # 60 frames per second, every other frame makes a step
+    for _ in range(60):
+        clock.now += 1 / 60
+        scheduler.advance(lambda n, dt: None)
+    assert scheduler.frames_per_second == pytest.approx(60, rel=0.05)
+    assert scheduler.steps_per_second == pytest.approx(30, rel=0.1)
@@ -0,0 +1,251 @@
+import numpy as np
+import pytest
+import taichi as ti
+
+from catradar.common import (
+    LAYOUT_COMPACT,
+    LAYOUT_COMPACT_SOA,
+    LAYOUT_STANDARD,
+    MOVE_PATTERN_CAROUSEL,
+    MOVE_PATTERN_COLLIDING,
+    MOVE_PATTERN_FREE,
+    STATE_IDLE,
+    STATE_INTERACT,
+    STATE_INTERSECTION,
+    TESTING_MODE,
+)
+from catradar.simulation import Simulation
+
+
+@pytest.mark.parametrize(
+    "movement_pattern",
+    [MOVE_PATTERN_FREE, MOVE_PATTERN_CAROUSEL, MOVE_PATTERN_COLLIDING],
+)
+def test_simulation_step(movement_pattern):
+    sim = Simulation({"X": 200, "Y": 100, "N": 300, "R0": 5, "R1": 10})
+    sim.movement_pattern = movement_pattern
+    sim.step(5)
+    assert sim.steps_done == 5
+
+    states = sim.states_numpy()
+    assert states.shape == (300,)
+    assert ((states >= STATE_IDLE) & (states <= STATE_INTERSECTION)).all()
+
+    positions = sim.positions_numpy()
+    assert (positions[:, 0] >= 0).all() and (positions[:, 0] <= 200).all()
+    assert (positions[:, 1] >= 0).all() and (positions[:, 1] <= 100).all()
+
+
+def test_simulation_reset():
+    sim = Simulation({"N": 100})
+    sim.step(2)
+    sim.reset({"N": 200, "init_opt": 1})
+    assert sim.steps_done == 0
+    assert sim.states_numpy().shape == (200,)
+    assert sim.params["init_opt"] == 1
+
+    with pytest.raises(ValueError):
+        sim.reset({"unknown": 1})
+
+
+def test_reset_to_smaller_n_reuses_fields():
+    params = {"X": 200, "Y": 200, "N": 3000, "R0": 3, "R1": 8}
+    sim = Simulation(params, TESTING_MODE)
+    sim.step(2)
+    sim.reset({**params, "N": 500})
+    assert sim.states_numpy().shape == (500,)
+    assert sim.positions_numpy().shape == (500, 2)
+
+    # Stale data past N in the pooled fields must not affect states
+    sim.speed_mult = 0
+    sim.update_states()
+    positions = sim.positions_numpy()
+    dist = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+    np.fill_diagonal(dist, np.inf)
+    expected = np.where(
+        (dist <= 3).any(axis=1),
+        STATE_INTERSECTION,
+        np.where((dist <= 8).any(axis=1), STATE_INTERACT, STATE_IDLE),
+    )
+    assert (sim.states_numpy() != expected).sum() <= 0.01 * 500
+
+
+def test_reorder_keeps_ids_stable():
+    sim = Simulation({"X": 300, "Y": 300, "N": 2000, "R0": 5, "R1": 15}, TESTING_MODE)
+    sim.logged_id = 7
+    sim.step(3)
+    positions_before = sim.positions_numpy()
+    states_before = sim.states_numpy()
+
+    sim.reorder()
+    assert sim.reordered
+    np.testing.assert_array_equal(sim.positions_numpy(), positions_before)
+    np.testing.assert_array_equal(sim.states_numpy(), states_before)
+    assert (sim.positions.to_numpy()[sim.slot(7)] == positions_before[7]).all()
+
+    # Reordered data must produce the same states as the original order
+    sim.speed_mult = 0
+    sim.update_states()
+    np.testing.assert_array_equal(sim.states_numpy(), states_before)
+
+    sim.reorder_interval = 2
+    sim.speed_mult = 1
+    sim.step(4)
+    assert sim.states_numpy().shape == (2000,)
+
+
+@pytest.mark.parametrize("symmetric_pairs", [False, True])
+@pytest.mark.parametrize(
+    "layout",
+    [LAYOUT_STANDARD, LAYOUT_COMPACT, LAYOUT_COMPACT_SOA],
+    ids=["standard", "compact", "compact-soa"],
+)
+def test_layouts(layout, symmetric_pairs):
+    params = {"X": 200, "Y": 200, "N": 1500, "R0": 3, "R1": 8, "layout": layout}
+    sim = Simulation(params, TESTING_MODE)
+    sim.symmetric_pairs = symmetric_pairs
+    sim.movement_pattern = MOVE_PATTERN_COLLIDING
+    sim.step(3)
+    sim.reorder()
+    sim.step(2)
+    assert sim.states.dtype == (ti.i32 if layout == LAYOUT_STANDARD else ti.u8)
+
+    positions = sim.positions_numpy()
+    assert (positions >= 0).all() and (positions <= 200).all()
+    dist = np.linalg.norm(positions[:, None] - positions[None], axis=-1)
+    np.fill_diagonal(dist, np.inf)
+    expected = np.where(
+        (dist <= 3).any(axis=1),
+        STATE_INTERSECTION,
+        np.where((dist <= 8).any(axis=1), STATE_INTERACT, STATE_IDLE),
+    )
+    np.testing.assert_array_equal(sim.states_numpy(), expected)
+
+
+def test_warmup_keeps_soft_parameters():
+    sim = Simulation({"X": 200, "Y": 100, "N": 300, "R0": 5, "R1": 10})
+    sim.movement_pattern = MOVE_PATTERN_CAROUSEL
+    sim.norm_func = 1
+    sim.logged_id = -1
+    sim.step(2)
+
+    report = sim.warmup()
+    # 3 movement patterns with and without cursor push, 3 norms with 3 watch modes and 2 traversal variants
+    # and 3 norms with 2 builds of contacts
+    assert report["variants"] == 6 + 18 + 6
+    assert sim.movement_pattern == MOVE_PATTERN_CAROUSEL
+    assert sim.norm_func == 1
+    assert sim.logged_id == -1
+    assert len(sim.logs) == 0
+    assert sim.steps_done == 0
+
+    sim.step(3)
+    states = sim.states_numpy()
+    assert ((states >= STATE_IDLE) & (states <= STATE_INTERSECTION)).all()
+    positions = sim.positions_numpy()
+    assert (positions[:, 0] >= 0).all() and (positions[:, 0] <= 200).all()
+
+
+@pytest.mark.parametrize("neighbor_skin", [0, 3])
+def test_partial_state_refresh(neighbor_skin):
+    sim = Simulation({"X": 200, "Y": 200, "N": 1000, "R0": 5, "R1": 10}, TESTING_MODE)
+    sim.neighbor_skin = neighbor_skin
+    sim.step(3)
+    sim.move()
+    states_before = sim.states_numpy()
+
+    sim.state_refresh = 0.5
+    sim.update_states()
+    partial = sim.states_numpy()
+    sim.state_refresh = 1.0
+    sim.update_states()
+    full = sim.states_numpy()
+
+    refreshed = np.arange(sim.N) % 2 == sim.steps_done % 2
+    np.testing.assert_array_equal(partial[refreshed], full[refreshed])
+    np.testing.assert_array_equal(partial[~refreshed], states_before[~refreshed])
+    assert (full[~refreshed] != states_before[~refreshed]).any()
+
+
+@pytest.mark.parametrize("symmetric_pairs", [False, True])
+def test_incremental_grid(symmetric_pairs):
+    params = {"X": 300, "Y": 300, "N": 1000, "R0": 5, "R1": 10}
+    sim = Simulation({**params, "incremental_grid": True}, TESTING_MODE)
+    sim.symmetric_pairs = symmetric_pairs
+    sim.reorder_interval = 3
+    sim.speed_mult = 0.2
+    for _ in range(8):
+        rebuilds = sim.grid_rebuilds
+        sim.step()
+        # Cats are moved by small steps, so most of them stay in their cells
+        assert sim.grid_rebuilds > rebuilds or sim.mover_share < 0.05
+        np.testing.assert_array_equal(
+            sim.states_numpy(), brute_force_states(sim.positions_numpy(), params)
+        )
+    # The first step and each step after a reorder bin all cats
+    assert sim.grid_rebuilds == 3
+
+
+def brute_force_states(positions, params):
+    dist = np.linalg.norm(positions[:, None] - positions[None], axis=2)
+    np.fill_diagonal(dist, np.inf)
+    return np.where(
+        (dist <= params["R0"]).any(axis=1),
+        STATE_INTERSECTION,
+        np.where((dist <= params["R1"]).any(axis=1), STATE_INTERACT, STATE_IDLE),
+    )
+
+
+def test_resize_updates_grid_incrementally():
+    params = {"X": 300, "Y": 300, "N": 1000, "R0": 5, "R1": 10}
+    sim = Simulation({**params, "incremental_grid": True}, TESTING_MODE)
+    sim.step()
+    rebuilds = sim.grid_rebuilds
+
+    # The last 10 cats take slots of the first 10 ones
+    cats = sim.cats_numpy()
+    sim.write_cats(np.arange(10), {key: array[-10:] for key, array in cats.items()})
+    sim.resize(990)
+    sim.update_states()
+    assert sim.N == 990
+    np.testing.assert_array_equal(
+        sim.states_numpy(), brute_force_states(sim.positions_numpy(), params)
+    )
+
+    # Added cats take fields reserved by the previous N
+    sim.resize(1000)
+    sim.write_cats(
+        np.arange(990, 1000), {key: array[:10] for key, array in cats.items()}
+    )
+    sim.update_states()
+    np.testing.assert_array_equal(
+        sim.states_numpy(), brute_force_states(sim.positions_numpy(), params)
+    )
+    assert sim.grid_rebuilds == rebuilds
+
+    # Growing beyond allocated fields keeps data of cats
+    positions = sim.positions_numpy()
+    sim.resize(1500)
+    rng = np.random.default_rng(0)
+    new_cats = {
+        "positions": rng.random((500, 2)) * 300,
+        "velocities": np.zeros((500, 2)),
+        "angles": np.zeros(500),
+        "speeds": np.zeros(500),
+    }
+    sim.write_cats(np.arange(1000, 1500), new_cats)
+    sim.update_states()
+    assert np.array_equal(sim.positions_numpy()[:1000], positions)
+    np.testing.assert_array_equal(
+        sim.states_numpy(), brute_force_states(sim.positions_numpy(), params)
+    )
+
+
+def test_symmetric_pairs_ignore_state_refresh():
+    sim = Simulation({"N": 100})
+    assert sim.obeys_state_refresh
+    sim.symmetric_pairs = True
+    assert not sim.obeys_state_refresh
+    # Neighbour lists take over symmetric pairs and obey it
+    sim.neighbor_skin = 1.0
+    assert sim.obeys_state_refresh
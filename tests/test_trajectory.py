@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+from catradar.common import (
+    ENCODING_FLOAT32,
+    ENCODING_QUANTIZED,
+    MOVE_PATTERN_CAROUSEL,
+)
+from catradar.simulation import Simulation
+from catradar.trajectory import TrajectoryReader, TrajectoryRecorder
+
+
+@pytest.mark.parametrize("reorder_interval", [0, 3])
+@pytest.mark.parametrize("encoding", [ENCODING_FLOAT32, ENCODING_QUANTIZED])
+def test_record_and_replay(tmp_path, encoding, reorder_interval):
+    X, Y, N = 300, 200, 400
+    sim = Simulation({"X": X, "Y": Y, "N": N, "R0": 5, "R1": 10})
+    sim.movement_pattern = MOVE_PATTERN_CAROUSEL
+    sim.reorder_interval = reorder_interval
+    path = str(tmp_path / "run.cattraj")
+
+    expected = []
+    # Chunks of 3 frames, so the file grows several times
+    with TrajectoryRecorder(path, sim, 2, encoding, chunk_frames=3) as recorder:
+        for _ in range(15):
+            sim.step()
+            if recorder.record(sim):
+                expected.append(
+                    (sim.steps_done, sim.positions_numpy(), sim.states_numpy())
+                )
+
+    reader = TrajectoryReader(path)
+    assert len(reader) == len(expected) == 8
+    assert reader.params == {"X": X, "Y": Y, "N": N, "R0": 5, "R1": 10}
+    assert reader.movement_pattern == MOVE_PATTERN_CAROUSEL
+    assert reader.interval == 2
+
+    # Quantization error is at most half of a step of the fixed point grid
+    tolerance = 0 if encoding == ENCODING_FLOAT32 else max(X, Y) / 65535
+    # Frames are read in any order without reading the previous ones
+    for k in [5, 0, 7, 2]:
+        step, positions, states = expected[k]
+        assert reader.step(k) == step
+        frame_positions, frame_states = reader.frame(k)
+        np.testing.assert_allclose(frame_positions, positions, rtol=0, atol=tolerance)
+        np.testing.assert_array_equal(frame_states, states)
+
+        reader.load(k)
+        np.testing.assert_allclose(
+            reader.positions.to_numpy()[:N], positions, rtol=0, atol=tolerance
+        )
+        np.testing.assert_array_equal(reader.states.to_numpy()[:N], states)
+
+
+def test_interrupted_recording_is_readable(tmp_path):
+    sim = Simulation({"N": 100})
+    path = str(tmp_path / "run.cattraj")
+    recorder = TrajectoryRecorder(path, sim, chunk_frames=4)
+    for _ in range(6):
+        sim.step()
+        recorder.record(sim)
+    # Frames are in the memory map, the file is not closed
+    reader = TrajectoryReader(path)
+    assert len(reader) == 6
+    np.testing.assert_array_equal(reader.frame(5)[1], sim.states_numpy())
+    recorder.close()
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a trajectory")
+    with pytest.raises(ValueError):
+        TrajectoryReader(str(path))
+
+
+def test_steps_are_counted_in_batches(tmp_path):
+    sim = Simulation({"N": 100})
+    path = str(tmp_path / "run.cattraj")
+    with TrajectoryRecorder(path, sim, 4) as recorder:
+        written = []
+        # Batches of substeps are split at steps of frames
+        for batch in [3, 1, 6, 2, 5]:
+            while batch > 0:
+                k = min(batch, recorder.steps_to_next_frame())
+                sim.step(k)
+                batch -= k
+                if recorder.record(sim, k):
+                    written.append(sim.steps_done)
+    assert written == [1, 5, 9, 13, 17]
+    reader = TrajectoryReader(path)
+    assert [reader.step(k) for k in range(len(reader))] == written
+
+
+def test_changed_parameters_do_not_match(tmp_path):
+    params = {"X": 300, "Y": 200, "N": 100, "R0": 5, "R1": 10}
+    sim = Simulation(params)
+    recorder = TrajectoryRecorder(str(tmp_path / "run.cattraj"), sim)
+    assert recorder.matches(sim)
+    for key, value in [("X", 600), ("Y", 100), ("R0", 2), ("R1", 20), ("N", 50)]:
+        sim.reset({**params, key: value})
+        assert not recorder.matches(sim), key
+    sim.reset(params)
+    assert recorder.matches(sim)
+    sim.movement_pattern = MOVE_PATTERN_CAROUSEL
+    assert not recorder.matches(sim)
+    recorder.close()
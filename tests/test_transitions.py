@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from catradar import transitions
+from catradar.common import STATE_IDLE, STATE_INTERSECTION, TESTING_MODE
+from catradar.simulation import Simulation
+
+PARAMS = {"X": 300, "Y": 300, "N": 2000, "R0": 5, "R1": 15}
+
+
+def test_watch_mask_bits():
+    transitions.setup_transitions_data(100, 16)
+    transitions.set_watched(np.array([0, 31, 32, 99]))
+    mask = transitions.watch_mask.to_numpy()
+    assert mask[:4].tolist() == [1 | 1 << 31, 1, 0, 1 << 3]
+
+
+def expected_transitions(states_before, states_after):
+    changed = np.flatnonzero(states_before != states_after)
+    return changed, states_before[changed], states_after[changed]
+
+
+@pytest.mark.parametrize("reorder", [False, True])
+@pytest.mark.parametrize("symmetric_pairs", [False, True])
+def test_watch_all_matches_states(symmetric_pairs, reorder):
+    sim = Simulation(PARAMS, TESTING_MODE)
+    sim.symmetric_pairs = symmetric_pairs
+    sim.logged_id = 3
+    sim.watch_all()
+    sim.step(2)
+    if reorder:
+        sim.reorder()
+    sim.transitions_numpy()
+    logged = len(sim.logs)
+
+    for frame in range(2, 5):
+        states_before = sim.states_numpy()
+        sim.step()
+        events = sim.transitions_numpy()
+        assert (events["frame"] == frame).all()
+        events = events[np.argsort(events["cat_id"])]
+        cats, prev, new = expected_transitions(states_before, sim.states_numpy())
+        np.testing.assert_array_equal(events["cat_id"], cats)
+        np.testing.assert_array_equal(events["prev"], prev)
+        np.testing.assert_array_equal(events["new"], new)
+
+        # A cat changed to intersection by a cat within R0
+        positions = sim.positions_numpy()
+        hit = events[events["new"] == STATE_INTERSECTION]
+        dist = np.linalg.norm(
+            positions[hit["cat_id"]] - positions[hit["cause_id"]], axis=1
+        )
+        assert (dist <= PARAMS["R0"] + 1e-3).all()
+
+        logged += (events["cat_id"] == 3).sum()
+    assert sim.dropped_transitions == 0
+    # Transitions of the logged cat go to its log as well
+    assert len(sim.logs) == logged
+
+
+def test_watch_set():
+    sim = Simulation(PARAMS, TESTING_MODE)
+    watched = np.arange(0, PARAMS["N"], 7)
+    sim.watch(watched)
+    sim.step()
+    states_before = sim.states_numpy()
+    sim.step(3)
+
+    events = sim.transitions_numpy()
+    assert np.isin(events["cat_id"], watched).all()
+    assert (events["frame"][:-1] <= events["frame"][1:]).all()
+    first = events[events["frame"] == 1]
+    assert len(first) > 0 and (first["prev"] == states_before[first["cat_id"]]).all()
+    assert len(sim.transitions_numpy()) == 0
+
+    sim.unwatch()
+    sim.step()
+    assert len(sim.transitions_numpy()) == 0
+
+    with pytest.raises(ValueError):
+        sim.watch([PARAMS["N"]])
+
+
+def test_overflow_is_counted():
+    sim = Simulation(PARAMS, TESTING_MODE)
+    sim.watch_all(capacity=10)
+    assert (sim.states_numpy() == STATE_IDLE).all()
+    sim.step()
+    changed = (sim.states_numpy() != STATE_IDLE).sum()
+    assert len(sim.transitions_numpy()) == 10
+    assert sim.dropped_transitions == changed - 10
+
+
+def test_logs_are_drained_after_substeps():
+    sim = Simulation(PARAMS, TESTING_MODE)
+    sim.logged_id = 3
+    sim.watch_all()
+    sim.step(4)
+    events = sim.transitions_numpy()
+    assert len(events) > 0
+    np.testing.assert_array_equal(sim.logs.events(), events[events["cat_id"] == 3])